@@ -1 +1,10 @@
-from .cli import app  # re-export for python -m pmbok_gpt
+from typing import Any
+
+
+def __getattr__(name: str) -> Any:
+    # re-export for python -m pmbok_gpt。CLI（typer/rich）はライブラリとして使うときには読み込まない
+    if name == "app":
+        from .cli import app
+
+        return app
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
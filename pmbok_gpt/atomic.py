@@ -0,0 +1,48 @@
+from __future__ import annotations
+
+import os
+import stat
+import tempfile
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Iterator, Union
+
+
+@contextmanager
+def atomic_path(path: Union[str, Path]) -> Iterator[str]:
+    """path を置き換えるための一時ファイルのパスを渡す（ファイル名を受け取る書き出し用。openpyxl・pyarrow 等）。
+
+    ブロックが正常に終わると一時ファイルを fsync し、既存ファイルの権限（新規なら 0644）に合わせてから
+    os.replace で置き換えます。例外のときは一時ファイルを消し、既存のファイルはそのまま残ります。
+    """
+    path = Path(path)
+    # 置換が同じファイルシステム内で完結するよう、一時ファイルは出力先と同じディレクトリに作る
+    fd, tmp = tempfile.mkstemp(dir=str(path.parent), prefix=".", suffix=path.suffix + ".tmp")
+    os.close(fd)
+    try:
+        yield tmp
+        fd = os.open(tmp, os.O_RDONLY)
+        try:
+            os.fsync(fd)
+        finally:
+            os.close(fd)
+        # mkstemp は 0600 で作るため、既存ファイルの権限に合わせる
+        try:
+            mode = stat.S_IMODE(os.stat(path).st_mode)
+        except OSError:
+            mode = 0o644
+        os.chmod(tmp, mode)
+        os.replace(tmp, path)
+    except BaseException:
+        try:
+            os.unlink(tmp)
+        except OSError:
+            pass
+        raise
+
+
+def atomic_write(path: Union[str, Path], data: Union[str, bytes]) -> None:
+    """data（文字列は UTF-8）を path に書く。途中で止まっても書きかけのファイルは残らない。"""
+    with atomic_path(path) as tmp:
+        with open(tmp, "wb") as f:
+            f.write(data.encode("utf-8") if isinstance(data, str) else data)
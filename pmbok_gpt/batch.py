@@ -0,0 +1,276 @@
+from __future__ import annotations
+
+import json
+import time
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import asdict, dataclass, field
+from pathlib import Path
+from typing import Any, Callable, Dict, List, Optional, Sequence
+
+from .cache import model_settings
+from .config import AppSettings
+from .generator import generate_sectioned_document, generate_text_document
+from .journal import JobJournal
+from .providers import get_provider
+from .templates import BUILTIN_TEMPLATES, TemplateSet
+
+
+@dataclass
+class DocumentResult:
+    """1ドキュメント分の生成結果。"""
+
+    project: str
+    doc_type: str
+    out_path: str
+    elapsed: float
+    ok: bool
+    error: Optional[str] = None
+
+
+@dataclass
+class BatchReport:
+    """バッチ生成全体の結果とサマリ。"""
+
+    results: List[DocumentResult] = field(default_factory=list)
+    wall_clock: float = 0.0
+    # ジャーナルを付けて実行した場合のジョブID（resume で再開できる）
+    job_id: Optional[str] = None
+
+    @property
+    def failed(self) -> List[DocumentResult]:
+        return [r for r in self.results if not r.ok]
+
+    def summary(self) -> Dict[str, Any]:
+        elapsed = [r.elapsed for r in self.results]
+        total = sum(elapsed)
+        return {
+            "documents": len(self.results),
+            "succeeded": len(self.results) - len(self.failed),
+            "failed": len(self.failed),
+            "wall_clock_sec": round(self.wall_clock, 3),
+            "sum_of_calls_sec": round(total, 3),
+            "slowest_call_sec": round(max(elapsed), 3) if elapsed else 0.0,
+            # 逐次実行した場合と比べた短縮率の目安
+            "speedup": round(total / self.wall_clock, 2) if self.wall_clock > 0 else 0.0,
+        }
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {"job_id": self.job_id, "summary": self.summary(), "results": [asdict(r) for r in self.results]}
+
+
+def collect_project_files(path: Path) -> List[Path]:
+    """プロジェクトJSON（単一ファイル、またはディレクトリ直下の *.json）を列挙する。"""
+    path = Path(path)
+    if path.is_dir():
+        return sorted(p for p in path.glob("*.json") if p.is_file())
+    return [path]
+
+
+def resolve_doc_types(doc_types: Optional[Sequence[str]], templates: Optional[TemplateSet] = None) -> List[str]:
+    """未指定なら全テンプレート（templates 省略時は組み込み）。未知のキーは ValueError。"""
+    known = (templates or BUILTIN_TEMPLATES).templates
+    if not doc_types:
+        return list(known)
+    unknown = [d for d in doc_types if d not in known]
+    if unknown:
+        raise ValueError(f"Unknown doc_type: {', '.join(unknown)}")
+    return list(doc_types)
+
+
+def plan_outputs(
+    project_files: Sequence[Path],
+    doc_types: Sequence[str],
+    out_dir: Path,
+) -> List[Dict[str, Any]]:
+    """(project, doc_type, out_path) の一覧を作る。
+
+    プロジェクトが1件なら out_dir 直下に <doc_type>.txt、
+    複数なら out_dir/<プロジェクトファイル名>/<doc_type>.txt に出力します。
+    """
+    out_dir = Path(out_dir)
+    nested = len(project_files) > 1
+    tasks: List[Dict[str, Any]] = []
+    for pf in project_files:
+        base = out_dir / pf.stem if nested else out_dir
+        for doc_type in doc_types:
+            tasks.append({"project": str(pf), "doc_type": doc_type, "out_path": str(base / f"{doc_type}.txt")})
+    return tasks
+
+
+# resume 時に開始時の値へ戻せる設定（それ以外の provider / endpoint は一致しなければ再開しない）
+_RESTORABLE = ("model", "temperature", "max_tokens", "use_responses_api", "cache_enabled", "cache_bypass", "context_projection")
+
+
+def _job_settings(settings: AppSettings) -> Dict[str, Any]:
+    """ジャーナルに記録する、生成結果に影響する設定（モデル設定とキャッシュ・コンテキストの扱い）。"""
+    return {
+        **model_settings(settings),
+        "cache_enabled": settings.cache_enabled,
+        "cache_bypass": settings.cache_bypass,
+        "context_projection": settings.context_projection,
+    }
+
+
+def generate_documents(
+    project: Path,
+    out_dir: Path,
+    *,
+    doc_types: Optional[Sequence[str]] = None,
+    language: Optional[str] = None,
+    extra_instructions: Optional[str] = None,
+    settings: Optional[AppSettings] = None,
+    max_workers: int = 4,
+    sectioned: bool = False,
+    provider: Any = None,
+    journal: bool = False,
+) -> BatchReport:
+    """複数ドキュメントをスレッドプールで並行生成する。
+
+    プロバイダ（=HTTPクライアント）は1つだけ作成して全タスクで共有します。
+    壁時計時間は各呼び出しの合計ではなく、最も遅い呼び出しに近づきます。
+    sectioned=True のときは各ドキュメントをセクション単位でも並行生成します。
+    provider を渡すと、そのインスタンスを全タスクで使います（ベンチマーク等）。
+    journal=True のときは各タスクの完了をジャーナルに記録し、中断しても resume_documents で
+    残りだけを再開できます（ジョブIDは BatchReport.job_id）。
+    """
+    settings = settings or AppSettings()
+    files = collect_project_files(project)
+    if not files:
+        raise ValueError(f"プロジェクトJSONが見つかりません: {project}")
+    doc_types = resolve_doc_types(doc_types)
+    if journal:
+        # 別のカレントディレクトリから再開しても同じタスクを指すよう、絶対パスで記録する
+        files, out_dir = [f.resolve() for f in files], Path(out_dir).resolve()
+    tasks = plan_outputs(files, doc_types, out_dir)
+    log: Optional[JobJournal] = None
+    if journal:
+        params = {
+            "project": str(Path(project).resolve()),
+            "out_dir": str(out_dir),
+            "doc_types": doc_types,
+            "language": language,
+            "extra_instructions": extra_instructions,
+            "sectioned": sectioned,
+            "max_workers": max_workers,
+            "settings": _job_settings(settings),
+        }
+        log = JobJournal.create(settings, params, tasks)
+    report = run_tasks(
+        tasks,
+        load_contexts(files),
+        language=language,
+        extra_instructions=extra_instructions,
+        settings=settings,
+        max_workers=max_workers,
+        sectioned=sectioned,
+        provider=provider,
+        on_done=_journal_callback(log),
+    )
+    report.job_id = log.id if log else None
+    return report
+
+
+def _journal_callback(log: Optional[JobJournal]) -> Optional[Callable[[DocumentResult], None]]:
+    if log is None:
+        return None
+    return lambda r: log.record(r.project, r.doc_type, ok=r.ok, error=r.error, elapsed=r.elapsed)
+
+
+def resume_documents(
+    job_id: str,
+    *,
+    settings: Optional[AppSettings] = None,
+    max_workers: Optional[int] = None,
+    provider: Any = None,
+) -> BatchReport:
+    """ジャーナルに記録されたジョブのうち、未完了（失敗・未着手・出力が消えたもの）だけを実行する。
+
+    完了済みのドキュメントは LLM を呼ばずにそのまま残します。条件（言語・追加指示等）は開始時のもの。
+    モデル・出力上限・キャッシュ等の設定も開始時の値に戻し、戻せない設定（provider / endpoint）が
+    異なる場合は ValueError（途中から別のモデルで生成したドキュメントが混ざらないように）。
+    """
+    settings = settings or AppSettings()
+    log = JobJournal.open(job_id, settings)
+    state = log.state()
+    params = state.params
+    recorded = params.get("settings")
+    if recorded:
+        settings = settings.model_copy(update={k: recorded[k] for k in _RESTORABLE if k in recorded})
+        differ = [k for k, v in _job_settings(settings).items() if k in recorded and recorded[k] != v]
+        if differ:
+            raise ValueError(f"ジョブ開始時と設定が異なるため再開できません: {', '.join(differ)}（{job_id}）")
+    remaining = [{k: t[k] for k in ("project", "doc_type", "out_path")} for t in state.remaining()]
+    log.append({"event": "resume", "remaining": len(remaining)})
+    report = run_tasks(
+        remaining,
+        load_contexts([Path(p) for p in dict.fromkeys(t["project"] for t in remaining)]),
+        language=params.get("language"),
+        extra_instructions=params.get("extra_instructions"),
+        settings=settings,
+        max_workers=max_workers or int(params.get("max_workers") or 4),
+        sectioned=bool(params.get("sectioned")),
+        provider=provider,
+        on_done=_journal_callback(log),
+    )
+    report.job_id = log.id
+    return report
+
+
+def load_contexts(project_files: Sequence[Path]) -> Dict[str, Dict[str, Any]]:
+    """プロジェクトJSONを読み込む（キーは plan_outputs の "project" と同じパス文字列）。"""
+    return {str(pf): json.loads(Path(pf).read_text(encoding="utf-8")) for pf in project_files}
+
+
+def run_tasks(
+    tasks: Sequence[Dict[str, Any]],
+    contexts: Dict[str, Dict[str, Any]],
+    *,
+    language: Optional[str] = None,
+    extra_instructions: Optional[str] = None,
+    settings: Optional[AppSettings] = None,
+    max_workers: int = 4,
+    sectioned: bool = False,
+    provider: Any = None,
+    on_done: Optional[Callable[[DocumentResult], None]] = None,
+) -> BatchReport:
+    """plan_outputs の各タスクをスレッドプールで生成する。
+
+    on_done は各タスクの完了時にワーカースレッドから呼ばれます（進捗の記録用）。
+    """
+    settings = settings or AppSettings()
+    for t in tasks:
+        Path(t["out_path"]).parent.mkdir(parents=True, exist_ok=True)
+
+    # セクション単位生成はトークン予算が doc_type ごとに異なるため、プロバイダは各生成で用意する
+    # （HTTPクライアントは clients.py の共有プールから取得されるため接続は再利用される）
+    if provider is None and not sectioned and tasks:
+        provider = get_provider(settings)
+    generate = generate_sectioned_document if sectioned else generate_text_document
+
+    def _run(task: Dict[str, Any]) -> DocumentResult:
+        start = time.perf_counter()
+        try:
+            generate(
+                doc_type=task["doc_type"],
+                project_context=contexts[task["project"]],
+                out_path=task["out_path"],
+                language=language,
+                extra_instructions=extra_instructions,
+                settings=settings,
+                provider=provider,
+            )
+            result = DocumentResult(elapsed=time.perf_counter() - start, ok=True, **task)
+        except Exception as e:
+            result = DocumentResult(elapsed=time.perf_counter() - start, ok=False, error=str(e), **task)
+        if on_done is not None:
+            on_done(result)
+        return result
+
+    report = BatchReport()
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=max(1, max_workers)) as ex:
+        # 結果は入力順で受け取る（全体の待ち時間は最も遅いタスクで決まる）
+        futures = [ex.submit(_run, t) for t in tasks]
+        report.results = [fut.result() for fut in futures]
+    report.wall_clock = time.perf_counter() - start
+    return report
@@ -0,0 +1,482 @@
+from __future__ import annotations
+
+import asyncio
+import hashlib
+import json
+import random
+import tempfile
+import threading
+import time
+from dataclasses import asdict, dataclass, field
+from pathlib import Path
+from types import SimpleNamespace
+from typing import Any, Dict, Iterator, List, Optional, Sequence, Tuple
+
+from .batch import generate_documents, plan_outputs, resolve_doc_types
+from .config import AppSettings
+from .generator import agenerate_text_document
+from .metrics import percentile
+from .providers import OpenAIProvider, wrap_provider
+
+# モデル名の接頭辞ごとに、実 API が拒否するパラメータ（フォールバックの分岐を再現する）
+MODEL_REJECTIONS: Dict[str, Tuple[str, ...]] = {
+    "gpt-5": ("max_tokens", "temperature"),
+    "o1": ("max_tokens", "temperature", "response_format"),
+    "o3": ("max_tokens", "temperature"),
+    "o4": ("max_tokens", "temperature"),
+}
+
+# OpenAI API が返すエラー文言に合わせる（providers の判定はこの文言を見る）
+_REJECTION_MESSAGES: Dict[str, str] = {
+    "max_tokens": (
+        "Unsupported parameter: 'max_tokens' is not supported with this model. "
+        "Use 'max_completion_tokens' instead."
+    ),
+    "temperature": (
+        "Unsupported value: 'temperature' does not support {value} with this model. "
+        "Only the default (1) value is supported."
+    ),
+    "response_format": "Invalid parameter: 'response_format' is not supported with this model.",
+    "max_output_tokens": "Unsupported parameter: 'max_output_tokens' is not supported with this model.",
+}
+
+SCENARIOS: Tuple[str, ...] = ("serial", "concurrent", "async", "cached")
+
+
+def rejected_params(model: str, override: Optional[Sequence[str]] = None) -> Tuple[str, ...]:
+    """モデルが拒否するパラメータ名。override を渡すとそれを優先する。"""
+    if override is not None:
+        return tuple(override)
+    for prefix, params in MODEL_REJECTIONS.items():
+        if model.startswith(prefix):
+            return params
+    return ()
+
+
+def rejection_error(params: Dict[str, Any], rejected: Sequence[str]) -> Optional[str]:
+    """送信パラメータに拒否対象が含まれていれば、そのエラー文言を返す。"""
+    for name in _REJECTION_MESSAGES:
+        if name in rejected and name in params:
+            return _REJECTION_MESSAGES[name].format(value=params.get(name))
+    return None
+
+
+@dataclass
+class SimulationProfile:
+    """疑似 API の応答特性。
+
+    秒数は実 API 相当の値で指定し、time_scale を掛けた時間だけ実際に待ちます
+    （既定 0.01 = 100倍速。比率を保ったまま短時間で回せます）。
+    """
+
+    ttft: float = 0.6  # 最初のトークンまでの秒数
+    per_token: float = 0.02  # 出力1トークンあたりの秒数
+    output_tokens: int = 600
+    jitter: float = 0.25  # 対数正規の揺らぎ（σ）。大きいほど裾が重い
+    error_rate: float = 0.0  # 一時エラー（5xx）の発生率
+    rate_limit_rate: float = 0.0  # レート制限（429）の発生率
+    retry_after: float = 1.0  # 429 で返す待機秒数（time_scale を掛ける）
+    reject_params: Optional[Sequence[str]] = None  # None ならモデル名から決める
+    time_scale: float = 0.01
+    chunk_tokens: int = 16  # ストリーミング時の1チャンクのトークン数
+    # プロンプトキャッシュ: 以前と同じ先頭部分（128トークン単位）をキャッシュ済みとして数え、TTFT を短縮
+    prompt_cache_min_tokens: int = 1024  # これ未満のプロンプトはキャッシュしない（OpenAI と同じ）
+    cached_ttft_factor: float = 0.5  # 全量キャッシュ時の TTFT 倍率
+    seed: Optional[int] = 0
+
+
+class SimulatedAPIError(Exception):
+    """疑似 API が返すエラー（status_code 付き。429 は retry_after 秒も持つ）。"""
+
+    def __init__(self, message: str, status_code: int, *, retry_after: Optional[float] = None):
+        super().__init__(f"Error code: {status_code} - {message}")
+        self.message = message
+        self.status_code = status_code
+        self.retry_after = retry_after
+
+
+@dataclass
+class CallPlan:
+    """Simulator.plan が決めた1回分の応答（待ち時間・エラー・ストリームの分割・usage）。SDK フェイクと疑似サーバで共通。"""
+
+    delay: float
+    error: Optional[SimulatedAPIError] = None
+    chunks: List[Tuple[float, str]] = field(default_factory=list)
+    prompt_tokens: int = 0
+    cached_tokens: int = 0
+    completion_tokens: int = 0
+
+    @property
+    def text(self) -> str:
+        return "".join(t for _, t in self.chunks)
+
+
+class Simulator:
+    """応答内容と待ち時間を決める共有の状態（乱数・呼び出し数）。スレッドセーフ。"""
+
+    def __init__(self, profile: SimulationProfile):
+        self.profile = profile
+        self._rng = random.Random(profile.seed)
+        self._lock = threading.Lock()
+        self.calls = 0
+        self.rejections = 0
+        self.errors = 0
+        self.rate_limited = 0
+        self.prompt_tokens = 0
+        self.cached_tokens = 0
+        self._prefixes: set = set()
+
+    def _cached_tokens(self, text: str, prompt_tokens: int) -> int:
+        # 先頭から 128 トークン（≒384文字）単位で、過去に見た接頭辞と一致する長さを数える
+        block = 384
+        h = hashlib.sha1()
+        digests = []
+        for i in range(0, len(text) - len(text) % block, block):
+            h.update(text[i:i + block].encode("utf-8"))
+            digests.append(h.hexdigest())
+        with self._lock:
+            hit = 0
+            for d in digests:
+                if d not in self._prefixes:
+                    break
+                hit += 1
+            self._prefixes.update(digests)
+        if prompt_tokens < self.profile.prompt_cache_min_tokens:
+            return 0
+        return min(prompt_tokens, hit * block // 3)
+
+    def _factor(self) -> float:
+        with self._lock:
+            return self._rng.lognormvariate(0.0, self.profile.jitter) if self.profile.jitter > 0 else 1.0
+
+    def plan(self, params: Dict[str, Any]) -> CallPlan:
+        p = self.profile
+        prompt = params.get("messages") or params.get("input") or ""
+        if isinstance(prompt, str):
+            text = prompt
+        else:
+            text = "".join(f"{m.get('role', '')}:{m.get('content', '')}\n" for m in prompt)
+        prompt_tokens = max(1, len(text) // 3)
+        with self._lock:
+            self.calls += 1
+            draw = self._rng.random()
+        message = rejection_error(params, rejected_params(str(params.get("model", "")), p.reject_params))
+        if message is not None:
+            with self._lock:
+                self.rejections += 1
+            # パラメータ検証エラーは生成前に即座に返る
+            return CallPlan(0.05 * p.time_scale, SimulatedAPIError(message, 400), prompt_tokens=prompt_tokens)
+        if draw < p.rate_limit_rate:
+            with self._lock:
+                self.rate_limited += 1
+            retry_after = p.retry_after * p.time_scale
+            return CallPlan(
+                0.0,
+                SimulatedAPIError("Rate limit reached for requests", 429, retry_after=retry_after),
+            )
+        if draw < p.rate_limit_rate + p.error_rate:
+            with self._lock:
+                self.errors += 1
+            return CallPlan(p.ttft * p.time_scale * self._factor(), SimulatedAPIError("simulated server error", 500))
+
+        factor = self._factor()
+        cached = self._cached_tokens(text, prompt_tokens)
+        with self._lock:
+            self.prompt_tokens += prompt_tokens
+            self.cached_tokens += cached
+        ttft = p.ttft * (1.0 - (1.0 - p.cached_ttft_factor) * cached / prompt_tokens)
+        chunks: List[Tuple[float, str]] = []
+        remaining, n = p.output_tokens, 0
+        while remaining > 0:
+            size = min(p.chunk_tokens, remaining)
+            n += 1
+            chunks.append((size * p.per_token * p.time_scale * factor, f"- 項目{n}: シミュレーション出力（{size} tokens）\n"))
+            remaining -= size
+        return CallPlan(
+            ttft * p.time_scale * factor,
+            chunks=chunks,
+            prompt_tokens=prompt_tokens,
+            cached_tokens=cached,
+            completion_tokens=p.output_tokens,
+        )
+
+
+def _usage(kind: str, plan: CallPlan) -> SimpleNamespace:
+    details = SimpleNamespace(cached_tokens=plan.cached_tokens)
+    if kind == "chat":
+        return SimpleNamespace(
+            prompt_tokens=plan.prompt_tokens,
+            completion_tokens=plan.completion_tokens,
+            prompt_tokens_details=details,
+        )
+    return SimpleNamespace(
+        input_tokens=plan.prompt_tokens, output_tokens=plan.completion_tokens, input_tokens_details=details
+    )
+
+
+def _response(kind: str, plan: CallPlan) -> SimpleNamespace:
+    if kind == "chat":
+        return SimpleNamespace(
+            choices=[SimpleNamespace(message=SimpleNamespace(content=plan.text))], usage=_usage(kind, plan)
+        )
+    return SimpleNamespace(output_text=plan.text, output=[], usage=_usage(kind, plan))
+
+
+def _event(kind: str, text: str) -> SimpleNamespace:
+    if kind == "chat":
+        return SimpleNamespace(choices=[SimpleNamespace(delta=SimpleNamespace(content=text))])
+    return SimpleNamespace(type="response.output_text.delta", delta=text)
+
+
+def _completed(kind: str, plan: CallPlan) -> Optional[SimpleNamespace]:
+    if kind == "chat":
+        return None
+    return SimpleNamespace(type="response.completed", response=SimpleNamespace(usage=_usage(kind, plan)))
+
+
+class _Endpoint:
+    def __init__(self, sim: Simulator, kind: str):
+        self._sim = sim
+        self._kind = kind
+
+    def create(self, **params: Any) -> Any:
+        plan = self._sim.plan(params)
+        time.sleep(plan.delay)
+        if plan.error is not None:
+            raise plan.error
+        if params.get("stream"):
+            return self._stream(plan)
+        time.sleep(sum(d for d, _ in plan.chunks))
+        return _response(self._kind, plan)
+
+    def _stream(self, plan: CallPlan) -> Iterator[Any]:
+        for delay, text in plan.chunks:
+            time.sleep(delay)
+            yield _event(self._kind, text)
+        done = _completed(self._kind, plan)
+        if done is not None:
+            yield done
+
+
+class _AsyncEndpoint(_Endpoint):
+    async def create(self, **params: Any) -> Any:  # type: ignore[override]
+        plan = self._sim.plan(params)
+        await asyncio.sleep(plan.delay)
+        if plan.error is not None:
+            raise plan.error
+        await asyncio.sleep(sum(d for d, _ in plan.chunks))
+        return _response(self._kind, plan)
+
+
+class FakeOpenAIClient:
+    """chat.completions.create / responses.create だけを持つ疑似 OpenAI クライアント。"""
+
+    def __init__(self, sim: Simulator, *, use_async: bool = False):
+        endpoint = _AsyncEndpoint if use_async else _Endpoint
+        self.chat = SimpleNamespace(completions=endpoint(sim, "chat"))
+        self.responses = endpoint(sim, "responses")
+
+
+def bench_settings(settings: Optional[AppSettings] = None, **overrides: Any) -> AppSettings:
+    """疑似 API 向けの設定（実キー不要。キャッシュ・学習結果は呼び出し側で一時領域に向ける）。"""
+    base = settings or AppSettings()
+    update = {"use_stub": False, "openai_api_key": "sk-simulated", "azure_openai_api_key": None}
+    update.update(overrides)
+    return base.model_copy(update=update)
+
+
+def simulated_provider(settings: AppSettings, sim: Simulator) -> OpenAIProvider:
+    """疑似クライアントを差し込んだ OpenAIProvider（フォールバック等の実装はそのまま通る）。"""
+    return OpenAIProvider(
+        settings, client=FakeOpenAIClient(sim), aclient=FakeOpenAIClient(sim, use_async=True)
+    )
+
+
+def synthetic_project(index: int, *, seed: int = 0) -> Dict[str, Any]:
+    """ベンチマーク用の合成プロジェクト情報（index ごとに内容と大きさが変わる）。"""
+    rng = random.Random(seed * 100003 + index)
+    n = rng.randint(2, 6)
+    return {
+        "name": f"合成プロジェクト{index:03d}",
+        "sponsor": rng.choice(["事業本部長", "CIO", "経営企画部長"]),
+        "objectives": [f"KPI{i}を{rng.randint(10, 50)}%改善" for i in range(n)],
+        "scope": {
+            "in": [f"機能{i}の刷新" for i in range(n + 1)],
+            "out": [f"周辺システム{i}" for i in range(rng.randint(1, 3))],
+        },
+        "constraints": [f"{rng.randint(3, 12)}ヶ月以内にリリース"],
+        "assumptions": ["予算は現状維持"],
+        "milestones": [
+            {"name": f"フェーズ{i}完了", "target": f"2027-{(i % 12) + 1:02d}-28"} for i in range(n)
+        ],
+        "budget": {"currency": "JPY", "amount": rng.randint(10, 500) * 1_000_000},
+        "stakeholders": [{"name": f"部門{i}", "interest": f"関心事{i}"} for i in range(n)],
+        "risk_seeds": [f"リスク要因{i}" for i in range(n)],
+    }
+
+
+@dataclass
+class ScenarioResult:
+    """1シナリオ分の計測結果。"""
+
+    name: str
+    documents: int
+    failed: int
+    wall_clock: float
+    throughput: float  # docs/sec
+    latency_p50: Optional[float]
+    latency_p95: Optional[float]
+    latency_p99: Optional[float]
+    latency_max: Optional[float]
+    param_rejections: int
+    simulated_errors: int
+    rate_limited: int
+    prompt_cache_ratio: Optional[float]  # 入力トークンのうちプロンプトキャッシュに載った割合
+
+
+@dataclass
+class BenchReport:
+    profile: Dict[str, Any]
+    model: str
+    projects: int
+    doc_types: List[str]
+    workers: int
+    scenarios: List[ScenarioResult] = field(default_factory=list)
+
+    def to_dict(self) -> Dict[str, Any]:
+        return asdict(self)
+
+
+def _counters(sim: Simulator) -> Tuple[int, ...]:
+    return sim.rejections, sim.errors, sim.rate_limited, sim.prompt_tokens, sim.cached_tokens
+
+
+def _result(name: str, latencies: List[float], failed: int, wall: float, sim: Simulator, before: Tuple[int, ...]) -> ScenarioResult:
+    def _r(v: Optional[float]) -> Optional[float]:
+        return round(v, 4) if v is not None else None
+
+    return ScenarioResult(
+        name=name,
+        documents=len(latencies),
+        failed=failed,
+        wall_clock=round(wall, 4),
+        throughput=round(len(latencies) / wall, 2) if wall > 0 else 0.0,
+        latency_p50=_r(percentile(latencies, 50)),
+        latency_p95=_r(percentile(latencies, 95)),
+        latency_p99=_r(percentile(latencies, 99)),
+        latency_max=_r(max(latencies) if latencies else None),
+        param_rejections=sim.rejections - before[0],
+        simulated_errors=sim.errors - before[1],
+        rate_limited=sim.rate_limited - before[2],
+        prompt_cache_ratio=_r((sim.cached_tokens - before[4]) / (sim.prompt_tokens - before[3]))
+        if sim.prompt_tokens > before[3]
+        else None,
+    )
+
+
+async def _run_async(tasks: List[Dict[str, Any]], contexts: Dict[str, Dict[str, Any]], settings: AppSettings, provider: Any, workers: int) -> Tuple[List[float], int]:
+    sem = asyncio.Semaphore(max(1, workers))
+    latencies: List[float] = []
+    failed = 0
+
+    async def _one(task: Dict[str, Any]) -> None:
+        nonlocal failed
+        async with sem:
+            start = time.perf_counter()
+            try:
+                await agenerate_text_document(
+                    doc_type=task["doc_type"],
+                    project_context=contexts[task["project"]],
+                    out_path=task["out_path"],
+                    settings=settings,
+                    provider=provider,
+                )
+            except Exception:
+                failed += 1
+            latencies.append(time.perf_counter() - start)
+
+    await asyncio.gather(*[_one(t) for t in tasks])
+    return latencies, failed
+
+
+def run_benchmark(
+    *,
+    projects: int = 4,
+    doc_types: Optional[Sequence[str]] = None,
+    workers: int = 8,
+    profile: Optional[SimulationProfile] = None,
+    scenarios: Sequence[str] = SCENARIOS,
+    settings: Optional[AppSettings] = None,
+    work_dir: Optional[Path] = None,
+) -> BenchReport:
+    """疑似 API に対して生成パイプラインを実行し、シナリオごとのスループットと裾のレイテンシを返す。
+
+    - serial: 1スレッドで逐次生成
+    - concurrent: スレッドプール（batch と同じ経路）
+    - async: 1イベントループで agenerate を同時実行
+    - cached: キャッシュを温めた後の2回目の実行
+    シナリオは同じ疑似 API・同じ学習結果を共有するため、先頭のシナリオだけが
+    パラメータ拒否（フォールバック）のコストを払います。
+    """
+    unknown = [s for s in scenarios if s not in SCENARIOS]
+    if unknown:
+        raise ValueError(f"Unknown scenario: {', '.join(unknown)}")
+    profile = profile or SimulationProfile()
+    kinds = resolve_doc_types(doc_types)
+
+    with tempfile.TemporaryDirectory(prefix="pmbok_bench_") as tmp:
+        root = Path(work_dir) if work_dir else Path(tmp)
+        project_dir = root / "projects"
+        project_dir.mkdir(parents=True, exist_ok=True)
+        for i in range(projects):
+            data = synthetic_project(i, seed=profile.seed or 0)
+            (project_dir / f"project_{i:03d}.json").write_text(json.dumps(data, ensure_ascii=False), encoding="utf-8")
+
+        settings = settings or AppSettings()
+        base = bench_settings(
+            settings,
+            # 再送の待ち時間も疑似APIの時間軸に合わせる
+            retry_base_delay=settings.retry_base_delay * profile.time_scale,
+            retry_max_delay=settings.retry_max_delay * profile.time_scale,
+            cache_enabled=False,
+            cache_bypass=False,
+            cache_dir=str(root / "cache"),
+            capabilities_path=str(root / "capabilities.json"),
+            metrics_path=str(root / "metrics.jsonl"),
+        )
+        sim = Simulator(profile)
+        report = BenchReport(
+            profile=asdict(profile), model=base.model, projects=projects, doc_types=kinds, workers=workers
+        )
+
+        for name in scenarios:
+            s = base.model_copy(update={"cache_enabled": True}) if name == "cached" else base
+            provider = wrap_provider(simulated_provider(s, sim), s)
+            out_dir = root / "out" / name
+            if name == "cached":
+                # 1回目でキャッシュを温め、2回目を計測する
+                generate_documents(project_dir, out_dir, doc_types=kinds, settings=s, max_workers=workers, provider=provider)
+            before = _counters(sim)
+            if name == "async":
+                files = sorted(project_dir.glob("*.json"))
+                tasks = plan_outputs(files, kinds, out_dir)
+                for t in tasks:
+                    Path(t["out_path"]).parent.mkdir(parents=True, exist_ok=True)
+                contexts = {str(pf): json.loads(pf.read_text(encoding="utf-8")) for pf in files}
+                start = time.perf_counter()
+                latencies, failed = asyncio.run(_run_async(tasks, contexts, s, provider, workers))
+                wall = time.perf_counter() - start
+            else:
+                batch = generate_documents(
+                    project_dir,
+                    out_dir,
+                    doc_types=kinds,
+                    settings=s,
+                    max_workers=1 if name == "serial" else workers,
+                    provider=provider,
+                )
+                latencies = [r.elapsed for r in batch.results]
+                failed = len(batch.failed)
+                wall = batch.wall_clock
+            report.scenarios.append(_result(name, latencies, failed, wall, sim, before))
+        return report
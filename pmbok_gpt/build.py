@@ -0,0 +1,224 @@
+from __future__ import annotations
+
+import hashlib
+import json
+import threading
+import time
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Sequence
+
+from .atomic import atomic_write
+from .batch import BatchReport, DocumentResult, collect_project_files, load_contexts, plan_outputs, resolve_doc_types, run_tasks
+from .cache import model_settings
+from .config import AppSettings
+from .generator import PROMPT_VERSION, SYSTEM_PROMPT, prepare_context, section_token_budget
+from .templates import BUILTIN_TEMPLATES, TemplateSet
+
+MANIFEST_NAME = ".pmbok_manifest.json"
+_MANIFEST_VERSION = 1
+
+
+def _digest(value: Any) -> str:
+    raw = json.dumps(value, ensure_ascii=False, sort_keys=True, separators=(",", ":"))
+    return hashlib.sha256(raw.encode("utf-8")).hexdigest()[:16]
+
+
+def input_fingerprint(
+    doc_type: str,
+    project_context: Dict[str, Any],
+    *,
+    language: str,
+    extra_instructions: Optional[str],
+    settings: AppSettings,
+    sectioned: bool = False,
+    templates: Optional[TemplateSet] = None,
+) -> Dict[str, str]:
+    """1ドキュメントの生成結果に影響する入力を、要素ごとのハッシュにまとめる。
+
+    context は実際に送るプロジェクト情報（種別ごとの絞り込み・切り詰め後）なので、
+    関係のない項目を編集しても変わりません。
+    """
+    template = (templates or BUILTIN_TEMPLATES).template(doc_type)
+    context, _ = prepare_context(language, doc_type, project_context, extra_instructions, settings, templates)
+    model: Dict[str, Any] = model_settings(settings)
+    if sectioned:
+        sections = len(template["sections"])
+        model["section_tokens"] = section_token_budget(settings.max_tokens, sections, settings.section_min_tokens)
+    return {
+        "context": _digest(context),
+        "template": _digest(template),
+        "language": language,
+        "note": _digest(extra_instructions or ""),
+        "model": _digest(model),
+        "prompt": f"v{PROMPT_VERSION}:{_digest(SYSTEM_PROMPT)[:8]}",
+        "mode": "sectioned" if sectioned else "single",
+    }
+
+
+class BuildManifest:
+    """出力ディレクトリに置く、生成済みファイルと入力ハッシュの対応表。
+
+    キーは出力ディレクトリからの相対パス。複数スレッドから record() されても
+    壊れないよう、保存は一時ファイル経由の置換で行います。
+    """
+
+    def __init__(self, out_dir: Path):
+        self.out_dir = Path(out_dir)
+        self.path = self.out_dir / MANIFEST_NAME
+        self.entries: Dict[str, Dict[str, Any]] = {}
+        self._lock = threading.Lock()
+        try:
+            data = json.loads(self.path.read_text(encoding="utf-8"))
+        except (OSError, ValueError):
+            data = {}
+        if isinstance(data, dict) and data.get("version") == _MANIFEST_VERSION:
+            self.entries = dict(data.get("entries") or {})
+
+    def key(self, out_path: str) -> str:
+        return Path(out_path).resolve().relative_to(self.out_dir.resolve()).as_posix()
+
+    def stale_reasons(self, out_path: str, inputs: Dict[str, str]) -> List[str]:
+        """再生成が必要な理由（変わった入力の名前）。空なら最新。"""
+        entry = self.entries.get(self.key(out_path))
+        if entry is None:
+            return ["new"]
+        if not Path(out_path).is_file():
+            return ["missing"]
+        recorded = entry.get("inputs") or {}
+        return [k for k in inputs if recorded.get(k) != inputs[k]]
+
+    def record(self, out_path: str, inputs: Dict[str, str], **extra: Any) -> None:
+        with self._lock:
+            self.entries[self.key(out_path)] = {"inputs": inputs, "built_at": time.time(), **extra}
+            self._save_locked()
+
+    def _save_locked(self) -> None:
+        self.out_dir.mkdir(parents=True, exist_ok=True)
+        data = json.dumps({"version": _MANIFEST_VERSION, "entries": self.entries}, ensure_ascii=False, indent=2, sort_keys=True)
+        atomic_write(self.path, data)
+
+
+@dataclass
+class BuildItem:
+    """ビルド対象の1ドキュメントと、再生成の理由。"""
+
+    project: str
+    doc_type: str
+    out_path: str
+    inputs: Dict[str, str]
+    reasons: List[str] = field(default_factory=list)
+
+    @property
+    def stale(self) -> bool:
+        return bool(self.reasons)
+
+
+@dataclass
+class BuildReport:
+    """build の結果（skipped は LLM を呼ばずに済んだドキュメント）。"""
+
+    items: List[BuildItem] = field(default_factory=list)
+    batch: BatchReport = field(default_factory=BatchReport)
+
+    @property
+    def skipped(self) -> List[BuildItem]:
+        return [i for i in self.items if not i.stale]
+
+    @property
+    def failed(self) -> List[DocumentResult]:
+        return self.batch.failed
+
+    def summary(self) -> Dict[str, Any]:
+        return {
+            "documents": len(self.items),
+            "rebuilt": len(self.batch.results) - len(self.failed),
+            "skipped": len(self.skipped),
+            "failed": len(self.failed),
+            "wall_clock_sec": round(self.batch.wall_clock, 3),
+        }
+
+
+def plan_build(
+    tasks: Sequence[Dict[str, Any]],
+    contexts: Dict[str, Dict[str, Any]],
+    manifest: BuildManifest,
+    *,
+    language: str,
+    extra_instructions: Optional[str],
+    settings: AppSettings,
+    sectioned: bool = False,
+    force: bool = False,
+    templates: Optional[TemplateSet] = None,
+) -> List[BuildItem]:
+    """plan_outputs の各タスクについて、入力ハッシュと再生成の理由を求める。"""
+    items: List[BuildItem] = []
+    for t in tasks:
+        inputs = input_fingerprint(
+            t["doc_type"], contexts[t["project"]], language=language,
+            extra_instructions=extra_instructions, settings=settings, sectioned=sectioned,
+            templates=templates,
+        )
+        reasons = ["force"] if force else manifest.stale_reasons(t["out_path"], inputs)
+        items.append(BuildItem(inputs=inputs, reasons=reasons, **t))
+    return items
+
+
+def build_documents(
+    project: Path,
+    out_dir: Path,
+    *,
+    doc_types: Optional[Sequence[str]] = None,
+    language: Optional[str] = None,
+    extra_instructions: Optional[str] = None,
+    settings: Optional[AppSettings] = None,
+    max_workers: int = 4,
+    sectioned: bool = False,
+    force: bool = False,
+    dry_run: bool = False,
+    provider: Any = None,
+) -> BuildReport:
+    """入力が変わったドキュメントだけを再生成する（make と同様の差分ビルド）。
+
+    マニフェスト（out_dir/.pmbok_manifest.json）と入力ハッシュが一致し、出力ファイルが
+    残っているドキュメントは LLM を呼ばずにスキップします。force=True で全件再生成。
+    """
+    settings = settings or AppSettings()
+    language = language or settings.default_language
+    files = collect_project_files(project)
+    if not files:
+        raise ValueError(f"プロジェクトJSONが見つかりません: {project}")
+    tasks = plan_outputs(files, resolve_doc_types(doc_types), out_dir)
+    contexts = load_contexts(files)
+    manifest = BuildManifest(out_dir)
+
+    report = BuildReport(
+        items=plan_build(
+            tasks, contexts, manifest, language=language, extra_instructions=extra_instructions,
+            settings=settings, sectioned=sectioned, force=force,
+        )
+    )
+    stale = [i for i in report.items if i.stale]
+    if dry_run or not stale:
+        return report
+
+    by_path = {i.out_path: i for i in stale}
+
+    def _done(result: DocumentResult) -> None:
+        # 成功したものだけ記録する（失敗分は次回も再生成の対象）
+        if result.ok:
+            item = by_path[result.out_path]
+            manifest.record(result.out_path, item.inputs, project=Path(item.project).name, doc_type=item.doc_type)
+
+    report.batch = run_tasks(
+        [{"project": i.project, "doc_type": i.doc_type, "out_path": i.out_path} for i in stale],
+        contexts,
+        language=language,
+        extra_instructions=extra_instructions,
+        settings=settings,
+        max_workers=max_workers,
+        sectioned=sectioned,
+        provider=provider,
+        on_done=_done,
+    )
+    return report
@@ -0,0 +1,253 @@
+from __future__ import annotations
+
+import json
+import time
+import uuid
+from dataclasses import asdict, dataclass, field
+from pathlib import Path
+from typing import Any, Callable, Dict, List, Optional, Sequence
+
+from . import metrics
+from .atomic import atomic_write
+from .batch import collect_project_files, load_contexts, plan_outputs, resolve_doc_types
+from .build import BuildManifest, plan_build
+from .cache import model_settings
+from .config import AppSettings
+from .generator import build_messages, finalize_text, prepare_context, write_output
+from .providers import ChatShape, build_backend, fallback_shape
+
+# バッチの終了状態（expired / cancelled でも処理済みの行は結果ファイルに含まれる）
+TERMINAL_STATUSES = frozenset({"completed", "failed", "expired", "cancelled"})
+# パラメータ非対応で失敗した行を、送信形を変えて再投入する上限回数
+_MAX_ROUNDS = len(ChatShape._fields) + 1
+
+
+@dataclass
+class BulkJob:
+    """Batch API による一括生成ジョブの記録（中断しても --resume で続きから再開できる）。
+
+    items は custom_id ごとの {project, doc_type, out_path, messages, inputs, context}。
+    rounds は投入したバッチ（パラメータ非対応の行は送信形を変えて次のバッチで再投入）。
+    results は custom_id ごとの結果（"ok" / "fallback" / "error: ..."）。
+    settings は作成時のモデル設定（model_settings）。再開時はこの値に戻して再投入・後処理する。
+    """
+
+    id: str
+    model: str
+    provider: str
+    language: str
+    out_dir: str
+    created: float
+    items: Dict[str, Dict[str, Any]] = field(default_factory=dict)
+    rounds: List[Dict[str, Any]] = field(default_factory=list)
+    results: Dict[str, str] = field(default_factory=dict)
+    status: str = "submitted"  # submitted | completed
+    settings: Dict[str, Any] = field(default_factory=dict)
+
+    @property
+    def pending(self) -> List[str]:
+        return [cid for cid in self.items if cid not in self.results]
+
+    def counts(self) -> Dict[str, int]:
+        values = list(self.results.values())
+        return {
+            "documents": len(self.items),
+            "ok": values.count("ok"),
+            "fallback": values.count("fallback"),
+            "failed": sum(1 for v in values if v.startswith("error")),
+            "pending": len(self.pending),
+        }
+
+
+def _jobs_dir(settings: AppSettings) -> Path:
+    return Path(settings.batch_jobs_dir)
+
+
+def save_job(job: BulkJob, settings: AppSettings) -> Path:
+    path = _jobs_dir(settings) / f"{job.id}.json"
+    path.parent.mkdir(parents=True, exist_ok=True)
+    atomic_write(path, json.dumps(asdict(job), ensure_ascii=False, indent=2))
+    return path
+
+
+def load_job(job_id: str, settings: AppSettings) -> BulkJob:
+    path = _jobs_dir(settings) / f"{job_id}.json"
+    try:
+        return BulkJob(**json.loads(path.read_text(encoding="utf-8")))
+    except FileNotFoundError:
+        raise ValueError(f"ジョブが見つかりません: {job_id}") from None
+
+
+def list_jobs(settings: AppSettings) -> List[BulkJob]:
+    jobs = [load_job(p.stem, settings) for p in _jobs_dir(settings).glob("*.json")]
+    return sorted(jobs, key=lambda j: j.created)
+
+
+# 再開時に作成時の値へ戻せる設定（それ以外の provider / endpoint は一致しなければ再開しない）
+_RESTORABLE = ("model", "temperature", "max_tokens", "use_responses_api")
+
+
+def _job_settings(job: BulkJob, settings: AppSettings) -> AppSettings:
+    """作成時のモデル設定に戻した settings（再投入・後処理・計測を作成時と同じ条件で行う）。
+
+    戻せない設定（provider / endpoint）が作成時と異なる場合は ValueError。
+    """
+    recorded = job.settings or {"model": job.model}  # settings を記録する前のジョブはモデルだけ戻す
+    settings = settings.model_copy(update={k: recorded[k] for k in _RESTORABLE if k in recorded})
+    differ = [k for k, v in model_settings(settings).items() if k in recorded and recorded[k] != v]
+    if differ:
+        raise ValueError(f"ジョブ作成時と設定が異なるため再開できません: {', '.join(differ)}（{job.id}）")
+    return settings
+
+
+def _submit_round(job: BulkJob, provider: Any, custom_ids: Sequence[str], shape: ChatShape) -> None:
+    lines = [provider.batch_line(cid, job.items[cid]["messages"], shape) for cid in custom_ids]
+    batch_id = provider.submit_batch(lines, metadata={"pmbok_job": job.id, "round": str(len(job.rounds) + 1)})
+    job.rounds.append({"batch_id": batch_id, "custom_ids": list(custom_ids), "shape": shape._asdict(), "status": "submitted"})
+
+
+def submit_bulk(
+    project: Path,
+    out_dir: Path,
+    *,
+    doc_types: Optional[Sequence[str]] = None,
+    language: Optional[str] = None,
+    extra_instructions: Optional[str] = None,
+    settings: Optional[AppSettings] = None,
+    force: bool = False,
+    provider: Any = None,
+) -> Optional[BulkJob]:
+    """再生成が必要なドキュメント（build と同じ判定）を1つのバッチとして投入する。
+
+    送信メッセージは generate_text_document と同じ（build_messages）。対象がなければ None。
+    """
+    settings = settings or AppSettings()
+    language = language or settings.default_language
+    provider = provider or build_backend(settings)
+    if not hasattr(provider, "submit_batch"):
+        raise ValueError("Batch API は OpenAI / Azure OpenAI でのみ使えます（スタブ設定を確認してください）")
+
+    files = collect_project_files(project)
+    if not files:
+        raise ValueError(f"プロジェクトJSONが見つかりません: {project}")
+    tasks = plan_outputs(files, resolve_doc_types(doc_types), out_dir)
+    contexts = load_contexts(files)
+    stale = [
+        i for i in plan_build(
+            tasks, contexts, BuildManifest(out_dir), language=language,
+            extra_instructions=extra_instructions, settings=settings, force=force,
+        ) if i.stale
+    ]
+    if not stale:
+        return None
+
+    job = BulkJob(
+        id=uuid.uuid4().hex[:12],
+        model=settings.model,
+        provider=settings.provider_kind(),
+        language=language,
+        out_dir=str(out_dir),
+        created=time.time(),
+        settings=model_settings(settings),
+    )
+    for n, item in enumerate(stale):
+        context, tags = prepare_context(language, item.doc_type, contexts[item.project], extra_instructions, settings)
+        job.items[f"doc-{n}"] = {
+            "project": item.project,
+            "doc_type": item.doc_type,
+            "out_path": item.out_path,
+            "messages": build_messages(language, item.doc_type, context, extra_instructions),
+            "inputs": item.inputs,
+            "context": tags,
+        }
+    _submit_round(job, provider, list(job.items), provider.batch_shape())
+    save_job(job, settings)
+    return job
+
+
+def _collect_round(job: BulkJob, rnd: Dict[str, Any], batch: Any, provider: Any, settings: AppSettings) -> Dict[str, str]:
+    """1バッチ分の結果を書き出し、送信形を変えて再投入すべき custom_id とそのエラー文言を返す。"""
+    results = provider.batch_results(batch)
+    manifest = BuildManifest(Path(job.out_dir))
+    shape = ChatShape(**rnd["shape"])
+    retry: Dict[str, str] = {}
+    for cid in rnd["custom_ids"]:
+        item = job.items[cid]
+        res = results.get(cid)
+        if res is None:
+            job.results[cid] = f"error: バッチが {batch.status} で終了し、結果がありません"
+            continue
+        if res["error"] and res["status"] == 400 and fallback_shape(shape, RuntimeError(res["error"])) is not None:
+            retry[cid] = res["error"]
+            continue
+        with metrics.recording(settings, "batch", doc_type=item["doc_type"], api="batch", **item["context"]) as rec:
+            if res["error"]:
+                job.results[cid] = f"error: {res['error']}"
+                if rec is not None:
+                    rec.ok, rec.error = False, str(res["error"])[:500]
+                continue
+            metrics.note_usage(res["usage"])
+            try:
+                # generate_text_document と同じ後処理（空出力ならスタブにフォールバック）
+                text = finalize_text(res["text"], item["messages"], settings)
+            except RuntimeError as e:
+                job.results[cid] = f"error: {e}"
+                if rec is not None:
+                    rec.ok, rec.error = False, str(e)[:500]
+                continue
+            if rec is not None:
+                rec.request_chars = sum(len(m["content"]) for m in item["messages"])
+                rec.response_chars = len(text)
+        Path(item["out_path"]).parent.mkdir(parents=True, exist_ok=True)
+        write_output(item["out_path"], text)
+        manifest.record(item["out_path"], item["inputs"], project=Path(item["project"]).name, doc_type=item["doc_type"])
+        job.results[cid] = "fallback" if not (res["text"] or "").strip() else "ok"
+    if not retry and any(job.results.get(cid) in ("ok", "fallback") for cid in rnd["custom_ids"]):
+        # この送信形で本文が得られた（次回以降の通常の生成でも最初から使う）
+        provider.record_batch_shape(shape)
+    return retry
+
+
+def poll_bulk(
+    job: BulkJob,
+    *,
+    settings: Optional[AppSettings] = None,
+    provider: Any = None,
+    wait: bool = True,
+    poll_interval: float = 30.0,
+    timeout: Optional[float] = None,
+    on_progress: Optional[Callable[[BulkJob, Any], None]] = None,
+) -> BulkJob:
+    """バッチの完了を待って結果を書き出す。wait=False なら1回だけ確認して戻る。
+
+    状態が変わるたびにジョブ記録を保存するため、途中で止めても続きから再開できます。
+    """
+    settings = _job_settings(job, settings or AppSettings())
+    provider = provider or build_backend(settings)
+    deadline = None if timeout is None else time.monotonic() + timeout
+    while job.status != "completed":
+        rnd = job.rounds[-1]
+        batch = provider.retrieve_batch(rnd["batch_id"])
+        if on_progress is not None:
+            on_progress(job, batch)
+        if batch.status in TERMINAL_STATUSES:
+            retry = _collect_round(job, rnd, batch, provider, settings)
+            rnd["status"] = batch.status
+            shape = ChatShape(**rnd["shape"])
+            if retry:
+                # 1行目のエラーから次の送信形を決める（同じモデルなら全行で同じ理由のため）
+                first = next(iter(retry.values()))
+                next_shape = fallback_shape(shape, RuntimeError(first))
+                if next_shape is not None and len(job.rounds) < _MAX_ROUNDS:
+                    _submit_round(job, provider, list(retry), next_shape)
+                else:
+                    for cid, error in retry.items():
+                        job.results[cid] = f"error: {error}"
+            if not job.pending:
+                job.status = "completed"
+            save_job(job, settings)
+            continue
+        if not wait or (deadline is not None and time.monotonic() >= deadline):
+            break
+        time.sleep(poll_interval)
+    return job
@@ -0,0 +1,213 @@
+from __future__ import annotations
+
+import hashlib
+import json
+import threading
+import time
+from pathlib import Path
+from typing import Any, Dict, Iterator, List, Optional
+
+from . import metrics
+from .atomic import atomic_write
+from .config import AppSettings
+
+# 書き込み何回ごとに TTL/件数による掃除を行うか
+_PRUNE_INTERVAL = 32
+
+
+def model_settings(settings: AppSettings) -> Dict[str, Any]:
+    """生成結果に影響するモデル設定（キャッシュキー・ビルドマニフェストで共通）。"""
+    kind = settings.provider_kind()
+    return {
+        "provider": kind,
+        "endpoint": settings.azure_openai_endpoint if kind == "azure" else settings.openai_base_url,
+        "model": settings.model,
+        "temperature": settings.temperature,
+        "max_tokens": settings.effective_max_tokens(),
+        "use_responses_api": settings.use_responses_api,
+    }
+
+
+def cache_key(messages: List[Dict[str, str]], settings: AppSettings) -> str:
+    """メッセージと出力に影響するモデル設定から、安定したキャッシュキーを作る。"""
+    payload = {"messages": messages, **model_settings(settings)}
+    raw = json.dumps(payload, ensure_ascii=False, sort_keys=True, separators=(",", ":"))
+    return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+
+class ResponseCache:
+    """生成結果のディスクキャッシュ（1エントリ=1 JSONファイル）。
+
+    - TTL 超過のエントリは読み出し時にミス扱いとし、掃除で削除
+    - 件数が上限を超えたら古い順（更新時刻）に削除
+    """
+
+    def __init__(self, directory: str, *, ttl_seconds: int = 0, max_entries: int = 0):
+        self.directory = Path(directory)
+        self.ttl_seconds = ttl_seconds
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self.writes = 0
+        self.evictions = 0
+        self._lock = threading.Lock()
+
+    def _path(self, key: str) -> Path:
+        return self.directory / key[:2] / f"{key}.json"
+
+    def _expired(self, created: float) -> bool:
+        return bool(self.ttl_seconds) and (time.time() - created) > self.ttl_seconds
+
+    def get(self, key: str) -> Optional[str]:
+        path = self._path(key)
+        try:
+            entry = json.loads(path.read_text(encoding="utf-8"))
+        except (OSError, ValueError):
+            entry = None
+        if entry is None or self._expired(float(entry.get("created", 0))):
+            with self._lock:
+                self.misses += 1
+            return None
+        with self._lock:
+            self.hits += 1
+        return str(entry.get("text", ""))
+
+    def put(self, key: str, text: str) -> None:
+        path = self._path(key)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        data = json.dumps({"created": time.time(), "text": text}, ensure_ascii=False)
+        # 並行書き込みでも壊れたファイルを読まないよう、一時ファイル経由で置換
+        atomic_write(path, data)
+        with self._lock:
+            self.writes += 1
+            need_prune = self.writes % _PRUNE_INTERVAL == 1
+        if need_prune:
+            self.prune()
+
+    def _entries(self) -> List[Path]:
+        if not self.directory.exists():
+            return []
+        return [p for p in self.directory.glob("*/*.json") if p.is_file()]
+
+    def prune(self) -> int:
+        """TTL 超過と件数上限超過のエントリを削除し、削除件数を返す。"""
+        entries = []
+        for p in self._entries():
+            try:
+                entries.append((p.stat().st_mtime, p))
+            except OSError:
+                continue
+        entries.sort()
+        removed = 0
+        now = time.time()
+        keep = []
+        for mtime, p in entries:
+            if self.ttl_seconds and now - mtime > self.ttl_seconds:
+                removed += self._unlink(p)
+            else:
+                keep.append(p)
+        if self.max_entries and len(keep) > self.max_entries:
+            for p in keep[: len(keep) - self.max_entries]:
+                removed += self._unlink(p)
+        with self._lock:
+            self.evictions += removed
+        return removed
+
+    @staticmethod
+    def _unlink(path: Path) -> int:
+        try:
+            path.unlink()
+            return 1
+        except OSError:
+            return 0
+
+    def clear(self) -> int:
+        removed = sum(self._unlink(p) for p in self._entries())
+        with self._lock:
+            self.evictions += removed
+        return removed
+
+    def stats(self) -> Dict[str, Any]:
+        entries = self._entries()
+        return {
+            "directory": str(self.directory),
+            "entries": len(entries),
+            "bytes": sum(p.stat().st_size for p in entries),
+            "hits": self.hits,
+            "misses": self.misses,
+            "writes": self.writes,
+            "evictions": self.evictions,
+        }
+
+
+_caches: Dict[str, ResponseCache] = {}
+_caches_lock = threading.Lock()
+
+
+def get_cache(settings: AppSettings) -> ResponseCache:
+    """キャッシュディレクトリごとに共有の ResponseCache を返す（ヒット/ミス数をプロセス内で集計）。"""
+    directory = str(Path(settings.cache_dir).resolve())
+    with _caches_lock:
+        cache = _caches.get(directory)
+        if cache is None:
+            cache = ResponseCache(
+                directory, ttl_seconds=settings.cache_ttl_seconds, max_entries=settings.cache_max_entries
+            )
+            _caches[directory] = cache
+        return cache
+
+
+class CachedProvider:
+    """provider.generate / agenerate / stream の結果をディスクにキャッシュするラッパ。
+
+    cache_bypass=True のときは読み出しをスキップし、新しい結果で上書きします。
+    空の結果はキャッシュしません。
+    """
+
+    def __init__(self, inner: Any, cache: ResponseCache, settings: AppSettings):
+        self.inner = inner
+        self.cache = cache
+        self.settings = settings
+
+    def _lookup(self, key: str) -> Optional[str]:
+        if self.settings.cache_bypass:
+            metrics.note(cache="bypass")
+            return None
+        text = self.cache.get(key)
+        metrics.note(cache="miss" if text is None else "hit")
+        return text
+
+    def _store(self, key: str, text: str) -> None:
+        if text and text.strip():
+            self.cache.put(key, text)
+
+    def generate(self, messages: List[Dict[str, str]]) -> str:
+        key = cache_key(messages, self.settings)
+        cached = self._lookup(key)
+        if cached is not None:
+            return cached
+        text = self.inner.generate(messages)
+        self._store(key, text)
+        return text
+
+    async def agenerate(self, messages: List[Dict[str, str]]) -> str:
+        key = cache_key(messages, self.settings)
+        cached = self._lookup(key)
+        if cached is not None:
+            return cached
+        text = await self.inner.agenerate(messages)
+        self._store(key, text)
+        return text
+
+    def stream(self, messages: List[Dict[str, str]]) -> Iterator[str]:
+        # ヒット時は一括で返し、ミス時は差分を中継しつつ最後に保存する
+        key = cache_key(messages, self.settings)
+        cached = self._lookup(key)
+        if cached is not None:
+            yield cached
+            return
+        parts: List[str] = []
+        for delta in self.inner.stream(messages):
+            parts.append(delta)
+            yield delta
+        self._store(key, "".join(parts))
@@ -0,0 +1,88 @@
+from __future__ import annotations
+
+import json
+import threading
+import time
+from pathlib import Path
+from typing import Any, Dict, Optional
+
+from .atomic import atomic_write
+from .config import AppSettings
+
+
+def capability_key(kind: str, endpoint: Optional[str], model: Optional[str]) -> str:
+    """provider / エンドポイント / モデル を連結したレジストリのキー。"""
+    return "|".join([kind, (endpoint or "").strip().rstrip("/"), model or ""])
+
+
+class CapabilityRegistry:
+    """モデルごとに「通ったパラメータの組み合わせ」を記録する JSON ファイル。
+
+    記録する項目:
+    - use_completion_param / include_temperature / include_response_format: Chat Completions の送信形
+    - preferred_api: 本文が得られた API（"chat" | "responses"）
+    - responses_max_output_tokens: Responses API が max_output_tokens を受け付けたか
+    """
+
+    def __init__(self, path: str):
+        self.path = Path(path)
+        self._lock = threading.Lock()
+        self._data: Optional[Dict[str, Dict[str, Any]]] = None
+
+    def _load(self) -> Dict[str, Dict[str, Any]]:
+        if self._data is None:
+            try:
+                self._data = json.loads(self.path.read_text(encoding="utf-8"))
+            except (OSError, ValueError):
+                self._data = {}
+        return self._data
+
+    def _save(self) -> None:
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        atomic_write(self.path, json.dumps(self._data, ensure_ascii=False, indent=2, sort_keys=True))
+
+    def get(self, key: str) -> Dict[str, Any]:
+        with self._lock:
+            return dict(self._load().get(key, {}))
+
+    def record(self, key: str, **fields: Any) -> None:
+        """値が変わったときだけファイルに書き出す。"""
+        with self._lock:
+            data = self._load()
+            entry = data.setdefault(key, {})
+            if all(entry.get(k) == v for k, v in fields.items()):
+                return
+            entry.update(fields)
+            entry["updated"] = time.strftime("%Y-%m-%dT%H:%M:%S")
+            self._save()
+
+    def all(self) -> Dict[str, Dict[str, Any]]:
+        with self._lock:
+            return {k: dict(v) for k, v in self._load().items()}
+
+    def reset(self, key: Optional[str] = None) -> int:
+        """指定キー（未指定なら全件）を削除し、削除件数を返す。"""
+        with self._lock:
+            data = self._load()
+            if key is None:
+                removed = len(data)
+                data.clear()
+            else:
+                removed = 1 if data.pop(key, None) is not None else 0
+            if removed:
+                self._save()
+            return removed
+
+
+_registries: Dict[str, CapabilityRegistry] = {}
+_registries_lock = threading.Lock()
+
+
+def get_registry(settings: AppSettings) -> CapabilityRegistry:
+    path = str(Path(settings.capabilities_path).resolve())
+    with _registries_lock:
+        registry = _registries.get(path)
+        if registry is None:
+            registry = CapabilityRegistry(path)
+            _registries[path] = registry
+        return registry
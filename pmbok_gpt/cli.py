@@ -2,17 +2,20 @@ from __future__ import annotations
 
 import json
 import os
+import sys
+import time
 from pathlib import Path
-from typing import Optional
+from typing import TYPE_CHECKING, List, Optional
 
 import typer
 from rich import print
 
-from .config import AppSettings
-from .generator import generate_text_document
-from .templates import DOC_TEMPLATES
-from .excel import create_risk_register_excel, create_stakeholder_register_excel
-from .wizard import run_project_wizard
+if TYPE_CHECKING:
+    from .config import AppSettings
+
+# 設定・生成・Excel 等のモジュールは各コマンドの中で読み込む（list / diag を繰り返し呼んでも、
+# 使わない依存（pydantic-settings・openpyxl・openai 等）の読み込みで待たされないように）
+
 
 app = typer.Typer(help="PMBOKドキュメント生成CLI")
 
@@ -20,6 +23,8 @@ app = typer.Typer(help="PMBOKドキュメント生成CLI")
 @app.command()
 def list():  # type: ignore[override]
     """生成可能なドキュメントタイプを一覧表示。"""
+    from .templates import DOC_TEMPLATES
+
     for key, tpl in DOC_TEMPLATES.items():
         print(f"[bold]{key}[/bold]: {tpl.get('title')}")
 
@@ -77,6 +82,30 @@ def init():  # type: ignore[override]
         print("サンプルは既に存在します。")
 
 
+def _apply_cache_options(settings: AppSettings, cache: Optional[bool], bypass_cache: bool) -> AppSettings:
+    if cache is not None:
+        settings.cache_enabled = cache
+    if bypass_cache:
+        settings.cache_bypass = True
+    return settings
+
+
+def _print_usage(settings: AppSettings, mark: int) -> None:
+    """mark 以降の呼び出しのトークン数（プロンプトキャッシュのヒット分を含む）を表示する。"""
+    from .metrics import get_recorder, usage_totals
+
+    if not settings.metrics_enabled:
+        print("- tokens: 計測が無効です（AICPM_METRICS_ENABLED=false）")
+        return
+    t = usage_totals(get_recorder(settings).since(mark))
+    ratio = f"{t['prompt_cache_ratio']:.0%}" if t["prompt_cache_ratio"] is not None else "-"
+    print(
+        f"- tokens: calls={t['calls']} prompt={t['prompt_tokens']} "
+        f"cached={t['cached_tokens']} ({ratio}) completion={t['completion_tokens']} "
+        f"context_saved={t['context_saved_tokens']}"
+    )
+
+
 @app.command()
 def txt(
     doc_type: str = typer.Option(..., help="ドキュメント種別キー（list参照）"),
@@ -84,12 +113,48 @@ def txt(
     out: Path = typer.Option(..., help="出力先のtxtファイルパス"),
     language: Optional[str] = typer.Option(None, help="言語(ja/en等)。未指定は設定値"),
     note: Optional[str] = typer.Option(None, help="追加指示(任意)"),
+    cache: Optional[bool] = typer.Option(None, "--cache/--no-cache", help="生成結果キャッシュの使用（未指定は設定値）"),
+    bypass_cache: bool = typer.Option(False, help="キャッシュを読まずに再生成（結果はキャッシュに書き戻す）"),
+    stream: bool = typer.Option(False, help="生成中の本文を逐次表示し、ファイルにも到着順に追記"),
+    sectioned: bool = typer.Option(False, help="セクションごとに並行生成して連結（長文向け）"),
+    usage: bool = typer.Option(False, help="入力/キャッシュ済み/出力トークン数を表示（プロンプトキャッシュの効き具合の確認）"),
 ):
-    settings = AppSettings()
+    from .config import AppSettings
+    from .generator import generate_sectioned_document, generate_text_document, stream_text_document
+    from .metrics import get_recorder
+
+    if stream and sectioned:
+        raise typer.BadParameter("--stream と --sectioned は同時に指定できません")
+    settings = _apply_cache_options(AppSettings(), cache, bypass_cache)
     data = json.loads(project_file.read_text(encoding="utf-8"))
     out.parent.mkdir(parents=True, exist_ok=True)
+    usage_mark = get_recorder(settings).emitted
+
+    if stream:
+        start = time.perf_counter()
+        first_byte: Optional[float] = None
+        for delta in stream_text_document(
+            doc_type=doc_type,
+            project_context=data,
+            out_path=str(out),
+            language=language,
+            extra_instructions=note,
+            settings=settings,
+        ):
+            if first_byte is None:
+                first_byte = time.perf_counter() - start
+            # rich のマークアップ解釈を避けて素のまま出力
+            sys.stdout.write(delta)
+            sys.stdout.flush()
+        total = time.perf_counter() - start
+        sys.stdout.write("\n")
+        print(f"生成しました: {out} (初回出力 {first_byte or total:.2f}s / 合計 {total:.2f}s)")
+        if usage:
+            _print_usage(settings, usage_mark)
+        return
 
-    path = generate_text_document(
+    generate = generate_sectioned_document if sectioned else generate_text_document
+    path = generate(
         doc_type=doc_type,
         project_context=data,
         out_path=str(out),
@@ -98,26 +163,656 @@ def txt(
         settings=settings,
     )
     print(f"生成しました: {path}")
+    if usage:
+        _print_usage(settings, usage_mark)
+
+
+@app.command()
+def batch(
+    project: Path = typer.Option(..., exists=True, help="プロジェクト情報(JSON)、またはJSONを含むディレクトリ"),
+    out_dir: Path = typer.Option(Path("output"), help="出力先ディレクトリ（複数プロジェクト時はプロジェクト名のサブフォルダ）"),
+    doc_type: Optional[List[str]] = typer.Option(None, help="ドキュメント種別キー（複数指定可。未指定は全種別）"),
+    language: Optional[str] = typer.Option(None, help="言語(ja/en等)。未指定は設定値"),
+    note: Optional[str] = typer.Option(None, help="追加指示(任意)"),
+    workers: int = typer.Option(4, min=1, help="同時実行数"),
+    report: Optional[Path] = typer.Option(None, help="サマリをJSONで保存するパス(任意)"),
+    sectioned: bool = typer.Option(False, help="各ドキュメントをセクションごとに並行生成して連結"),
+    cache: Optional[bool] = typer.Option(None, "--cache/--no-cache", help="生成結果キャッシュの使用（未指定は設定値）"),
+    bypass_cache: bool = typer.Option(False, help="キャッシュを読まずに再生成（結果はキャッシュに書き戻す）"),
+    usage: bool = typer.Option(False, help="入力/キャッシュ済み/出力トークン数を表示（プロンプトキャッシュの効き具合の確認）"),
+    journal: bool = typer.Option(True, "--journal/--no-journal", help="進捗をジャーナルに記録（中断しても resume で再開可能）"),
+):
+    """複数ドキュメントを並行生成し、所要時間のサマリを表示します。"""
+    from .batch import generate_documents
+    from .config import AppSettings
+    from .metrics import get_recorder
+
+    settings = _apply_cache_options(AppSettings(), cache, bypass_cache)
+    usage_mark = get_recorder(settings).emitted
+    try:
+        result = generate_documents(
+            project,
+            out_dir,
+            doc_types=doc_type,
+            language=language,
+            extra_instructions=note,
+            settings=settings,
+            max_workers=workers,
+            sectioned=sectioned,
+            journal=journal,
+        )
+    except ValueError as e:
+        raise typer.BadParameter(str(e)) from e
+    _print_batch_result(result, settings, usage, usage_mark, report)
+
+
+def _print_batch_result(result, settings: AppSettings, usage: bool, usage_mark: int, report: Optional[Path]) -> None:
+    from .cache import get_cache
+
+    for r in result.results:
+        mark = "[green]OK[/green]" if r.ok else "[red]NG[/red]"
+        detail = r.out_path if r.ok else r.error
+        print(f"{mark} {Path(r.project).stem}/{r.doc_type} ({r.elapsed:.2f}s): {detail}")
+    print("[bold]サマリ[/bold]")
+    for k, v in result.summary().items():
+        print(f"- {k}: {v}")
+    if settings.cache_enabled:
+        stats = get_cache(settings).stats()
+        print(f"- cache: hits={stats['hits']} misses={stats['misses']}")
+    if usage:
+        _print_usage(settings, usage_mark)
+    if report:
+        report.parent.mkdir(parents=True, exist_ok=True)
+        report.write_text(json.dumps(result.to_dict(), ensure_ascii=False, indent=2), encoding="utf-8")
+        print(f"レポートを保存しました: {report}")
+    if result.job_id:
+        print(f"- job: {result.job_id}")
+    if result.failed:
+        if result.job_id:
+            print(f"失敗分だけ再実行: python -m pmbok_gpt resume {result.job_id}")
+        raise typer.Exit(code=1)
+
+
+@app.command()
+def portfolio(
+    project: Path = typer.Option(..., exists=True, file_okay=False, help="プロジェクト情報(JSON)を含むディレクトリ"),
+    out_dir: Path = typer.Option(Path("output"), help="出力先ディレクトリ（プロジェクト名のサブフォルダに出力）"),
+    doc_type: Optional[List[str]] = typer.Option(None, help="ドキュメント種別キー（複数指定可。未指定は全種別）"),
+    language: Optional[str] = typer.Option(None, help="言語(ja/en等)。未指定は設定値"),
+    note: Optional[str] = typer.Option(None, help="追加指示(任意)"),
+    processes: int = typer.Option(0, min=0, help="プロセス数（0 は CPU コア数）"),
+    concurrency: int = typer.Option(8, min=1, help="1プロセスあたりの同時実行数"),
+    report: Optional[Path] = typer.Option(None, help="サマリをJSONで保存するパス(任意)"),
+    sectioned: bool = typer.Option(False, help="各ドキュメントをセクションごとに並行生成して連結"),
+    usage: bool = typer.Option(False, help="入力/キャッシュ済み/出力トークン数を表示"),
+    export: Optional[List[str]] = typer.Option(None, help="全プロジェクトの登録簿と生成結果を横断表として出力（csv | parquet。複数指定可）"),
+):
+    """多数のプロジェクトを複数プロセスに分担して生成します（CPU コア数に応じてスケール）。"""
+    from .config import AppSettings
+    from .metrics import get_recorder
+    from .portfolio import generate_portfolio
+
+    settings = AppSettings()
+    usage_mark = get_recorder(settings).emitted
+    try:
+        result = generate_portfolio(
+            project,
+            out_dir,
+            doc_types=doc_type,
+            language=language,
+            extra_instructions=note,
+            settings=settings,
+            processes=processes,
+            concurrency=concurrency,
+            sectioned=sectioned,
+        )
+        if export:
+            _export_tables(project, out_dir, export, result.results)
+    except ValueError as e:
+        raise typer.BadParameter(str(e)) from e
+    _print_batch_result(result, settings, usage, usage_mark, report)
+
+
+def _export_tables(project: Path, out_dir: Path, formats: List[str], results=None) -> None:
+    from .batch import collect_project_files
+    from .export import export_portfolio
+
+    try:
+        written = export_portfolio(collect_project_files(project), out_dir, formats=formats, results=results)
+    except RuntimeError as e:
+        raise typer.BadParameter(str(e)) from e
+    for path, count in written.items():
+        print(f"横断表を出力しました: {path} ({count} 行)")
+
+
+@app.command()
+def export(
+    project: Path = typer.Option(..., exists=True, help="プロジェクト情報(JSON)、またはそれを含むディレクトリ"),
+    out_dir: Path = typer.Option(Path("output"), help="出力先ディレクトリ"),
+    format: Optional[List[str]] = typer.Option(None, help="csv | parquet（複数指定可。既定 csv）"),
+):
+    """全プロジェクトのリスク/ステークホルダー登録簿を1つの表（CSV/Parquet）にまとめて出力します。"""
+    try:
+        _export_tables(project, out_dir, format or ["csv"])
+    except ValueError as e:
+        raise typer.BadParameter(str(e)) from e
+
+
+@app.command()
+def resume(
+    job_id: Optional[str] = typer.Argument(None, help="再開するジョブID（省略時はジョブ一覧を表示）"),
+    workers: Optional[int] = typer.Option(None, min=1, help="同時実行数（未指定は開始時の値）"),
+    usage: bool = typer.Option(False, help="入力/キャッシュ済み/出力トークン数を表示"),
+    report: Optional[Path] = typer.Option(None, help="サマリをJSONで保存するパス(任意)"),
+):
+    """中断・失敗した batch ジョブを、完了済みのドキュメントを飛ばして再開します。"""
+    from rich.table import Table
+
+    from .batch import resume_documents
+    from .config import AppSettings
+    from .journal import list_journals
+    from .metrics import get_recorder
+
+    settings = AppSettings()
+    if job_id is None:
+        table = Table(title="batch ジョブ")
+        for c in ("id", "started", "runs", "documents", "done", "failed", "pending", "project"):
+            table.add_column(c)
+        for st in list_journals(settings):
+            counts = st.counts()
+            table.add_row(
+                st.id, time.strftime("%Y-%m-%d %H:%M", time.localtime(st.started)), str(st.runs),
+                *(str(counts[k]) for k in ("documents", "done", "failed", "pending")), str(st.params.get("project", "")),
+            )
+        print(table)
+        return
+    usage_mark = get_recorder(settings).emitted
+    try:
+        result = resume_documents(job_id, settings=settings, max_workers=workers)
+    except (ValueError, OSError) as e:
+        raise typer.BadParameter(str(e)) from e
+    if not result.results:
+        print("すべてのドキュメントが完了しています")
+        return
+    _print_batch_result(result, settings, usage, usage_mark, report)
+
+
+@app.command()
+def build(
+    project: Path = typer.Option(..., exists=True, help="プロジェクト情報(JSON)、またはJSONを含むディレクトリ"),
+    out_dir: Path = typer.Option(Path("output"), help="出力先ディレクトリ（マニフェストもここに保存）"),
+    doc_type: Optional[List[str]] = typer.Option(None, help="ドキュメント種別キー（複数指定可。未指定は全種別）"),
+    language: Optional[str] = typer.Option(None, help="言語(ja/en等)。未指定は設定値"),
+    note: Optional[str] = typer.Option(None, help="追加指示(任意)"),
+    workers: int = typer.Option(4, min=1, help="同時実行数"),
+    sectioned: bool = typer.Option(False, help="各ドキュメントをセクションごとに並行生成して連結"),
+    force: bool = typer.Option(False, help="入力が変わっていなくても全件再生成"),
+    dry_run: bool = typer.Option(False, help="再生成が必要なドキュメントと理由の表示のみ"),
+    usage: bool = typer.Option(False, help="入力/キャッシュ済み/出力トークン数を表示"),
+):
+    """入力（関係するプロジェクト情報・テンプレート・モデル設定等）が変わったドキュメントだけを再生成します。"""
+    from .build import build_documents
+    from .config import AppSettings
+    from .metrics import get_recorder
+
+    settings = AppSettings()
+    usage_mark = get_recorder(settings).emitted
+    try:
+        result = build_documents(
+            project,
+            out_dir,
+            doc_types=doc_type,
+            language=language,
+            extra_instructions=note,
+            settings=settings,
+            max_workers=workers,
+            sectioned=sectioned,
+            force=force,
+            dry_run=dry_run,
+        )
+    except ValueError as e:
+        raise typer.BadParameter(str(e)) from e
+
+    outcomes = {r.out_path: r for r in result.batch.results}
+    for item in result.items:
+        r = outcomes.get(item.out_path)
+        label = f"{Path(item.project).stem}/{item.doc_type}"
+        if not item.stale:
+            print(f"[dim]SKIP[/dim] {label}: 最新")
+        elif r is None:
+            print(f"[yellow]STALE[/yellow] {label}: {', '.join(item.reasons)}")
+        elif r.ok:
+            print(f"[green]OK[/green] {label} ({r.elapsed:.2f}s, {', '.join(item.reasons)}): {r.out_path}")
+        else:
+            print(f"[red]NG[/red] {label} ({r.elapsed:.2f}s): {r.error}")
+    print("[bold]サマリ[/bold]")
+    for k, v in result.summary().items():
+        print(f"- {k}: {v}")
+    if usage:
+        _print_usage(settings, usage_mark)
+    if result.failed:
+        raise typer.Exit(code=1)
+
+
+@app.command()
+def bulk(
+    project: Optional[Path] = typer.Option(None, exists=True, help="プロジェクト情報(JSON)、またはJSONを含むディレクトリ（新規投入時）"),
+    out_dir: Path = typer.Option(Path("output"), help="出力先ディレクトリ（build と同じマニフェストを使用）"),
+    doc_type: Optional[List[str]] = typer.Option(None, help="ドキュメント種別キー（複数指定可。未指定は全種別）"),
+    language: Optional[str] = typer.Option(None, help="言語(ja/en等)。未指定は設定値"),
+    note: Optional[str] = typer.Option(None, help="追加指示(任意)"),
+    force: bool = typer.Option(False, help="入力が変わっていなくても全件投入"),
+    resume: Optional[str] = typer.Option(None, help="再開するジョブID（完了待ちと結果の書き出しを続ける）"),
+    wait: bool = typer.Option(True, "--wait/--no-wait", help="完了まで待つ（--no-wait は投入/状態確認のみ）"),
+    poll_interval: float = typer.Option(30.0, min=0.1, help="状態確認の間隔（秒）"),
+    jobs: bool = typer.Option(False, "--jobs", help="ジョブ一覧を表示"),
+):
+    """Batch API で一括生成します（待ち時間より費用・スループットを優先する大量生成向け）。"""
+    from rich.table import Table
+
+    from .bulk import list_jobs, load_job, poll_bulk, submit_bulk
+    from .config import AppSettings
+
+    settings = AppSettings()
+    if jobs:
+        table = Table(title="Batch API ジョブ")
+        for c in ("id", "created", "model", "status", "rounds", "documents", "ok", "fallback", "failed", "pending", "out_dir"):
+            table.add_column(c)
+        for j in list_jobs(settings):
+            counts = j.counts()
+            table.add_row(
+                j.id, time.strftime("%Y-%m-%d %H:%M", time.localtime(j.created)), j.model, j.status, str(len(j.rounds)),
+                *(str(counts[k]) for k in ("documents", "ok", "fallback", "failed", "pending")), j.out_dir,
+            )
+        print(table)
+        return
+    try:
+        if resume:
+            job = load_job(resume, settings)
+        elif project is not None:
+            job = submit_bulk(
+                project, out_dir, doc_types=doc_type, language=language,
+                extra_instructions=note, settings=settings, force=force,
+            )
+            if job is None:
+                print("すべてのドキュメントが最新です（投入なし）")
+                return
+            print(f"投入しました: job={job.id} batch={job.rounds[-1]['batch_id']} documents={len(job.items)}")
+        else:
+            raise typer.BadParameter("--project（新規投入）または --resume <ジョブID> を指定してください")
+    except (ValueError, RuntimeError) as e:
+        raise typer.BadParameter(str(e)) from e
+
+    def _progress(j, batch) -> None:
+        counts = getattr(batch, "request_counts", None)
+        done = f" {counts.completed + counts.failed}/{counts.total}" if counts else ""
+        print(f"{time.strftime('%H:%M:%S')} {batch.id}: {batch.status}{done}")
+
+    job = poll_bulk(job, settings=settings, wait=wait, poll_interval=poll_interval, on_progress=_progress)
+    for cid, item in job.items.items():
+        result = job.results.get(cid)
+        if result is None:
+            continue
+        mark = "[green]OK[/green]" if result == "ok" else "[yellow]FB[/yellow]" if result == "fallback" else "[red]NG[/red]"
+        print(f"{mark} {Path(item['project']).stem}/{item['doc_type']}: {item['out_path'] if not result.startswith('error') else result}")
+    print(f"[bold]{job.status}[/bold]: {job.counts()}")
+    if job.status != "completed":
+        print(f"再開: python -m pmbok_gpt bulk --resume {job.id}")
+    elif job.counts()["failed"]:
+        raise typer.Exit(code=1)
+
+
+@app.command()
+def watch(
+    project: List[Path] = typer.Option(..., exists=True, help="監視するプロジェクト情報(JSON)、またはJSONを含むディレクトリ（複数指定可）"),
+    out_dir: Path = typer.Option(Path("output"), help="出力先ディレクトリ（マニフェストもここに保存）"),
+    templates: Optional[Path] = typer.Option(None, help="テンプレート上書き(JSON)。変更も監視します"),
+    doc_type: Optional[List[str]] = typer.Option(None, help="ドキュメント種別キー（複数指定可。未指定は全種別）"),
+    language: Optional[str] = typer.Option(None, help="言語(ja/en等)。未指定は設定値"),
+    note: Optional[str] = typer.Option(None, help="追加指示(任意)"),
+    workers: int = typer.Option(4, min=1, help="同時実行数"),
+    sectioned: bool = typer.Option(False, help="各ドキュメントをセクションごとに並行生成して連結"),
+    debounce: float = typer.Option(0.5, min=0.0, help="変更が落ち着くまで待つ秒数"),
+    interval: float = typer.Option(0.25, min=0.05, help="変更を確認する間隔（秒）"),
+):
+    """プロジェクトJSONの変更を監視し、影響のあるドキュメントだけを再生成します（Ctrl+C で終了）。"""
+    import asyncio
+
+    from .batch import resolve_doc_types
+    from .config import AppSettings
+    from .watch import ProjectWatcher
+
+    styles = {"start": "cyan", "ok": "green", "error": "red", "cancel": "yellow", "reload": "magenta"}
+
+    def _event(kind: str, label: str, detail: str) -> None:
+        if kind in styles:
+            stamp = time.strftime("%H:%M:%S")
+            print(f"{stamp} [{styles[kind]}]{kind.upper()}[/{styles[kind]}] {label}: {detail}")
+
+    try:
+        resolve_doc_types(doc_type)
+        watcher = ProjectWatcher(
+            project,
+            out_dir,
+            templates=templates,
+            doc_types=doc_type,
+            language=language,
+            extra_instructions=note,
+            settings=AppSettings(),
+            max_workers=workers,
+            sectioned=sectioned,
+            debounce=debounce,
+            interval=interval,
+            on_event=_event,
+        )
+    except ValueError as e:
+        raise typer.BadParameter(str(e)) from e
+    print(f"[bold]監視を開始しました[/bold]: {', '.join(str(p) for p in watcher.files)} → {out_dir}（Ctrl+C で終了）")
+    try:
+        asyncio.run(watcher.run())
+    except KeyboardInterrupt:
+        pass
+    print(f"[bold]終了[/bold]: {watcher.stats}")
+
+
+@app.command()
+def context(
+    project_file: Path = typer.Option(..., exists=True, help="プロジェクト情報(JSON)"),
+    doc_type: Optional[List[str]] = typer.Option(None, help="ドキュメント種別キー（複数指定可。未指定は全種別）"),
+    budget: Optional[int] = typer.Option(None, help="プロジェクト情報のトークン予算（未指定は設定値から算出）"),
+    projection: Optional[bool] = typer.Option(None, "--projection/--no-projection", help="種別に関係する項目だけに絞るか（未指定は AICPM_CONTEXT_PROJECTION）"),
+    show: bool = typer.Option(False, help="圧縮後のJSONも表示"),
+):
+    """プロンプトに載せるプロジェクト情報の圧縮結果（トークン数・切り詰め内容）を表示します。"""
+    from rich.table import Table
+
+    from .config import AppSettings
+    from .context import canonical_json, compact_context
+    from .generator import context_budget
+    from .templates import DOC_TEMPLATES
+
+    settings = AppSettings()
+    data = json.loads(project_file.read_text(encoding="utf-8"))
+    kinds = doc_type or [k for k in DOC_TEMPLATES]
+    unknown = [k for k in kinds if k not in DOC_TEMPLATES]
+    if unknown:
+        raise typer.BadParameter(f"Unknown doc_type: {', '.join(unknown)}")
+    table = Table(title=f"プロジェクト情報のトークン数（{project_file}）")
+    project = settings.context_projection if projection is None else projection
+    for c in ("doc_type", "budget", "indent=2", "compact", "sent", "saved", "omitted", "trimmed"):
+        table.add_column(c, justify="left" if c in ("doc_type", "trimmed") else "right")
+    for kind in kinds:
+        limit = budget if budget is not None else context_budget(settings.default_language, kind, None, settings)
+        compacted, report = compact_context(data, doc_type=kind, budget=limit, model=settings.model, project=project)
+        table.add_row(
+            kind, str(limit or "-"), str(report.raw_tokens), str(report.compact_tokens), str(report.tokens),
+            str(report.saved_tokens), str(len(report.omitted)), ", ".join(report.trimmed) or "-",
+        )
+        if show:
+            omitted = f" (omitted: {', '.join(report.omitted)})" if report.omitted else ""
+            sys.stdout.write(f"# {kind}{omitted}\n{canonical_json(compacted)}\n")
+    print(table)
+
+
+@app.command("cache")
+def cache_cmd(
+    clear: bool = typer.Option(False, help="キャッシュを全削除"),
+    prune: bool = typer.Option(False, help="期限切れ・件数上限超過のエントリを削除"),
+):
+    """生成結果キャッシュの状態を表示・掃除します。"""
+    from .cache import get_cache
+    from .config import AppSettings
+
+    cache = get_cache(AppSettings())
+    if clear:
+        print(f"削除しました: {cache.clear()} 件")
+    elif prune:
+        print(f"削除しました: {cache.prune()} 件")
+    stats = cache.stats()
+    print("[bold]キャッシュ[/bold]")
+    for k in ("directory", "entries", "bytes"):
+        print(f"- {k}: {stats[k]}")
+
+
+@app.command()
+def stats(
+    path: Optional[Path] = typer.Option(None, help="メトリクス(JSON Lines)のパス。未指定は設定値(AICPM_METRICS_PATH)"),
+    by: str = typer.Option("doc_type,model", help="集計キー（カンマ区切り。例: doc_type,model / provider,api）"),
+    as_json: bool = typer.Option(False, "--json", help="集計結果をJSONで出力"),
+):
+    """LLM呼び出しの所要時間(p50/p95)とトークン数を集計して表示します。"""
+    from rich.table import Table
+
+    from .config import AppSettings
+    from .metrics import load_records, summarize
+
+    settings = AppSettings()
+    source = str(path or settings.metrics_path)
+    if not source:
+        print("AICPM_METRICS_PATH が空のため、計測はメモリ内のみで集計できません（パスを指定すると JSON Lines に記録します）")
+        return
+    rows = load_records(source)
+    keys = [k.strip() for k in by.split(",") if k.strip()]
+    summary = summarize(rows, keys)
+    if as_json:
+        sys.stdout.write(json.dumps(summary, ensure_ascii=False, indent=2) + "\n")
+        return
+    if not summary:
+        print(f"メトリクスがありません: {source}")
+        return
+
+    def _fmt(v):
+        if v is None:
+            return "-"
+        return f"{v:.2f}" if isinstance(v, float) else str(v)
+
+    labels = {
+        "calls": "calls", "errors": "err", "latency_p50": "p50(s)", "latency_p95": "p95(s)",
+        "ttft_p50": "ttft50", "ttft_p95": "ttft95", "prompt_tokens_avg": "in(avg)",
+        "completion_tokens_avg": "out(avg)", "tokens_total": "tokens", "param_retries": "retry",
+        "retries": "backoff", "queue_wait_p95": "wait95",
+        "cached_tokens_total": "cached", "prompt_cache_ratio": "pcache",
+        "context_saved_tokens_total": "ctx-", "context_trimmed_calls": "trim",
+        "stub_fallbacks": "stub", "cache_hits": "cache",
+    }
+    columns = keys + [c for c in labels]
+    table = Table(title=f"LLM呼び出し統計 ({len(rows)} 件: {source})")
+    for c in columns:
+        table.add_column(labels.get(c, c), justify="left" if c in keys else "right")
+    for row in summary:
+        table.add_row(*[_fmt(row.get(c)) for c in columns])
+    print(table)
+
+
+@app.command()
+def bench(
+    projects: int = typer.Option(4, min=1, help="合成プロジェクト数"),
+    doc_type: Optional[List[str]] = typer.Option(None, help="ドキュメント種別キー（複数指定可。未指定は全種別）"),
+    workers: int = typer.Option(8, min=1, help="concurrent / async シナリオの同時実行数"),
+    scenario: Optional[List[str]] = typer.Option(None, help="serial | concurrent | async | cached（複数指定可。未指定は全て）"),
+    model: Optional[str] = typer.Option(None, help="疑似APIに送るモデル名（拒否されるパラメータが変わる。例: gpt-5-mini）"),
+    ttft: float = typer.Option(0.6, help="最初のトークンまでの秒数（実API相当）"),
+    per_token: float = typer.Option(0.02, help="出力1トークンあたりの秒数（実API相当）"),
+    output_tokens: int = typer.Option(600, min=1, help="1応答あたりの出力トークン数"),
+    jitter: float = typer.Option(0.25, min=0.0, help="レイテンシの揺らぎ（対数正規のσ）"),
+    error_rate: float = typer.Option(0.0, min=0.0, max=1.0, help="一時エラー(5xx)の発生率"),
+    rate_limit_rate: float = typer.Option(0.0, min=0.0, max=1.0, help="レート制限(429)の発生率"),
+    reject: Optional[List[str]] = typer.Option(None, help="拒否するパラメータ（max_tokens/temperature/response_format/max_output_tokens。未指定はモデル名から決定）"),
+    time_scale: float = typer.Option(0.01, min=0.0, help="待ち時間の倍率（0.01 = 100倍速）"),
+    seed: int = typer.Option(0, help="乱数シード"),
+    as_json: bool = typer.Option(False, "--json", help="結果をJSONで出力"),
+    report: Optional[Path] = typer.Option(None, help="結果をJSONで保存するパス(任意)"),
+):
+    """疑似APIでパイプラインを計測します（APIキー・課金不要）。"""
+    from rich.table import Table
+
+    from .bench import SCENARIOS, SimulationProfile, run_benchmark
+    from .config import AppSettings
+
+    profile = SimulationProfile(
+        ttft=ttft,
+        per_token=per_token,
+        output_tokens=output_tokens,
+        jitter=jitter,
+        error_rate=error_rate,
+        rate_limit_rate=rate_limit_rate,
+        reject_params=reject or None,
+        time_scale=time_scale,
+        seed=seed,
+    )
+    settings = AppSettings()
+    if model:
+        settings = settings.model_copy(update={"model": model})
+    try:
+        result = run_benchmark(
+            projects=projects,
+            doc_types=doc_type,
+            workers=workers,
+            profile=profile,
+            scenarios=scenario or SCENARIOS,
+            settings=settings,
+        )
+    except ValueError as e:
+        raise typer.BadParameter(str(e)) from e
+
+    data = result.to_dict()
+    if report:
+        report.parent.mkdir(parents=True, exist_ok=True)
+        report.write_text(json.dumps(data, ensure_ascii=False, indent=2), encoding="utf-8")
+    if as_json:
+        sys.stdout.write(json.dumps(data, ensure_ascii=False, indent=2) + "\n")
+        return
+
+    labels = {
+        "name": "scenario", "documents": "docs", "failed": "NG", "wall_clock": "wall(s)",
+        "throughput": "docs/s", "latency_p50": "p50(s)", "latency_p95": "p95(s)", "latency_p99": "p99(s)",
+        "latency_max": "max(s)", "param_rejections": "reject", "simulated_errors": "5xx",
+        "rate_limited": "429", "prompt_cache_ratio": "pcache",
+    }
+    table = Table(
+        title=f"ベンチマーク（model={result.model}, {projects} プロジェクト x {len(result.doc_types)} 種別, workers={workers}）"
+    )
+    for c, label in labels.items():
+        table.add_column(label, justify="left" if c == "name" else "right")
+    for row in data["scenarios"]:
+        table.add_row(*["-" if row[c] is None else f"{row[c]:.3f}" if isinstance(row[c], float) else str(row[c]) for c in labels])
+    print(table)
+    if report:
+        print(f"レポートを保存しました: {report}")
+
+
+@app.command("mock-server")
+def mock_server(
+    host: str = typer.Option("127.0.0.1", help="待ち受けホスト"),
+    port: int = typer.Option(8765, min=0, help="待ち受けポート（0 で空きポート）"),
+    ttft: float = typer.Option(0.6, help="最初のトークンまでの秒数"),
+    per_token: float = typer.Option(0.02, help="出力1トークンあたりの秒数"),
+    output_tokens: int = typer.Option(600, min=1, help="1応答あたりの出力トークン数"),
+    jitter: float = typer.Option(0.25, min=0.0, help="レイテンシの揺らぎ（対数正規のσ）"),
+    error_rate: float = typer.Option(0.0, min=0.0, max=1.0, help="一時エラー(500)の発生率"),
+    rate_limit_rate: float = typer.Option(0.0, min=0.0, max=1.0, help="レート制限(429)の発生率"),
+    retry_after: float = typer.Option(1.0, min=0.0, help="429 で返す Retry-After 秒数"),
+    reject: Optional[List[str]] = typer.Option(None, help="拒否するパラメータ（未指定はモデル名から決定。例: gpt-5 系は max_tokens/temperature）"),
+    time_scale: float = typer.Option(1.0, min=0.0, help="待ち時間の倍率（0.1 = 10倍速）"),
+    seed: int = typer.Option(0, help="乱数シード"),
+    verbose: bool = typer.Option(False, help="リクエストごとのアクセスログを表示"),
+):
+    """OpenAI互換の疑似APIサーバを起動します（負荷試験・CI用。Ctrl+Cで停止）。"""
+    from .bench import SimulationProfile
+    from .mock_server import MockOpenAIServer
+
+    profile = SimulationProfile(
+        ttft=ttft,
+        per_token=per_token,
+        output_tokens=output_tokens,
+        jitter=jitter,
+        error_rate=error_rate,
+        rate_limit_rate=rate_limit_rate,
+        retry_after=retry_after,
+        reject_params=reject or None,
+        time_scale=time_scale,
+        seed=seed,
+    )
+    server = MockOpenAIServer(host, port, profile=profile, verbose=verbose)
+    print(f"疑似APIサーバを起動しました: [bold]{server.base_url}[/bold]")
+    print(f"- 接続先: OPENAI_BASE_URL={server.base_url} （APIキーは任意の値で可）")
+    print(f"- 統計: GET {server.base_url.rsplit('/v1', 1)[0]}/stats")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        stats = server.stats()
+        server.stop()
+        print(f"停止しました: {stats}")
 
 
 @app.command()
 def excel(
     type: str = typer.Option(..., help="risk-register | stakeholder-register"),
-    out: Path = typer.Option(..., help="出力先 .xlsx ファイルパス"),
+    out: Path = typer.Option(..., help="出力先ファイルパス（.xlsx。.csv / .parquet なら表形式で出力）"),
+    project_file: Optional[Path] = typer.Option(None, exists=True, help="行を埋めるプロジェクト情報(JSON)。risk_seeds / stakeholders を使用"),
+    rows: Optional[Path] = typer.Option(None, exists=True, help="追加の行（JSON配列、または1行1件の .jsonl。LLMで展開したリスク等）"),
+    expand: bool = typer.Option(False, help="risk_seeds を LLM で登録簿の各列まで展開する（risk-register のみ。複数件を1回の呼び出しでJSON出力）"),
+    chunk_size: int = typer.Option(20, min=1, help="--expand で1回の呼び出しにまとめる件数"),
+    language: Optional[str] = typer.Option(None, help="--expand の出力言語(ja/en等)。未指定は設定値"),
+    upsert: bool = typer.Option(True, "--upsert/--overwrite", help="既存ファイルは ID 列で突き合わせて変わったセルだけ更新（--overwrite で作り直す）"),
 ):
+    from itertools import chain
+
+    from .config import AppSettings
+    from .excel import create_register_excel, load_register_rows, upsert_register_excel
+
     out.parent.mkdir(parents=True, exist_ok=True)
-    if type == "risk-register":
-        path = create_risk_register_excel(str(out))
-    elif type == "stakeholder-register":
-        path = create_stakeholder_register_excel(str(out))
-    else:
-        raise typer.BadParameter("type は 'risk-register' または 'stakeholder-register'")
-    print(f"生成しました: {path}")
+    project = json.loads(project_file.read_text(encoding="utf-8")) if project_file else None
+    extra = load_register_rows(rows) if rows else ()
+    result = None
+    if expand:
+        if type != "risk-register" or project is None:
+            raise typer.BadParameter("--expand は --type risk-register と --project-file を指定して使います")
+        from .risks import RiskExpansionReport, expand_risks
+
+        result = RiskExpansionReport()
+        expanded = expand_risks(project, language=language, settings=AppSettings(), chunk_size=chunk_size, report=result)
+        # 展開済みの行で置き換えるため、プロジェクトJSONの risk_seeds はそのまま使わない
+        project, extra = None, chain(expanded, extra)
+    try:
+        if out.suffix.lower() in (".csv", ".parquet"):
+            from .export import export_register
+
+            try:
+                print(f"生成しました: {export_register(type, out, project=project, rows=extra)}")
+            except RuntimeError as e:
+                raise typer.BadParameter(str(e)) from e
+        elif upsert and out.exists():
+            changes = upsert_register_excel(type, str(out), project=project, rows=extra)
+            print(
+                f"更新しました: {out} (追加 {changes.added} / 更新 {changes.updated} / 変更なし {changes.unchanged} 行、"
+                f"セル {changes.cells} 件、手修正を残したセル {changes.kept} 件)"
+                if changes.saved else f"変更はありません: {out}"
+            )
+        else:
+            print(f"生成しました: {create_register_excel(type, str(out), project=project, rows=extra)}")
+    except ValueError as e:
+        raise typer.BadParameter(str(e)) from e
+    if result is not None:
+        print(
+            f"- risks: seeds={result.seeds} calls={result.calls} rows={result.rows} "
+            f"unexpanded={result.fallback_rows} ({result.wall_clock:.2f}s)"
+        )
+        for error in result.errors:
+            print(f"[yellow]展開できませんでした[/yellow] {error}")
 
 
 @app.command()
-def diag():  # type: ignore[override]
+def diag(
+    capabilities: bool = typer.Option(False, help="学習済みのモデル別パラメータ互換情報を表示"),
+    reset_capabilities: bool = typer.Option(False, help="学習済みのパラメータ互換情報を全削除"),
+):  # type: ignore[override]
     """環境設定の診断情報を表示します。"""
+    from .capabilities import get_registry
+    from .config import AppSettings
+
     settings = AppSettings()
     # 実効的な BASE_URL を確認（空文字は未設定扱い）
     base_url_env = (settings.openai_base_url or os.getenv("OPENAI_BASE_URL") or "").strip()
@@ -138,12 +833,35 @@ def diag():  # type: ignore[override]
         "azure_api_key_set": bool(settings.azure_openai_api_key or os.getenv("AZURE_OPENAI_API_KEY")),
         "azure_endpoint": settings.azure_openai_endpoint or os.getenv("AZURE_OPENAI_ENDPOINT") or "",
         "azure_api_version": settings.azure_openai_api_version,
+        "cache_enabled": settings.cache_enabled,
+        "learn_capabilities": settings.learn_capabilities,
+        "metrics_enabled": settings.metrics_enabled,
+        "metrics_path": settings.metrics_path or "(memory only)",
+        "scheduler_enabled": settings.scheduler_enabled,
+        "rate_limit_rpm": settings.rate_limit_rpm or "(unlimited)",
+        "rate_limit_tpm": settings.rate_limit_tpm or "(unlimited)",
+        "max_concurrency": settings.max_concurrency,
     }
     print("[bold]診断結果[/bold]")
     for k, v in info.items():
         # APIキーは有無のみ表示
         print(f"- {k}: {v}")
 
+    registry = get_registry(settings)
+    if reset_capabilities:
+        print(f"パラメータ互換情報を削除しました: {registry.reset()} 件 ({registry.path})")
+    if capabilities:
+        print(f"[bold]パラメータ互換情報[/bold] ({registry.path})")
+        entries = registry.all()
+        if not entries:
+            print("- (記録なし)")
+        for key, entry in entries.items():
+            print(f"- {key}: {json.dumps(entry, ensure_ascii=False, sort_keys=True)}")
+
+
+# diag の別名
+app.command("doctor")(diag)
+
 
 @app.command()
 def wizard(
@@ -153,6 +871,9 @@ def wizard(
     level: str = typer.Option("extended", help="収集レベル: basic | extended (既定: extended)"),
 ):
     """ChatGPT（またはスタブ）と対話し、プロジェクトJSONを作成します。"""
+    from .config import AppSettings
+    from .wizard import run_project_wizard
+
     settings = AppSettings()
     try:
         path = run_project_wizard(
@@ -0,0 +1,105 @@
+from __future__ import annotations
+
+import asyncio
+import hashlib
+import threading
+import weakref
+from typing import Any, Dict, Optional, Tuple
+
+from .config import AppSettings
+
+# 同期クライアント: キー -> クライアント
+_clients: Dict[Tuple[Any, ...], Any] = {}
+# 非同期クライアントはイベントループごとに保持（httpx.AsyncClient の接続はループに紐づくため）
+_async_clients: "weakref.WeakKeyDictionary[asyncio.AbstractEventLoop, Dict[Tuple[Any, ...], Any]]" = (
+    weakref.WeakKeyDictionary()
+)
+_lock = threading.Lock()
+
+
+def _fingerprint(secret: Optional[str]) -> str:
+    # APIキーそのものはキーに保持しない
+    return hashlib.sha256((secret or "").encode("utf-8")).hexdigest()[:16]
+
+
+def client_key(kind: str, api_key: Optional[str], endpoint: Optional[str], api_version: Optional[str], settings: AppSettings) -> Tuple[Any, ...]:
+    """資格情報・エンドポイント・APIバージョン・接続プール設定・再送の担当からなるレジストリのキー。"""
+    return (
+        kind,
+        _fingerprint(api_key),
+        (endpoint or "").rstrip("/"),
+        api_version or "",
+        settings.http_max_connections,
+        settings.http_max_keepalive_connections,
+        settings.http_keepalive_expiry,
+        settings.scheduler_enabled,
+    )
+
+
+def _limits(settings: AppSettings) -> Any:
+    import httpx  # openai の依存として導入済み
+
+    return httpx.Limits(
+        max_connections=settings.http_max_connections,
+        max_keepalive_connections=settings.http_max_keepalive_connections,
+        keepalive_expiry=settings.http_keepalive_expiry,
+    )
+
+
+def _build(kind: str, api_key: Optional[str], endpoint: Optional[str], api_version: Optional[str], settings: AppSettings, *, use_async: bool) -> Any:
+    import openai  # lazy import
+
+    http_client_cls = openai.DefaultAsyncHttpxClient if use_async else openai.DefaultHttpxClient
+    http_client = http_client_cls(limits=_limits(settings))
+    # スケジューラが再送を受け持つ場合は SDK の自動リトライを止める（二重の再送を防ぐ）
+    retries: Dict[str, Any] = {"max_retries": 0} if settings.scheduler_enabled else {}
+    if kind == "azure":
+        cls = openai.AsyncAzureOpenAI if use_async else openai.AzureOpenAI
+        return cls(api_key=api_key, api_version=api_version, azure_endpoint=endpoint, http_client=http_client, **retries)
+    cls = openai.AsyncOpenAI if use_async else openai.OpenAI
+    return cls(api_key=api_key, base_url=endpoint or None, http_client=http_client, **retries)
+
+
+def get_client(kind: str, api_key: Optional[str], endpoint: Optional[str], api_version: Optional[str], settings: AppSettings) -> Any:
+    """同一キーの同期クライアント（=接続プール）をプロセス内で共有して返す。"""
+    key = client_key(kind, api_key, endpoint, api_version, settings)
+    with _lock:
+        client = _clients.get(key)
+        if client is None:
+            client = _build(kind, api_key, endpoint, api_version, settings, use_async=False)
+            _clients[key] = client
+        return client
+
+
+def get_async_client(kind: str, api_key: Optional[str], endpoint: Optional[str], api_version: Optional[str], settings: AppSettings) -> Any:
+    """実行中のイベントループごとに共有する非同期クライアントを返す。"""
+    loop = asyncio.get_running_loop()
+    key = client_key(kind, api_key, endpoint, api_version, settings)
+    with _lock:
+        per_loop = _async_clients.setdefault(loop, {})
+        client = per_loop.get(key)
+        if client is None:
+            client = _build(kind, api_key, endpoint, api_version, settings, use_async=True)
+            per_loop[key] = client
+        return client
+
+
+def pool_stats() -> Dict[str, int]:
+    with _lock:
+        return {
+            "clients": len(_clients),
+            "async_clients": sum(len(v) for v in _async_clients.values()),
+        }
+
+
+def close_clients() -> None:
+    """共有中の同期クライアントを閉じてレジストリを空にする（非同期側は参照のみ破棄）。"""
+    with _lock:
+        clients = list(_clients.values())
+        _clients.clear()
+        _async_clients.clear()
+    for client in clients:
+        try:
+            client.close()
+        except Exception:
+            pass
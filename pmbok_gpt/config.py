@@ -1,13 +1,33 @@
 from __future__ import annotations
 
-from typing import Optional
+import threading
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Any, Iterator, Optional
 from pydantic import Field
 from pydantic_settings import BaseSettings, SettingsConfigDict
-from dotenv import load_dotenv
 
-# .env を OS 環境変数に読み込む（pydantic-settings の読み込みとは独立に）
-# これにより model_post_init の os.getenv(...) が期待通りに動作します。
-load_dotenv()
+_dotenv_loaded = False
+_dotenv_lock = threading.Lock()
+
+# 呼び出し単位の出力上限（セクション分割生成・リスク展開など）。プロバイダの settings.max_tokens より優先する
+_max_tokens_override: ContextVar[Optional[int]] = ContextVar("aicpm_max_tokens", default=None)
+
+
+def load_env() -> None:
+    """.env を OS 環境変数に読み込む（pydantic-settings の読み込みとは独立に。プロセスで1回だけ）。
+
+    これにより model_post_init の os.getenv(...) が期待通りに動作します。
+    import 時ではなく最初に AppSettings を作るときに呼ぶため、設定を使わないコマンドは待たされません。
+    """
+    global _dotenv_loaded
+    with _dotenv_lock:
+        if _dotenv_loaded:
+            return
+        from dotenv import load_dotenv
+
+        load_dotenv()
+        _dotenv_loaded = True
 
 
 class AppSettings(BaseSettings):
@@ -30,6 +50,72 @@ class AppSettings(BaseSettings):
     # Chat Completions ではなく Responses API を優先的に使うか（OpenAI のみ）
     use_responses_api: bool = False
 
+    # 生成結果のディスクキャッシュ（同一プロンプト・同一モデル設定の再生成を省略）
+    cache_enabled: bool = False
+    cache_dir: str = ".cache/pmbok_gpt/responses"
+    # 有効期限（秒）。0 で無期限
+    cache_ttl_seconds: int = 7 * 24 * 3600
+    # 保持する最大件数。0 で無制限
+    cache_max_entries: int = 2000
+    # True でキャッシュを読まずに再生成（結果は書き戻す）
+    cache_bypass: bool = False
+
+    # LLM 呼び出しの計測（所要時間・トークン数・分岐）。metrics_path に JSON Lines で追記する（空文字ならメモリ内のみ）
+    metrics_enabled: bool = True
+    metrics_path: str = ".cache/pmbok_gpt/metrics.jsonl"
+    # metrics_path がこのサイズを超えたら <path>.1 に退避して新しいファイルに切り替える。0 で無制限
+    metrics_max_bytes: int = 50 * 1024 * 1024
+
+    # HTTP 接続プール（同一資格情報・エンドポイントのクライアントはプロセス内で共有）
+    http_max_connections: int = 100
+    http_max_keepalive_connections: int = 20
+    http_keepalive_expiry: float = 60.0
+
+    # セクション単位の並行生成（--sectioned）: 1セクションあたりの最小トークン数と同時実行数（0=セクション数）
+    section_min_tokens: int = 256
+    section_workers: int = 0
+
+    # プロンプトに載せるプロジェクト情報のトークン予算
+    # prompt_token_budget はプロンプト全体の上限（0 なら context_window - max_tokens）。
+    # 超える場合はドキュメント種別との関連が薄い項目から切り詰める（context_window も 0 なら切り詰めない）
+    context_window: int = 128000
+    prompt_token_budget: int = 0
+    # True でドキュメント種別に関係する項目（templates.DOC_CONTEXT_FIELDS）だけを送る。
+    # 既定は False（全種別で同じプロジェクト情報を送り、同じプロジェクトの各ドキュメントでプロンプトキャッシュを共有する）
+    context_projection: bool = False
+
+    # 呼び出しスケジューラ（RPM/TPM の上限と 429/5xx の再送）。0 は無制限
+    # 有効時は SDK 側の自動リトライを止め、こちらで Retry-After とバックオフを扱う
+    scheduler_enabled: bool = True
+    rate_limit_rpm: int = 0
+    rate_limit_tpm: int = 0
+    max_concurrency: int = 16
+    retry_max_attempts: int = 6
+    retry_base_delay: float = 0.5
+    retry_max_delay: float = 30.0
+
+    # 予備のバックエンド（フェイルオーバー・ヘッジ先）。secondary_provider は openai | azure（空は主と同じ）、
+    # secondary_model は空なら主と同じモデル。どちらも空なら予備を使わない
+    secondary_provider: str = ""
+    secondary_model: str = ""
+    # 主の応答が hedge_delay 秒を過ぎても返らなければ、予備にも同じ依頼を送って先に返った方を使う
+    # hedge_delay が 0 なら主の直近の応答時間の p{hedge_percentile}（hedge_min_samples 件たまるまではヘッジしない）
+    hedge_enabled: bool = False
+    hedge_delay: float = 0.0
+    hedge_percentile: float = 95.0
+    hedge_min_samples: int = 20
+
+    # batch 実行のジャーナル（タスクごとの完了を記録し、中断したジョブを resume で再開）
+    jobs_dir: str = ".cache/pmbok_gpt/jobs"
+
+    # Batch API による一括生成（bulk）: 完了期限と、再開用のジョブ記録の保存先
+    batch_completion_window: str = "24h"
+    batch_jobs_dir: str = ".cache/pmbok_gpt/batch_jobs"
+
+    # モデルごとに通ったパラメータ形（max_completion_tokens/temperature 等）を記録し、次回から最初に使う
+    learn_capabilities: bool = True
+    capabilities_path: str = ".cache/pmbok_gpt/capabilities.json"
+
     # OpenAI（個別の環境変数から読み込み）
     openai_api_key: Optional[str] = None
     openai_base_url: Optional[str] = None
@@ -39,6 +125,10 @@ class AppSettings(BaseSettings):
     azure_openai_endpoint: Optional[str] = None
     azure_openai_api_version: Optional[str] = "2024-08-01-preview"
 
+    def __init__(self, **values: Any) -> None:
+        load_env()
+        super().__init__(**values)
+
     def model_post_init(self, __context) -> None:  # type: ignore[override]
         import os
         self.openai_api_key = os.getenv("OPENAI_API_KEY", self.openai_api_key)
@@ -47,9 +137,24 @@ class AppSettings(BaseSettings):
         self.azure_openai_endpoint = os.getenv("AZURE_OPENAI_ENDPOINT", self.azure_openai_endpoint)
         self.azure_openai_api_version = os.getenv("AZURE_OPENAI_API_VERSION", self.azure_openai_api_version)
 
+    def effective_max_tokens(self) -> int:
+        """この呼び出しで送る出力上限（max_tokens_limit の中ならその値）。"""
+        override = _max_tokens_override.get()
+        return self.max_tokens if override is None else override
+
     def provider_kind(self) -> str:
         if self.use_stub:
             return "stub"
         if self.azure_openai_api_key and self.azure_openai_endpoint:
             return "azure"
         return "openai"
+
+
+@contextmanager
+def max_tokens_limit(max_tokens: int) -> Iterator[None]:
+    """この中で行う LLM 呼び出しの max_tokens を上書きする（呼び出し側から渡されたプロバイダにも効く）。"""
+    token = _max_tokens_override.set(max_tokens)
+    try:
+        yield
+    finally:
+        _max_tokens_override.reset(token)
@@ -0,0 +1,232 @@
+from __future__ import annotations
+
+import copy
+import json
+import threading
+from dataclasses import dataclass, field
+from typing import Any, Dict, List, Optional, Sequence, Set, Tuple
+
+from .templates import BUILTIN_TEMPLATES, TemplateSet
+
+# すべての種別で最後まで残す項目
+CORE_FIELDS: Tuple[str, ...] = ("name", "objectives")
+
+_Path = Tuple[str, ...]
+
+
+def canonical_json(data: Any) -> str:
+    """キー順・区切りを固定したコンパクトな JSON（同じ内容なら常に同じ文字列）。"""
+    return json.dumps(data, ensure_ascii=False, sort_keys=True, separators=(",", ":"))
+
+
+def prune_empty(value: Any) -> Any:
+    """None・空文字・空リスト・空辞書を再帰的に取り除く（0 や False は残す）。"""
+    if isinstance(value, dict):
+        pruned = {k: prune_empty(v) for k, v in value.items()}
+        return {k: v for k, v in pruned.items() if not _is_empty(v)}
+    if isinstance(value, list):
+        pruned_items = [prune_empty(v) for v in value]
+        return [v for v in pruned_items if not _is_empty(v)]
+    if isinstance(value, str):
+        return value.strip()
+    return value
+
+
+def _is_empty(value: Any) -> bool:
+    return value is None or (isinstance(value, (str, list, dict)) and len(value) == 0)
+
+
+def estimate_tokens(text: str) -> int:
+    """トークン数の概算（ASCII は約4文字/トークン、それ以外は1文字/トークン）。"""
+    ascii_chars = sum(1 for ch in text if ord(ch) < 128)
+    return (ascii_chars + 3) // 4 + (len(text) - ascii_chars)
+
+
+_encoders: Dict[str, Any] = {}
+_encoders_lock = threading.Lock()
+
+
+def _encoder(model: str) -> Any:
+    with _encoders_lock:
+        if model in _encoders:
+            return _encoders[model]
+        try:
+            import tiktoken  # 任意依存（未導入なら概算）
+        except ImportError:
+            enc = None
+        else:
+            try:
+                enc = tiktoken.encoding_for_model(model)
+            except KeyError:
+                enc = tiktoken.get_encoding("o200k_base")
+            except Exception:
+                # 語彙ファイルを取得できない（オフライン等）場合も概算に切り替える
+                enc = None
+        _encoders[model] = enc
+        return enc
+
+
+def count_tokens(text: str, model: Optional[str] = None) -> int:
+    """tiktoken があれば正確に、なければ estimate_tokens で数える。"""
+    enc = _encoder(model or "")
+    if enc is None:
+        return estimate_tokens(text)
+    return len(enc.encode(text, disallowed_special=()))
+
+
+@dataclass
+class CompactionReport:
+    """1回分の圧縮結果（トークン数は project_context 部分のみ）。"""
+
+    raw_tokens: int  # 従来の indent=2 の JSON
+    compact_tokens: int  # 空項目の除去 + コンパクトな JSON
+    tokens: int  # 予算に合わせて切り詰めた後（実際に送る量）
+    budget: int = 0
+    trimmed: List[str] = field(default_factory=list)
+    omitted: List[str] = field(default_factory=list)  # doc_type と無関係として送らなかった項目
+
+    @property
+    def saved_tokens(self) -> int:
+        return self.raw_tokens - self.tokens
+
+
+def _schema_fields(templates: TemplateSet) -> Set[str]:
+    return set(CORE_FIELDS).union(*templates.context_fields.values())
+
+
+def project_fields(
+    project_context: Dict[str, Any],
+    doc_type: Optional[str],
+    templates: Optional[TemplateSet] = None,
+) -> Tuple[Dict[str, Any], List[str]]:
+    """doc_type が参照する項目だけに絞ったプロジェクト情報と、外した項目名を返す。
+
+    スキーマにない独自の項目と、未知の doc_type の場合はすべて残します。
+    """
+    templates = templates or BUILTIN_TEMPLATES
+    fields = templates.context_fields.get(doc_type or "")
+    if fields is None:
+        return project_context, []
+    keep = set(CORE_FIELDS).union(fields)
+    known = _schema_fields(templates)
+    omitted = [k for k in project_context if k in known and k not in keep]
+    return {k: v for k, v in project_context.items() if k not in omitted}, omitted
+
+
+def _list_paths(data: Dict[str, Any]) -> List[Tuple[_Path, int]]:
+    # トップレベルと、その直下の辞書（scope.in など）にあるリスト
+    paths: List[Tuple[_Path, int]] = []
+    for key, value in data.items():
+        if isinstance(value, list):
+            paths.append(((key,), len(value)))
+        elif isinstance(value, dict):
+            paths.extend(((key, k), len(v)) for k, v in value.items() if isinstance(v, list))
+    return paths
+
+
+def _truncate_strings(value: Any, limit: int) -> Any:
+    if isinstance(value, dict):
+        return {k: _truncate_strings(v, limit) for k, v in value.items()}
+    if isinstance(value, list):
+        return [_truncate_strings(v, limit) for v in value]
+    if isinstance(value, str) and len(value) > limit:
+        return value[:limit] + "…"
+    return value
+
+
+def _apply(data: Dict[str, Any], keep: Dict[_Path, int], str_limit: Optional[int], dropped: Sequence[str]) -> Dict[str, Any]:
+    out = copy.deepcopy({k: v for k, v in data.items() if k not in dropped})
+    for path, n in keep.items():
+        if path[0] in dropped:
+            continue
+        parent = out
+        for key in path[:-1]:
+            parent = parent[key]
+        items = parent[path[-1]]
+        if len(items) > n:
+            # 省略した件数を残し、モデルが「これで全部」と誤解しないようにする
+            parent[path[-1]] = items[:n] + [f"…他{len(items) - n}件（省略）"]
+    if str_limit:
+        out = _truncate_strings(out, str_limit)
+    return out
+
+
+def _fit(
+    data: Dict[str, Any], doc_type: Optional[str], budget: int, model: Optional[str], templates: TemplateSet
+) -> Tuple[Dict[str, Any], List[str]]:
+    relevant = set(CORE_FIELDS) | set(templates.context_fields.get(doc_type or "", []))
+    paths = _list_paths(data)
+    original = dict(paths)
+    keep: Dict[_Path, int] = dict(original)
+    dropped: List[str] = []
+    str_limit: Optional[int] = None
+
+    def _size() -> int:
+        return count_tokens(canonical_json(_apply(data, keep, str_limit, dropped)), model)
+
+    def _shrink(paths_: List[_Path], floor: int) -> None:
+        for path in paths_:
+            while _size() > budget:
+                n = max(floor, keep[path] // 2)
+                # 1件だけ省くと「…他1件」の注記の方が長くなるため、2件以上減らせるときのみ
+                if original[path] - n < 2 or n >= keep[path]:
+                    break
+                keep[path] = n
+
+    irrelevant = sorted((p for p, _ in paths if p[0] not in relevant), key=lambda p: -original[p])
+    related = sorted((p for p, _ in paths if p[0] in relevant), key=lambda p: -original[p])
+    # 1) 関連の薄い項目のリスト → 2) 関連項目のリスト（3件まで）
+    _shrink(irrelevant, 1)
+    _shrink(related, 3)
+    # 3) 関連の薄い項目を大きい順に外す
+    if _size() > budget:
+        sizes = {k: count_tokens(canonical_json(v), model) for k, v in data.items() if k not in relevant}
+        for key in sorted(sizes, key=lambda k: -sizes[k]):
+            dropped.append(key)
+            if _size() <= budget:
+                break
+    # 4) 長い文字列を切り詰める → 5) 関連項目のリストも1件まで
+    for limit in (200, 80):
+        before = _size()
+        if before <= budget:
+            break
+        str_limit, previous = limit, str_limit
+        if _size() >= before:
+            str_limit = previous
+    _shrink(related, 1)
+
+    notes = [f"{'.'.join(p)}: {original[p]}→{n}" for p, n in keep.items() if n < original[p] and p[0] not in dropped]
+    if str_limit:
+        notes.append(f"strings>{str_limit}")
+    notes.extend(f"-{k}" for k in dropped)
+    return _apply(data, keep, str_limit, dropped), notes
+
+
+def compact_context(
+    project_context: Dict[str, Any],
+    *,
+    doc_type: Optional[str] = None,
+    budget: int = 0,
+    model: Optional[str] = None,
+    project: bool = False,
+    templates: Optional[TemplateSet] = None,
+) -> Tuple[Dict[str, Any], CompactionReport]:
+    """プロンプトに載せるプロジェクト情報を圧縮する。
+
+    空項目を除き、project=True なら doc_type に関係する項目だけに絞ります（project_fields）。
+    budget（トークン。0 は無制限）を超える場合は doc_type との関連が薄い項目から
+    リストの件数・長い文字列・項目そのものの順に切り詰めます。
+    templates は種別ごとの参照項目の出どころ（省略時は組み込み）。
+    """
+    templates = templates or BUILTIN_TEMPLATES
+    raw_tokens = count_tokens(json.dumps(project_context, ensure_ascii=False, indent=2), model)
+    data = prune_empty(project_context)
+    compact_tokens = count_tokens(canonical_json(data), model)
+    report = CompactionReport(raw_tokens=raw_tokens, compact_tokens=compact_tokens, tokens=compact_tokens, budget=budget)
+    if project and isinstance(data, dict):
+        data, report.omitted = project_fields(data, doc_type, templates)
+        report.tokens = count_tokens(canonical_json(data), model)
+    if budget and report.tokens > budget and isinstance(data, dict):
+        data, report.trimmed = _fit(data, doc_type, budget, model, templates)
+        report.tokens = count_tokens(canonical_json(data), model)
+    return data, report
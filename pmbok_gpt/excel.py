@@ -1,8 +1,15 @@
 from __future__ import annotations
 
-from typing import Iterable, List
-from openpyxl import Workbook
-from openpyxl.worksheet.worksheet import Worksheet
+import hashlib
+import json
+from dataclasses import dataclass
+from itertools import chain
+from pathlib import Path
+from typing import Any, Callable, Dict, Iterable, Iterator, List, Mapping, Optional, Tuple
+from openpyxl import Workbook, load_workbook
+from openpyxl.utils import get_column_letter
+
+from .atomic import atomic_path
 
 
 RISK_HEADERS: List[str] = [
@@ -33,31 +40,341 @@ STAKEHOLDER_HEADERS: List[str] = [
     "メモ",
 ]
 
+# 各列に対応する行データ（dict）のキー。見出しそのもの（例: "リスク事象"）をキーにしても構いません
+RISK_KEYS: List[str] = [
+    "id", "event", "category", "cause", "impact", "probability", "score",
+    "strategy", "response", "owner", "trigger", "status", "note",
+]
+STAKEHOLDER_KEYS: List[str] = [
+    "id", "name", "role", "interest", "influence", "expectation", "strategy", "communication", "note",
+]
 
-def _set_headers(ws: Worksheet, headers: Iterable[str]) -> None:
-    for i, h in enumerate(headers, start=1):
-        ws.cell(row=1, column=i, value=h)
-    ws.freeze_panes = "A2"
+# スコア列（G）の数式。影響=E列, 確率=F列。未入力の行は空欄のまま
+_SCORE_FORMULA = '=IF(AND(ISNUMBER({e}{r}),ISNUMBER({f}{r})),{e}{r}*{f}{r},"")'
+# データ行の後ろに追加する、手入力用の空行（スコアの数式のみ）
+DEFAULT_SPARE_ROWS = 20
 
+_RISK_WIDTHS = {"B": 40, "D": 30, "I": 40, "M": 30}
+_STAKEHOLDER_WIDTHS = {"B": 24, "D": 36, "F": 30, "G": 30, "H": 28}
 
-def create_risk_register_excel(path: str) -> str:
-    wb = Workbook()
-    ws = wb.active
-    ws.title = "RiskRegister"
-    _set_headers(ws, RISK_HEADERS)
+# 前回書き出した生成値（ID -> 列ごとの値の JSON）を保持する非表示シート。upsert で手修正と区別するために使う
+STATE_SHEET = "_pmbok_state"
 
-    # score = impact * probability（影響=E列, 確率=F列, スコア=G列）
-    for r in range(2, 200):
-        ws.cell(row=r, column=7, value=f"=E{r}*F{r}")
 
-    wb.save(path)
-    return path
+def _cell(row: Mapping[str, Any], key: str, header: str) -> Any:
+    value = row.get(key, row.get(header))
+    if isinstance(value, (list, tuple)):
+        return "、".join(str(v) for v in value)
+    if isinstance(value, dict):
+        return json.dumps(value, ensure_ascii=False)
+    return value
+
+
+def _number(value: Any) -> Any:
+    # "3" や "0.4" は数値として書き込む（スコアの数式で計算できるように）
+    if isinstance(value, str):
+        try:
+            return float(value) if "." in value else int(value)
+        except ValueError:
+            return value
+    return value
 
 
-def create_stakeholder_register_excel(path: str) -> str:
-    wb = Workbook()
-    ws = wb.active
-    ws.title = "Stakeholders"
-    _set_headers(ws, STAKEHOLDER_HEADERS)
-    wb.save(path)
+def is_formula(value: Any) -> bool:
+    """セルの値が数式（"=" で始まる文字列）かどうか。"""
+    return isinstance(value, str) and value.startswith("=")
+
+
+def _state_blob(headers: List[str], values: List[Any]) -> str:
+    # 数式は行位置に依存するため記録しない
+    data = {h: v for h, v in zip(headers, values) if v not in (None, "") and not is_formula(v)}
+    return json.dumps(data, ensure_ascii=False, sort_keys=True)
+
+
+def _score_formula(r: int, impact: str = "E", probability: str = "F") -> str:
+    return _SCORE_FORMULA.format(e=impact, f=probability, r=r)
+
+
+def _write_register(
+    path: str,
+    title: str,
+    headers: List[str],
+    rows: Iterable[List[Any]],
+    widths: Dict[str, int],
+) -> str:
+    # write-only モードは行を逐次ファイルへ書き出すため、行数に関係なくメモリ使用量が一定
+    wb = Workbook(write_only=True)
+    ws = wb.create_sheet(title)
+    ws.freeze_panes = "A2"
+    for col, width in widths.items():
+        ws.column_dimensions[col].width = width
+    state = wb.create_sheet(STATE_SHEET)
+    state.sheet_state = "hidden"
+    ws.append(headers)
+    for values in rows:
+        ws.append(values)
+        if values[0]:
+            state.append([values[0], _state_blob(headers, values)])
+    with atomic_path(path) as tmp:
+        wb.save(tmp)
     return path
+
+
+# 文言から作る ID の桁数（16進）。64 ビットあれば 10 万行規模でも衝突はまず起きない
+_ID_DIGITS = 16
+
+
+class _ContentIds:
+    """行の位置ではなく文言から ID を振る（種を挿入・並べ替えても既存の行の ID が変わらず、upsert で手修正がずれない）。
+
+    ID は文言だけで決まり、ほかの行の有無や順序には依存しません。同じ文言の行が複数あるときだけ、
+    その文言の行どうしの出現順で -2, -3 を付けます（入れ替えても中身は同じ行）。万一、別の文言と ID が衝突した
+    場合は、どちらに寄せても並び順で ID が決まってしまうため採番せず ValueError にします（id を明示してください）。
+    """
+
+    def __init__(self, prefix: str) -> None:
+        self.prefix = prefix
+        self._texts: Dict[str, str] = {}  # ID -> 文言
+        self._counts: Dict[str, int] = {}  # 文言 -> 出現回数
+
+    def __call__(self, text: Any) -> str:
+        text = str(text or "").strip()
+        key = f"{self.prefix}-{hashlib.sha1(text.encode('utf-8')).hexdigest()[:_ID_DIGITS]}"
+        other = self._texts.setdefault(key, text)
+        if other != text:
+            raise ValueError(f"ID {key} が「{other}」と「{text}」で衝突しました。どちらかの行に id を指定してください")
+        self._counts[text] = self._counts.get(text, 0) + 1
+        n = self._counts[text]
+        return key if n == 1 else f"{key}-{n}"
+
+
+def _risk_values(rows: Iterable[Mapping[str, Any]], spare_rows: int) -> Iterator[List[Any]]:
+    r = 1
+    content_id = _ContentIds("R")
+    for r, row in enumerate(rows, start=2):
+        values = [_cell(row, k, h) for k, h in zip(RISK_KEYS, RISK_HEADERS)]
+        # LLM で展開した行は事象の文言が毎回変わり得るため、元の種（seed）の文言があればそちらを使う
+        values[0] = values[0] or content_id(row.get("seed") or values[1])
+        values[4], values[5] = _number(values[4]), _number(values[5])
+        if values[6] in (None, ""):
+            values[6] = _score_formula(r)
+        yield values
+    for r in range(r + 1, r + 1 + spare_rows):
+        yield [None] * 6 + [_score_formula(r)]
+
+
+def _stakeholder_values(rows: Iterable[Mapping[str, Any]]) -> Iterator[List[Any]]:
+    content_id = _ContentIds("S")
+    for row in rows:
+        values = [_cell(row, k, h) for k, h in zip(STAKEHOLDER_KEYS, STAKEHOLDER_HEADERS)]
+        values[0] = values[0] or content_id(values[1])
+        yield values
+
+
+def risk_rows_from_project(project: Mapping[str, Any]) -> Iterator[Dict[str, Any]]:
+    """プロジェクトJSONの risk_seeds（文字列、またはリスク項目の dict）をリスク登録簿の行にする。"""
+    for seed in project.get("risk_seeds") or []:
+        yield dict(seed) if isinstance(seed, Mapping) else {"event": str(seed), "status": "未評価"}
+
+
+def stakeholder_rows_from_project(project: Mapping[str, Any]) -> Iterator[Dict[str, Any]]:
+    """プロジェクトJSONの stakeholders（{name, interest, ...} または文字列）をステークホルダー登録簿の行にする。"""
+    for sh in project.get("stakeholders") or []:
+        yield dict(sh) if isinstance(sh, Mapping) else {"name": str(sh)}
+
+
+def load_register_rows(path: Path) -> Iterator[Dict[str, Any]]:
+    """行データを JSON 配列、または JSON Lines（1行1件。大量の行を逐次読む）から読み込む。"""
+    path = Path(path)
+    if path.suffix.lower() == ".jsonl":
+        with open(path, encoding="utf-8") as f:
+            for line in f:
+                if line.strip():
+                    yield json.loads(line)
+        return
+    data = json.loads(path.read_text(encoding="utf-8"))
+    if isinstance(data, dict):
+        # {"risks": [...]} のようにリストを1つ含む形も受け付ける
+        data = next((v for v in data.values() if isinstance(v, list)), [])
+    yield from data
+
+
+def create_risk_register_excel(
+    path: str,
+    rows: Optional[Iterable[Mapping[str, Any]]] = None,
+    *,
+    spare_rows: int = DEFAULT_SPARE_ROWS,
+) -> str:
+    """リスク登録簿を書き出す。rows（RISK_KEYS をキーとする dict）は逐次読み、全件をメモリに載せません。
+
+    スコア列はデータ行と、その後ろの spare_rows 行（手入力用）にだけ数式を入れます。
+    """
+    return _write_register(path, "RiskRegister", RISK_HEADERS, _risk_values(rows or (), spare_rows), _RISK_WIDTHS)
+
+
+def create_stakeholder_register_excel(path: str, rows: Optional[Iterable[Mapping[str, Any]]] = None) -> str:
+    """ステークホルダー登録簿を書き出す。rows は STAKEHOLDER_KEYS をキーとする dict。"""
+    return _write_register(
+        path, "Stakeholders", STAKEHOLDER_HEADERS, _stakeholder_values(rows or ()), _STAKEHOLDER_WIDTHS
+    )
+
+
+def create_register_excel(
+    kind: str,
+    path: str,
+    *,
+    project: Optional[Mapping[str, Any]] = None,
+    rows: Iterable[Mapping[str, Any]] = (),
+) -> str:
+    """登録簿（risk-register | stakeholder-register）を、プロジェクトJSONの行 + rows（LLM で展開した行など）で書き出す。"""
+    if kind == "risk-register":
+        return create_risk_register_excel(path, chain(risk_rows_from_project(project or {}), rows))
+    if kind == "stakeholder-register":
+        return create_stakeholder_register_excel(path, chain(stakeholder_rows_from_project(project or {}), rows))
+    raise ValueError("type は 'risk-register' または 'stakeholder-register'")
+
+
+@dataclass
+class UpsertReport:
+    """upsert_register_excel の結果。"""
+
+    added: int = 0
+    updated: int = 0
+    unchanged: int = 0
+    # 書き換えたセル数（見出しの追加を含む）
+    cells: int = 0
+    # 元データが前回から変わっていないため、手修正を残したセル数
+    kept: int = 0
+    saved: bool = False
+
+
+# 種類ごとの (シート名, 見出し, プロジェクトJSONからの行, 行データ -> 列の値)
+_REGISTERS: Dict[str, Tuple[str, List[str], Callable[..., Iterator[Dict[str, Any]]], Callable[..., Iterator[List[Any]]]]] = {
+    "risk-register": ("RiskRegister", RISK_HEADERS, risk_rows_from_project, lambda rows: _risk_values(rows, 0)),
+    "stakeholder-register": ("Stakeholders", STAKEHOLDER_HEADERS, stakeholder_rows_from_project, _stakeholder_values),
+}
+
+
+def register_values(
+    kind: str,
+    *,
+    project: Optional[Mapping[str, Any]] = None,
+    rows: Iterable[Mapping[str, Any]] = (),
+) -> Tuple[List[str], Iterator[List[Any]]]:
+    """登録簿を (見出し, 行ごとの列の値) として返す。採番・数値化は xlsx と同じで、スコア列は数式のまま。"""
+    if kind not in _REGISTERS:
+        raise ValueError("type は 'risk-register' または 'stakeholder-register'")
+    _, headers, from_project, to_values = _REGISTERS[kind]
+    return headers, to_values(chain(from_project(project or {}), rows))
+
+
+def upsert_register_excel(
+    kind: str,
+    path: str,
+    *,
+    project: Optional[Mapping[str, Any]] = None,
+    rows: Iterable[Mapping[str, Any]] = (),
+) -> UpsertReport:
+    """既存の登録簿を ID 列で突き合わせ、変わったセルだけを書き換える（ファイルがなければ新規作成）。
+
+    ユーザーが追加した列・行・書式はそのまま残し、新しい ID の行は最後のデータ行の後ろに追加します。
+    前回の生成値（非表示シート）から元データが変わっていないセルは、手修正があっても上書きしません。
+    変更がなければファイルを保存しません。
+    """
+    if kind not in _REGISTERS:
+        raise ValueError("type は 'risk-register' または 'stakeholder-register'")
+    title, headers, from_project, to_values = _REGISTERS[kind]
+    source = chain(from_project(project or {}), rows)
+    report = UpsertReport()
+    if not Path(path).exists():
+        def _counted() -> Iterator[Mapping[str, Any]]:
+            for row in source:
+                report.added += 1
+                yield row
+
+        create_register_excel(kind, path, rows=_counted())
+        report.saved = True
+        return report
+
+    wb = load_workbook(path)
+    ws = wb[title] if title in wb.sheetnames else wb.worksheets[0]
+    columns = {str(c.value).strip(): c.column for c in ws[1] if c.value not in (None, "")}
+    if "ID" not in columns:
+        raise ValueError(f"ID 列が見つかりません: {path}")
+    for h in headers:
+        if h not in columns:
+            # 利用者が消した列は末尾に戻す（並べ替えた列はその位置のまま使う）
+            columns[h] = ws.max_column + 1
+            ws.cell(row=1, column=columns[h], value=h)
+            report.cells += 1
+
+    ids: Dict[str, int] = {}
+    last = 1
+    id_index = columns["ID"] - 1
+    for r, values in enumerate(ws.iter_rows(min_row=2, values_only=True), start=2):
+        if any(v not in (None, "") and not is_formula(v) for v in values):
+            last = r
+        if id_index < len(values) and values[id_index] not in (None, ""):
+            ids[str(values[id_index])] = r
+
+    if STATE_SHEET in wb.sheetnames:
+        state_ws = wb[STATE_SHEET]
+    else:
+        state_ws = wb.create_sheet(STATE_SHEET)
+        state_ws.sheet_state = "hidden"
+    state: Dict[str, Tuple[int, str]] = {}
+    for r, (key, blob) in enumerate(state_ws.iter_rows(min_col=1, max_col=2, values_only=True), start=1):
+        if key not in (None, ""):
+            state[str(key)] = (r, blob or "{}")
+    state_last = state_ws.max_row if state else 0
+    state_changed = False
+
+    for values in to_values(source):
+        key = str(values[0])
+        blob = _state_blob(headers, values)
+        state_row, prev_blob = state.get(key, (0, None))
+        prev = json.loads(prev_blob) if prev_blob else None
+        r = ids.get(key)
+        is_new = r is None
+        if is_new:
+            last += 1
+            r = ids[key] = last
+        changed = 0
+        for h, v in zip(headers, values):
+            cell = ws.cell(row=r, column=columns[h])
+            if is_formula(v):
+                # スコアの数式は、実際の行・列の位置で作り直し、空欄のときだけ入れる（手入力の値は残す）
+                if cell.value in (None, ""):
+                    cell.value = _score_formula(
+                        r, get_column_letter(columns[RISK_HEADERS[4]]), get_column_letter(columns[RISK_HEADERS[5]])
+                    )
+                    changed += 1
+                continue
+            if v in (None, "") or cell.value == v:
+                continue
+            if prev is not None and prev.get(h) == v:
+                report.kept += 1
+                continue
+            cell.value = v
+            changed += 1
+        report.cells += changed
+        if is_new:
+            report.added += 1
+        elif changed:
+            report.updated += 1
+        else:
+            report.unchanged += 1
+        if blob != prev_blob:
+            if not state_row:
+                state_last += 1
+                state_row = state_last
+                state_ws.cell(row=state_row, column=1, value=key)
+            state_ws.cell(row=state_row, column=2, value=blob)
+            state[key] = (state_row, blob)
+            state_changed = True
+
+    if report.cells or state_changed:
+        with atomic_path(path) as tmp:
+            wb.save(tmp)
+        report.saved = True
+    return report
@@ -0,0 +1,208 @@
+from __future__ import annotations
+
+import csv
+import json
+from contextlib import ExitStack
+from pathlib import Path
+from typing import Any, Dict, Iterable, Iterator, List, Mapping, Optional, Sequence, Tuple
+
+from .atomic import atomic_path
+from .excel import RISK_HEADERS, STAKEHOLDER_HEADERS, is_formula, register_values
+
+# 列指向の書き出し形式（拡張子で選ぶ）
+EXPORT_FORMATS = ("csv", "parquet")
+# Parquet の行グループ（この件数ごとにファイルへ書き出すため、全件をメモリに載せない）
+PARQUET_BATCH_ROWS = 10_000
+
+# 横断表の先頭に付ける列（プロジェクトJSONのファイル名。portfolio の出力サブフォルダと同じ）
+PROJECT_HEADER = "プロジェクト"
+DOCUMENT_HEADERS: List[str] = [PROJECT_HEADER, "ドキュメント種別", "出力先", "成否", "所要時間(秒)", "エラー", "文字数", "本文"]
+
+# Parquet で数値型（float64）にする列。数値にできない値は null（CSV には元の値のまま書く）
+_NUMERIC = {"影響", "発生確率", "スコア(影響×確率)", "所要時間(秒)", "文字数"}
+_BOOLEAN = {"成否"}
+
+
+def export_format(path: Path) -> str:
+    """出力先の拡張子から形式（csv | parquet）を決める。"""
+    fmt = Path(path).suffix.lower().lstrip(".")
+    if fmt not in EXPORT_FORMATS:
+        raise ValueError(f"対応していない形式です: {path}（.csv または .parquet）")
+    return fmt
+
+
+def _score(values: List[Any]) -> Any:
+    # xlsx ではスコア列が数式になる。表形式では影響×発生確率を計算した値を書く
+    impact, probability = values[4], values[5]
+    if isinstance(impact, (int, float)) and isinstance(probability, (int, float)):
+        return impact * probability
+    return None if is_formula(values[6]) else values[6]
+
+
+def register_table(
+    kind: str,
+    *,
+    project: Optional[Mapping[str, Any]] = None,
+    rows: Iterable[Mapping[str, Any]] = (),
+) -> Tuple[List[str], Iterator[List[Any]]]:
+    """登録簿（risk-register | stakeholder-register）を (見出し, 行の値) として返す。列と採番は xlsx と同じ。"""
+    headers, values = register_values(kind, project=project, rows=rows)
+    if kind == "risk-register":
+        return headers, ([*v[:6], _score(v), *v[7:]] for v in values)
+    return headers, values
+
+
+class _CsvTable:
+    def __init__(self, path: str, headers: Sequence[str]) -> None:
+        self._f = open(path, "w", encoding="utf-8", newline="")
+        self._writer = csv.writer(self._f)
+        self._writer.writerow(headers)
+
+    def write(self, values: Sequence[Any]) -> None:
+        self._writer.writerow(["" if v is None else v for v in values])
+
+    def close(self) -> None:
+        self._f.close()
+
+
+class _ParquetTable:
+    def __init__(self, path: str, headers: Sequence[str], batch_rows: int) -> None:
+        try:
+            import pyarrow as pa  # 任意依存（Parquet を書くときだけ必要）
+            import pyarrow.parquet as pq
+        except ImportError as e:
+            raise RuntimeError("Parquet の書き出しには pyarrow が必要です（pip install pyarrow）") from e
+        self._pa = pa
+        self._headers = list(headers)
+        self._schema = pa.schema([
+            (h, pa.float64() if h in _NUMERIC else pa.bool_() if h in _BOOLEAN else pa.string()) for h in headers
+        ])
+        self._writer = pq.ParquetWriter(path, self._schema, compression="zstd")
+        self._batch_rows = max(1, batch_rows)
+        self._columns: List[List[Any]] = [[] for _ in headers]
+
+    def _value(self, header: str, value: Any) -> Any:
+        if value in (None, ""):
+            return None
+        if header in _NUMERIC:
+            try:
+                return float(value)
+            except (TypeError, ValueError):
+                return None
+        if header in _BOOLEAN:
+            return bool(value)
+        return value if isinstance(value, str) else str(value)
+
+    def write(self, values: Sequence[Any]) -> None:
+        for column, header, value in zip(self._columns, self._headers, values):
+            column.append(self._value(header, value))
+        if len(self._columns[0]) >= self._batch_rows:
+            self._flush()
+
+    def _flush(self) -> None:
+        if self._columns[0]:
+            self._writer.write_table(self._pa.Table.from_arrays(self._columns, schema=self._schema))
+            self._columns = [[] for _ in self._headers]
+
+    def close(self) -> None:
+        self._flush()
+        self._writer.close()
+
+
+def open_table(
+    path: Path, headers: Sequence[str], *, batch_rows: int = PARQUET_BATCH_ROWS, target: Optional[str] = None
+) -> Any:
+    """表の書き出し先を開く（write(values) で1行ずつ追記し、close で書き終える）。
+
+    形式は path の拡張子で決めます。target を渡すと実際にはそのパス（atomic_path の一時ファイル等）に書きます。
+    """
+    fmt = export_format(path)
+    target = target or str(path)
+    if fmt == "parquet":
+        return _ParquetTable(target, headers, batch_rows)
+    return _CsvTable(target, headers)
+
+
+def _write_tables(paths: Sequence[Path], headers: Sequence[str], records: Iterable[Sequence[Any]]) -> int:
+    # 同じ行を複数の形式へ同時に書く（行の生成・JSON の読み込みは1回だけ）。
+    # 途中で失敗したらどの出力も置き換えず、既存のファイルを残す
+    tables = []
+    count = 0
+    with ExitStack() as stack:
+        for path in paths:
+            Path(path).parent.mkdir(parents=True, exist_ok=True)
+            tmp = stack.enter_context(atomic_path(path))
+            table = open_table(path, headers, target=tmp)
+            tables.append(table)
+            stack.callback(table.close)
+        for values in records:
+            for table in tables:
+                table.write(values)
+            count += 1
+    return count
+
+
+def export_register(
+    kind: str,
+    path: Path,
+    *,
+    project: Optional[Mapping[str, Any]] = None,
+    rows: Iterable[Mapping[str, Any]] = (),
+) -> str:
+    """登録簿を CSV / Parquet（拡張子で選択）に書き出す。行は逐次処理し、全件をメモリに載せません。"""
+    headers, records = register_table(kind, project=project, rows=rows)
+    _write_tables([Path(path)], headers, records)
+    return str(path)
+
+
+def _project_rows(kind: str, project_files: Sequence[Path]) -> Iterator[List[Any]]:
+    # プロジェクトJSONは1件ずつ読み、読み終えたものは保持しない
+    for pf in project_files:
+        project = json.loads(Path(pf).read_text(encoding="utf-8"))
+        _, records = register_table(kind, project=project)
+        for values in records:
+            yield [Path(pf).stem, *values]
+
+
+def _document_rows(results: Iterable[Any]) -> Iterator[List[Any]]:
+    for r in results:
+        text = None
+        if r.ok:
+            try:
+                text = Path(r.out_path).read_text(encoding="utf-8")
+            except OSError:
+                pass
+        yield [
+            Path(r.project).stem, r.doc_type, r.out_path, r.ok, round(r.elapsed, 3), r.error,
+            len(text) if text is not None else None, text,
+        ]
+
+
+def export_portfolio(
+    project_files: Sequence[Path],
+    out_dir: Path,
+    *,
+    formats: Sequence[str] = ("csv",),
+    results: Optional[Iterable[Any]] = None,
+) -> Dict[str, int]:
+    """全プロジェクトの登録簿を1つの表にまとめて out_dir に書き出す（先頭列はプロジェクト名）。
+
+    risk_register.<形式> / stakeholder_register.<形式> と、results（batch/portfolio の DocumentResult）を
+    渡した場合は生成したドキュメントの一覧 documents.<形式> を作ります。返り値はファイルごとの行数です。
+    """
+    unknown = [f for f in formats if f not in EXPORT_FORMATS]
+    if unknown:
+        raise ValueError(f"対応していない形式です: {', '.join(unknown)}（csv または parquet）")
+    out_dir = Path(out_dir)
+    formats = list(dict.fromkeys(formats))
+    written: Dict[str, int] = {}
+    for kind, headers in (("risk-register", RISK_HEADERS), ("stakeholder-register", STAKEHOLDER_HEADERS)):
+        name = kind.replace("-", "_")
+        paths = [out_dir / f"{name}.{fmt}" for fmt in formats]
+        count = _write_tables(paths, [PROJECT_HEADER, *headers], _project_rows(kind, project_files))
+        written.update({str(p): count for p in paths})
+    if results is not None:
+        paths = [out_dir / f"documents.{fmt}" for fmt in formats]
+        count = _write_tables(paths, DOCUMENT_HEADERS, _document_rows(results))
+        written.update({str(p): count for p in paths})
+    return written
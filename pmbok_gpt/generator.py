@@ -1,13 +1,22 @@
 from __future__ import annotations
 
-import json
-from typing import Any, Dict, List, Optional
+import asyncio
+import math
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Dict, Iterator, List, Optional, Tuple
 
-from .config import AppSettings
-from .providers import get_provider
-from .templates import DOC_TEMPLATES
+from . import metrics
+from .atomic import atomic_path, atomic_write
+from .config import AppSettings, max_tokens_limit
+from .context import canonical_json, compact_context, count_tokens
+from .providers import StubProvider, get_provider
+from .templates import BUILTIN_TEMPLATES, TemplateSet
 
 
+# プロンプトの組み立て方（build_messages / build_section_messages）を変えたら上げる。
+# build のマニフェストに記録され、上がると既存の出力はすべて再生成の対象になります。
+PROMPT_VERSION = 1
+
 SYSTEM_PROMPT = (
     "あなたは経験豊富なプロジェクトマネージャ支援AIです。" 
     "PMBOKに整合する一般的な構成と用語を用いて、過度に冗長にならず、実務に使える明確さで記述してください。" 
@@ -15,50 +24,182 @@ SYSTEM_PROMPT = (
 )
 
 
+def project_preamble(language: str, project_context: Dict[str, Any]) -> str:
+    """同じプロジェクトの全ドキュメントで共通の前置き（プロバイダ側のプロンプトキャッシュに載る部分）。"""
+    return f"言語: {language}\nプロジェクト情報(JSON):\n{canonical_json(project_context)}"
+
+
 def build_messages(
     language: str,
     doc_type: str,
     project_context: Dict[str, Any],
     extra_instructions: Optional[str] = None,
+    templates: Optional[TemplateSet] = None,
 ) -> List[Dict[str, str]]:
-    if doc_type not in DOC_TEMPLATES:
-        raise ValueError(f"Unknown doc_type: {doc_type}")
+    """1ドキュメント分のメッセージ。
 
-    tpl = DOC_TEMPLATES[doc_type]
+    システムプロンプトとプロジェクト情報を共通の前置きとして先頭に置き、
+    ドキュメントごとに変わる指示は最後のメッセージにまとめます（プロンプトキャッシュの再利用のため）。
+    templates を省略すると組み込みのテンプレートを使います（上書きは TemplateSet.with_overrides）。
+    """
+    tpl = (templates or BUILTIN_TEMPLATES).template(doc_type)
     sections = tpl["sections"]  # type: ignore
 
-    user_payload = {
-        "language": language,
-        "doc_type": doc_type,
-        "title": tpl.get("title"),
-        "sections": sections,
-        "project": project_context,
-        "format": {
-            "headings": True,
-            "bullets": True,
-            "section_numbering": True,
-        },
-        "notes": extra_instructions or "",
-    }
-    content = (
-        "以下の条件で、指定のドキュメントを作成してください。\n"
-        f"言語: {language}\n"
+    instruction = (
+        "上記のプロジェクト情報をもとに、以下の条件で指定のドキュメントを作成してください。\n"
         f"ドキュメント種別: {tpl.get('title')} ({doc_type})\n"
         "セクション（順序厳守）:\n- セクション1: "
         + "\n- セクション: ".join(str(s) for s in sections)
         + "\n"
         "体裁: 見出し + 箇条書き + 短い説明\n"
-        "厳禁: 機密情報の推測、虚偽の数値、PMBOK原文の複製\n"
-        "プロジェクト情報(JSON):\n"
-        + json.dumps(project_context, ensure_ascii=False, indent=2)
+        "厳禁: 機密情報の推測、虚偽の数値、PMBOK原文の複製"
     )
+    if extra_instructions:
+        instruction += f"\n追加指示: {extra_instructions}"
+
+    return [
+        {"role": "system", "content": SYSTEM_PROMPT},
+        {"role": "user", "content": project_preamble(language, project_context)},
+        {"role": "user", "content": instruction},
+    ]
+
+
+def build_section_messages(
+    language: str,
+    doc_type: str,
+    project_context: Dict[str, Any],
+    index: int,
+    extra_instructions: Optional[str] = None,
+    templates: Optional[TemplateSet] = None,
+) -> List[Dict[str, str]]:
+    """セクション単位生成用のメッセージ（index は 0 始まり）。
 
+    前置きは build_messages と同じで、対象セクションの指示だけを末尾に置きます。
+    """
+    tpl = (templates or BUILTIN_TEMPLATES).template(doc_type)
+    sections = [str(x) for x in tpl["sections"]]  # type: ignore
+    instruction = (
+        f"ドキュメント種別: {tpl.get('title')} ({doc_type})\n"
+        f"全体の構成: {' / '.join(sections)}\n"
+        f"このうち {index + 1}/{len(sections)} 番目のセクションの本文だけを作成してください。\n"
+        f"- セクション: {sections[index]}\n"
+        "見出し（セクション名・番号）は付けず、本文から書き始めてください。他セクションの内容は書かないでください。\n"
+        "体裁: 箇条書き + 短い説明\n"
+        "厳禁: 機密情報の推測、虚偽の数値、PMBOK原文の複製"
+    )
+    if extra_instructions:
+        instruction += f"\n追加指示: {extra_instructions}"
     return [
         {"role": "system", "content": SYSTEM_PROMPT},
-        {"role": "user", "content": content},
+        {"role": "user", "content": project_preamble(language, project_context)},
+        {"role": "user", "content": instruction},
     ]
 
 
+def context_budget(
+    language: str,
+    doc_type: str,
+    extra_instructions: Optional[str],
+    settings: AppSettings,
+    templates: Optional[TemplateSet] = None,
+) -> int:
+    """プロジェクト情報に使えるトークン数（0 は無制限）。
+
+    プロンプト全体の予算（AICPM_PROMPT_TOKEN_BUDGET、なければ context_window - max_tokens）から、
+    システムプロンプト・指示の分を差し引きます。
+    """
+    budget = settings.prompt_token_budget
+    if not budget and settings.context_window:
+        budget = settings.context_window - settings.max_tokens
+    if budget <= 0:
+        return 0
+    overhead = "".join(m["content"] for m in build_messages(language, doc_type, {}, extra_instructions, templates))
+    return max(1, budget - count_tokens(overhead, settings.model))
+
+
+def prepare_context(
+    language: str,
+    doc_type: str,
+    project_context: Dict[str, Any],
+    extra_instructions: Optional[str],
+    settings: AppSettings,
+    templates: Optional[TemplateSet] = None,
+) -> Tuple[Dict[str, Any], Dict[str, Any]]:
+    """送信用に圧縮したプロジェクト情報と、計測レコードに付けるタグを返す。"""
+    budget = context_budget(language, doc_type, extra_instructions, settings, templates)
+    compacted, report = compact_context(
+        project_context, doc_type=doc_type, budget=budget, model=settings.model,
+        project=settings.context_projection, templates=templates,
+    )
+    tags = {
+        "context_tokens": report.tokens,
+        "context_saved_tokens": report.saved_tokens,
+        "context_trimmed": report.trimmed,
+    }
+    return compacted, tags
+
+
+def section_token_budget(max_tokens: int, sections: int, minimum: int = 0) -> int:
+    """全体の max_tokens をセクション数で割ったトークン予算（下限 minimum）。"""
+    return max(minimum, math.ceil(max_tokens / max(1, sections)))
+
+
+def _strip_heading(body: str, section: str) -> str:
+    # 指示に反してモデルがセクション見出しを付けた場合は取り除く（番号は連結時に振り直す）
+    lines = body.strip().splitlines()
+    if lines and lines[0].strip().lstrip("#0123456789.．)） ").strip() == section:
+        lines = lines[1:]
+    return "\n".join(lines).strip()
+
+
+def _stitch_sections(title: str, sections: List[str], bodies: List[str]) -> str:
+    parts = [title]
+    for i, (sec, body) in enumerate(zip(sections, bodies), start=1):
+        parts.append(f"{i}. {sec}\n{_strip_heading(body, sec)}")
+    return "\n\n".join(parts) + "\n"
+
+
+def _sectioned_plan(doc_type: str, settings: AppSettings, templates: Optional[TemplateSet]):
+    tpl = (templates or BUILTIN_TEMPLATES).template(doc_type)
+    sections = [str(x) for x in tpl["sections"]]  # type: ignore
+    budget = section_token_budget(settings.max_tokens, len(sections), settings.section_min_tokens)
+    section_settings = settings.model_copy(update={"max_tokens": budget})
+    return str(tpl.get("title") or doc_type), sections, section_settings
+
+
+def finalize_text(text: str, messages: List[Dict[str, str]], settings: AppSettings) -> str:
+    """空出力時のフォールバックを適用した最終テキストを返す。"""
+    if text and text.strip():
+        return text
+
+    # 内容が空の場合の最終フォールバック：スタブで生成して空ファイル回避
+    if not settings.fallback_to_stub_on_empty:
+        raise RuntimeError("LLMが空の本文を返しました。フォールバックは無効です（AICPM_FALLBACK_TO_STUB_ON_EMPTY=false）。")
+    metrics.note(stub_fallback=True)
+    metrics.branch("stub_fallback")
+    try:
+        fallback_settings = AppSettings()
+        fallback_settings.use_stub = True
+        # 計測・キャッシュのラッパは通さない（元の呼び出しのレコードにフォールバックとして記録済み）
+        stub_provider = StubProvider(fallback_settings)
+        stub_text = stub_provider.generate(messages)
+        header = (
+            "【注意】実APIから空出力が返ったため、スタブ生成にフォールバックしました。\n"
+            f"- provider: {fallback_settings.provider_kind()}\n"
+            f"- model: {settings.model}\n\n"
+        )
+        return header + stub_text
+    except Exception:
+        # それでも失敗する場合は空のままとする
+        return ""
+
+
+def write_output(out_path: str, text: str) -> str:
+    """text を out_path に保存して out_path を返す（途中で止まっても書きかけのファイルは残らない）。"""
+    atomic_write(out_path, text)
+    return out_path
+
+
 def generate_text_document(
     doc_type: str,
     project_context: Dict[str, Any],
@@ -67,34 +208,148 @@ def generate_text_document(
     language: Optional[str] = None,
     extra_instructions: Optional[str] = None,
     settings: Optional[AppSettings] = None,
+    provider: Any = None,
+    templates: Optional[TemplateSet] = None,
 ) -> str:
+    """1ドキュメントを生成して out_path に保存する。
+
+    provider を渡すと、そのインスタンスを再利用します（バッチ生成でクライアントを共有する用途）。
+    """
     settings = settings or AppSettings()
     language = language or settings.default_language
-    provider = get_provider(settings)
+    provider = provider or get_provider(settings)
 
-    messages = build_messages(language, doc_type, project_context, extra_instructions)
-    text = provider.generate(messages)
+    context, tags = prepare_context(language, doc_type, project_context, extra_instructions, settings, templates)
+    messages = build_messages(language, doc_type, context, extra_instructions, templates)
+    with metrics.scope(doc_type=doc_type, **tags):
+        text = provider.generate(messages)
+        text = finalize_text(text, messages, settings)
+    return write_output(out_path, text)
 
-    # 内容が空の場合の最終フォールバック：スタブで生成して空ファイル回避
-    if not (text and text.strip()):
-        if settings.fallback_to_stub_on_empty:
-            try:
-                fallback_settings = AppSettings()
-                fallback_settings.use_stub = True
-                stub_provider = get_provider(fallback_settings)
-                stub_text = stub_provider.generate(messages)
-                header = (
-                    "【注意】実APIから空出力が返ったため、スタブ生成にフォールバックしました。\n"
-                    f"- provider: {fallback_settings.provider_kind()}\n"
-                    f"- model: {settings.model}\n\n"
-                )
-                text = header + stub_text
-            except Exception:
-                # それでも失敗する場合は空のままとする
-                text = ""
-        else:
-            raise RuntimeError("LLMが空の本文を返しました。フォールバックは無効です（AICPM_FALLBACK_TO_STUB_ON_EMPTY=false）。")
-
-    with open(out_path, "w", encoding="utf-8") as f:
-        f.write(text)
-    return out_path
+
+async def agenerate_text_document(
+    doc_type: str,
+    project_context: Dict[str, Any],
+    *,
+    out_path: str,
+    language: Optional[str] = None,
+    extra_instructions: Optional[str] = None,
+    settings: Optional[AppSettings] = None,
+    provider: Any = None,
+    templates: Optional[TemplateSet] = None,
+) -> str:
+    """generate_text_document の非同期版（provider.agenerate を使用）。
+
+    1つのイベントループで多数の生成を同時に待ち合わせられます。
+    """
+    settings = settings or AppSettings()
+    language = language or settings.default_language
+    provider = provider or get_provider(settings)
+
+    context, tags = prepare_context(language, doc_type, project_context, extra_instructions, settings, templates)
+    messages = build_messages(language, doc_type, context, extra_instructions, templates)
+    with metrics.scope(doc_type=doc_type, **tags):
+        text = await provider.agenerate(messages)
+        text = finalize_text(text, messages, settings)
+    return write_output(out_path, text)
+
+
+def stream_text_document(
+    doc_type: str,
+    project_context: Dict[str, Any],
+    *,
+    out_path: str,
+    language: Optional[str] = None,
+    extra_instructions: Optional[str] = None,
+    settings: Optional[AppSettings] = None,
+    provider: Any = None,
+    templates: Optional[TemplateSet] = None,
+) -> Iterator[str]:
+    """generate_text_document のストリーミング版。
+
+    本文の差分を受け取るたびに out_path と同じディレクトリの一時ファイルへ追記して flush し、同じ差分を yield します。
+    最後まで受け取ってから out_path を置き換えるため、途中で中断・例外になっても既存の出力は壊れません。
+    何も返らなかった場合は generate_text_document と同じ空出力フォールバックを適用します。
+    """
+    settings = settings or AppSettings()
+    language = language or settings.default_language
+    provider = provider or get_provider(settings)
+
+    context, tags = prepare_context(language, doc_type, project_context, extra_instructions, settings, templates)
+    messages = build_messages(language, doc_type, context, extra_instructions, templates)
+    received: List[str] = []
+    with metrics.scope(doc_type=doc_type, **tags), atomic_path(out_path) as tmp, open(tmp, "w", encoding="utf-8") as f:
+        for delta in provider.stream(messages):
+            received.append(delta)
+            f.write(delta)
+            f.flush()
+            yield delta
+        if not "".join(received).strip():
+            text = finalize_text("", messages, settings)
+            f.seek(0)
+            f.truncate()
+            f.write(text)
+            yield text
+
+
+def generate_sectioned_document(
+    doc_type: str,
+    project_context: Dict[str, Any],
+    *,
+    out_path: str,
+    language: Optional[str] = None,
+    extra_instructions: Optional[str] = None,
+    settings: Optional[AppSettings] = None,
+    provider: Any = None,
+    templates: Optional[TemplateSet] = None,
+) -> str:
+    """テンプレートのセクションごとに並行生成し、番号付きで連結して保存する。
+
+    各セクションの max_tokens は全体の max_tokens をセクション数で割った値
+    （下限 AICPM_SECTION_MIN_TOKENS）。provider を渡した場合も各呼び出しにこの予算を適用します。
+    """
+    settings = settings or AppSettings()
+    language = language or settings.default_language
+    title, sections, section_settings = _sectioned_plan(doc_type, settings, templates)
+    provider = provider or get_provider(section_settings)
+    context, tags = prepare_context(language, doc_type, project_context, extra_instructions, section_settings, templates)
+
+    def _one(index: int) -> str:
+        messages = build_section_messages(language, doc_type, context, index, extra_instructions, templates)
+        with metrics.scope(doc_type=doc_type, section=index, **tags), max_tokens_limit(section_settings.max_tokens):
+            return finalize_text(provider.generate(messages), messages, section_settings)
+
+    workers = settings.section_workers or len(sections)
+    with ThreadPoolExecutor(max_workers=max(1, min(workers, len(sections)))) as ex:
+        bodies = list(ex.map(_one, range(len(sections))))
+    return write_output(out_path, _stitch_sections(title, sections, bodies))
+
+
+async def agenerate_sectioned_document(
+    doc_type: str,
+    project_context: Dict[str, Any],
+    *,
+    out_path: str,
+    language: Optional[str] = None,
+    extra_instructions: Optional[str] = None,
+    settings: Optional[AppSettings] = None,
+    provider: Any = None,
+    templates: Optional[TemplateSet] = None,
+) -> str:
+    """generate_sectioned_document の非同期版。"""
+    settings = settings or AppSettings()
+    language = language or settings.default_language
+    title, sections, section_settings = _sectioned_plan(doc_type, settings, templates)
+    provider = provider or get_provider(section_settings)
+    limit = asyncio.Semaphore(max(1, settings.section_workers or len(sections)))
+    context, tags = prepare_context(language, doc_type, project_context, extra_instructions, section_settings, templates)
+
+    async def _one(index: int) -> str:
+        messages = build_section_messages(language, doc_type, context, index, extra_instructions, templates)
+        with metrics.scope(doc_type=doc_type, section=index, **tags), max_tokens_limit(section_settings.max_tokens):
+            async with limit:
+                text = await provider.agenerate(messages)
+            return finalize_text(text, messages, section_settings)
+
+    bodies = await asyncio.gather(*[_one(i) for i in range(len(sections))])
+    return write_output(out_path, _stitch_sections(title, sections, list(bodies)))
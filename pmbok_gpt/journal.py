@@ -0,0 +1,124 @@
+from __future__ import annotations
+
+import json
+import os
+import threading
+import time
+import uuid
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import Any, Dict, List, Optional
+
+from .config import AppSettings
+
+# タスクの状態（pending は開始時に計画したが、まだ完了していないもの）
+PENDING, DONE, FAILED = "pending", "done", "failed"
+
+
+def task_key(project: str, doc_type: str) -> str:
+    return f"{project}::{doc_type}"
+
+
+@dataclass
+class JobState:
+    """ジャーナルを先頭から再生した結果。"""
+
+    id: str
+    params: Dict[str, Any] = field(default_factory=dict)
+    tasks: Dict[str, Dict[str, Any]] = field(default_factory=dict)  # key -> {project, doc_type, out_path, state, error}
+    started: float = 0.0
+    updated: float = 0.0
+    runs: int = 0
+
+    def counts(self) -> Dict[str, int]:
+        states = [t["state"] for t in self.tasks.values()]
+        return {"documents": len(states), "done": states.count(DONE), "failed": states.count(FAILED), "pending": states.count(PENDING)}
+
+    @property
+    def complete(self) -> bool:
+        return all(t["state"] == DONE for t in self.tasks.values())
+
+    def remaining(self) -> List[Dict[str, Any]]:
+        """未完了のタスク。完了済みでも出力ファイルが消えていれば対象に含める。"""
+        return [
+            t for t in self.tasks.values()
+            if t["state"] != DONE or not Path(t["out_path"]).is_file()
+        ]
+
+
+class JobJournal:
+    """batch 実行の進捗を1行1イベントで追記するジャーナル（JSON Lines）。
+
+    タスクの完了ごとに fsync するため、プロセスが途中で落ちても完了済みの
+    (project, doc_type) が分かり、resume で残りだけを実行できます。
+    書きかけの最終行（クラッシュ時）は読み込み時に無視します。
+    """
+
+    def __init__(self, path: Path):
+        self.path = Path(path)
+        self.id = self.path.stem
+        self._lock = threading.Lock()
+
+    @classmethod
+    def create(cls, settings: AppSettings, params: Dict[str, Any], tasks: List[Dict[str, Any]]) -> "JobJournal":
+        job_id = time.strftime("%Y%m%d-%H%M%S-") + uuid.uuid4().hex[:6]
+        journal = cls(Path(settings.jobs_dir) / f"{job_id}.jsonl")
+        journal.path.parent.mkdir(parents=True, exist_ok=True)
+        journal.append({"event": "start", "params": params, "tasks": tasks})
+        return journal
+
+    @classmethod
+    def open(cls, job_id: str, settings: AppSettings) -> "JobJournal":
+        path = Path(settings.jobs_dir) / f"{job_id}.jsonl"
+        if not path.is_file():
+            raise ValueError(f"ジョブが見つかりません: {job_id}")
+        return cls(path)
+
+    def append(self, event: Dict[str, Any]) -> None:
+        line = (json.dumps({"ts": time.time(), **event}, ensure_ascii=False) + "\n").encode("utf-8")
+        with self._lock, open(self.path, "a+b") as f:
+            # 前回のクラッシュで最終行が書きかけなら、改行してから追記する
+            if f.tell() > 0:
+                f.seek(-1, os.SEEK_END)
+                if f.read(1) != b"\n":
+                    line = b"\n" + line
+            f.write(line)
+            f.flush()
+            os.fsync(f.fileno())
+
+    def record(self, project: str, doc_type: str, *, ok: bool, error: Optional[str] = None, elapsed: float = 0.0) -> None:
+        self.append({
+            "event": "task",
+            "key": task_key(project, doc_type),
+            "state": DONE if ok else FAILED,
+            "error": error,
+            "elapsed": round(elapsed, 3),
+        })
+
+    def state(self) -> JobState:
+        state = JobState(id=self.id)
+        with open(self.path, encoding="utf-8") as f:
+            for raw in f:
+                try:
+                    event = json.loads(raw)
+                except ValueError:
+                    continue
+                kind = event.get("event")
+                state.updated = float(event.get("ts", state.updated))
+                if kind == "start":
+                    state.params = event.get("params") or {}
+                    state.started = state.updated
+                    state.runs = 1
+                    for t in event.get("tasks") or []:
+                        state.tasks[task_key(t["project"], t["doc_type"])] = {**t, "state": PENDING, "error": None}
+                elif kind == "resume":
+                    state.runs += 1
+                elif kind == "task" and event.get("key") in state.tasks:
+                    state.tasks[event["key"]].update(state=event.get("state"), error=event.get("error"))
+        return state
+
+
+def list_journals(settings: AppSettings) -> List[JobState]:
+    directory = Path(settings.jobs_dir)
+    states = [JobJournal(p).state() for p in directory.glob("*.jsonl")] if directory.is_dir() else []
+    return sorted(states, key=lambda s: s.started)
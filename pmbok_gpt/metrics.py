@@ -0,0 +1,445 @@
+from __future__ import annotations
+
+import contextvars
+import copy
+import json
+import math
+import os
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+from dataclasses import asdict, dataclass, field, fields
+from pathlib import Path
+from typing import Any, Deque, Dict, Iterable, Iterator, List, Optional, Sequence, Tuple
+
+from .config import AppSettings
+
+
+@dataclass
+class CallRecord:
+    """LLM 呼び出し1回分の計測値。"""
+
+    ts: str
+    provider: str
+    model: str
+    mode: str  # generate | agenerate | stream
+    doc_type: Optional[str] = None
+    section: Optional[int] = None
+    latency: float = 0.0
+    # ストリーミング時のみ。最初の差分が届くまでの秒数
+    ttft: Optional[float] = None
+    prompt_tokens: Optional[int] = None
+    # prompt_tokens のうちプロバイダ側のプロンプトキャッシュに載った分
+    cached_tokens: Optional[int] = None
+    completion_tokens: Optional[int] = None
+    # プロジェクト情報の送信トークン数と、従来形式（indent=2）からの削減量・切り詰め内容
+    context_tokens: Optional[int] = None
+    context_saved_tokens: Optional[int] = None
+    context_trimmed: List[str] = field(default_factory=list)
+    request_chars: int = 0
+    response_chars: int = 0
+    # 最終的に本文を返した API（chat | responses | stub）
+    api: Optional[str] = None
+    # 通過した分岐（例: "responses:empty", "param:max_completion_tokens"）
+    branches: List[str] = field(default_factory=list)
+    param_retries: int = 0
+    # 429/5xx/接続エラーによる再送回数と、スケジューラでの待ち秒数
+    retries: int = 0
+    queue_wait: float = 0.0
+    stub_fallback: bool = False
+    cache: Optional[str] = None  # hit | miss | bypass
+    ok: bool = True
+    error: Optional[str] = None
+
+
+_current: "contextvars.ContextVar[Optional[CallRecord]]" = contextvars.ContextVar("pmbok_metrics_current", default=None)
+# スコープ内で完了したレコードと、その書き出し先
+_scope: "contextvars.ContextVar[Optional[List[Tuple[CallRecord, MetricsRecorder]]]]" = contextvars.ContextVar(
+    "pmbok_metrics_scope", default=None
+)
+_tags: "contextvars.ContextVar[Dict[str, Any]]" = contextvars.ContextVar("pmbok_metrics_tags", default={})
+
+
+def _target() -> Optional[CallRecord]:
+    # 呼び出し中のレコード、なければスコープ内の直近のレコード（空出力フォールバック等の後処理用）
+    rec = _current.get()
+    if rec is None:
+        records = _scope.get()
+        if records:
+            rec = records[-1][0]
+    return rec
+
+
+def note(**fields: Any) -> None:
+    """計測中のレコードに値を設定する（計測外では何もしない）。"""
+    rec = _target()
+    if rec is not None:
+        for k, v in fields.items():
+            setattr(rec, k, v)
+
+
+def branch(name: str) -> None:
+    """通過した分岐を記録する。"param:" / "retry:" で始まる分岐はそれぞれの再送として数える。"""
+    rec = _target()
+    if rec is not None:
+        rec.branches.append(name)
+        if name.startswith("param:"):
+            rec.param_retries += 1
+        elif name.startswith("retry:"):
+            rec.retries += 1
+
+
+def add_queue_wait(seconds: float) -> None:
+    """スケジューラでの待ち時間を加算する。"""
+    rec = _target()
+    if rec is not None:
+        rec.queue_wait = round(rec.queue_wait + seconds, 4)
+
+
+@contextmanager
+def detached() -> Iterator[CallRecord]:
+    """範囲内の note / branch を別のレコードに集める（並行して送る呼び出しの値を混ぜないため）。
+
+    採用した呼び出しの値は merge で計測中のレコードに反映します。
+    """
+    rec = CallRecord(ts="", provider="", model="", mode="")
+    token = _current.set(rec)
+    try:
+        yield rec
+    finally:
+        _current.reset(token)
+
+
+def merge(child: CallRecord, *, usage: bool = True) -> None:
+    """detached で集めた分岐・再送（usage=True ならトークン数と API も）を計測中のレコードに加える。"""
+    rec = _target()
+    if rec is None:
+        return
+    if usage:
+        for name in ("prompt_tokens", "cached_tokens", "completion_tokens", "api"):
+            value = getattr(child, name)
+            if value is not None:
+                setattr(rec, name, value)
+    rec.branches.extend(child.branches)
+    rec.param_retries += child.param_retries
+    rec.retries += child.retries
+    rec.queue_wait = round(rec.queue_wait + child.queue_wait, 4)
+
+
+def _field(obj: Any, name: str) -> Any:
+    # SDK のオブジェクトと、Batch API の結果ファイル由来の dict の両方を扱う
+    return obj.get(name) if isinstance(obj, dict) else getattr(obj, name, None)
+
+
+def note_usage(usage: Any) -> None:
+    """Chat Completions / Responses API の usage からトークン数を取り込む。"""
+    if usage is None:
+        return
+    prompt = _field(usage, "prompt_tokens")
+    if prompt is None:
+        prompt = _field(usage, "input_tokens")
+    completion = _field(usage, "completion_tokens")
+    if completion is None:
+        completion = _field(usage, "output_tokens")
+    details = _field(usage, "prompt_tokens_details") or _field(usage, "input_tokens_details")
+    cached = _field(details, "cached_tokens") if details is not None else None
+    note(prompt_tokens=prompt, completion_tokens=completion, cached_tokens=cached)
+
+
+class MetricsRecorder:
+    """計測レコードの集約先。直近のレコードをメモリに保持し、任意で JSON Lines に追記する。"""
+
+    def __init__(self, path: Optional[str] = None, *, max_records: int = 10000, max_bytes: int = 0):
+        self.path = Path(path) if path else None
+        self.max_bytes = max_bytes
+        self.records: Deque[CallRecord] = deque(maxlen=max_records)
+        self.emitted = 0
+        self._lock = threading.Lock()
+        self._file: Any = None
+
+    def _append(self, line: str) -> None:
+        # ファイルは開いたまま追記する（レコードごとに開き直さない）
+        assert self.path is not None
+        if self._file is None:
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+            self._file = open(self.path, "a", encoding="utf-8")
+        data = line.encode("utf-8")
+        # 他のプロセスの追記も含めた実際のサイズで判定し、上限を超えるなら1世代だけ残して切り替える
+        size = os.fstat(self._file.fileno()).st_size
+        if self.max_bytes and size and size + len(data) > self.max_bytes:
+            self._file.close()
+            os.replace(self.path, rotated_path(self.path))
+            self._file = open(self.path, "a", encoding="utf-8")
+        self._file.write(line)
+        self._file.flush()
+
+    def emit(self, record: CallRecord) -> None:
+        with self._lock:
+            self.records.append(record)
+            self.emitted += 1
+            if self.path is not None:
+                self._append(json.dumps(asdict(record), ensure_ascii=False) + "\n")
+
+    def close(self) -> None:
+        with self._lock:
+            if self._file is not None:
+                self._file.close()
+                self._file = None
+
+    def summary(self, by: Sequence[str] = ("doc_type", "model")) -> List[Dict[str, Any]]:
+        with self._lock:
+            rows = [asdict(r) for r in self.records]
+        return summarize(rows, by)
+
+    def since(self, mark: int) -> List[CallRecord]:
+        """emitted が mark だった時点以降に書き出されたレコード（メモリに残っている分）。"""
+        with self._lock:
+            n = min(len(self.records), self.emitted - mark)
+            return list(self.records)[-n:] if n > 0 else []
+
+
+_recorders: Dict[str, MetricsRecorder] = {}
+_recorders_lock = threading.Lock()
+
+
+def get_recorder(settings: AppSettings) -> MetricsRecorder:
+    """metrics_path ごとに共有の MetricsRecorder を返す（空文字ならメモリのみ）。"""
+    path = str(Path(settings.metrics_path).resolve()) if settings.metrics_path else ""
+    with _recorders_lock:
+        recorder = _recorders.get(path)
+        if recorder is None:
+            recorder = MetricsRecorder(path or None, max_bytes=settings.metrics_max_bytes)
+            _recorders[path] = recorder
+        return recorder
+
+
+@contextmanager
+def scope(**tags: Any) -> Iterator[None]:
+    """1ドキュメント（またはセクション）分の計測範囲。
+
+    範囲内のレコードには tags（doc_type 等）が付き、範囲を抜けた時点で書き出されます。
+    """
+    records: List[Tuple[CallRecord, MetricsRecorder]] = []
+    tags_token = _tags.set({**_tags.get(), **tags})
+    scope_token = _scope.set(records)
+    try:
+        yield
+    finally:
+        _scope.reset(scope_token)
+        _tags.reset(tags_token)
+        for rec, recorder in records:
+            recorder.emit(rec)
+
+
+_RECORD_FIELDS = frozenset(f.name for f in fields(CallRecord))
+
+
+@contextmanager
+def recording(settings: AppSettings, mode: str, **values: Any) -> Iterator[Optional[CallRecord]]:
+    """プロバイダを通さない呼び出し（Batch API の結果など）を1件のレコードとして記録する。
+
+    範囲内の note / branch / note_usage はこのレコードに反映されます。計測が無効なら None。
+    """
+    if not settings.metrics_enabled:
+        yield None
+        return
+    rec = CallRecord(
+        ts=time.strftime("%Y-%m-%dT%H:%M:%S"), provider=settings.provider_kind(), model=settings.model, mode=mode
+    )
+    for k, v in values.items():
+        if k in _RECORD_FIELDS:
+            setattr(rec, k, copy.copy(v))
+    token = _current.set(rec)
+    try:
+        yield rec
+    finally:
+        _current.reset(token)
+        get_recorder(settings).emit(rec)
+
+
+class InstrumentedProvider:
+    """provider.generate / agenerate / stream の所要時間・トークン数・分岐を計測するラッパ。"""
+
+    def __init__(self, inner: Any, settings: AppSettings):
+        self.inner = inner
+        self.settings = settings
+        self.recorder = get_recorder(settings)
+
+    def _start(self, mode: str, messages: List[Dict[str, str]]) -> CallRecord:
+        tags = _tags.get()
+        rec = CallRecord(
+            ts=time.strftime("%Y-%m-%dT%H:%M:%S"),
+            provider=self.settings.provider_kind(),
+            model=self.settings.model,
+            mode=mode,
+            request_chars=sum(len(m.get("content", "")) for m in messages),
+        )
+        # scope のタグのうちレコードの項目名と一致するもの（doc_type / section / context_* 等）を反映
+        for k, v in tags.items():
+            if k in _RECORD_FIELDS:
+                setattr(rec, k, copy.copy(v))
+        if rec.provider == "stub":
+            rec.api = "stub"
+        return rec
+
+    def _finish(self, rec: CallRecord, started: float, text: Optional[str], error: Optional[Exception]) -> None:
+        rec.latency = round(time.perf_counter() - started, 4)
+        rec.response_chars = len(text or "")
+        if error is not None:
+            rec.ok = False
+            rec.error = f"{type(error).__name__}: {error}"[:500]
+        records = _scope.get()
+        if records is None:
+            self.recorder.emit(rec)
+        else:
+            # スコープ終了時にまとめて書き出す（後処理の空出力フォールバックも反映するため）
+            records.append((rec, self.recorder))
+
+    def generate(self, messages: List[Dict[str, str]]) -> str:
+        rec = self._start("generate", messages)
+        token = _current.set(rec)
+        started = time.perf_counter()
+        text: Optional[str] = None
+        error: Optional[Exception] = None
+        try:
+            text = self.inner.generate(messages)
+            return text
+        except Exception as e:
+            error = e
+            raise
+        finally:
+            _current.reset(token)
+            self._finish(rec, started, text, error)
+
+    async def agenerate(self, messages: List[Dict[str, str]]) -> str:
+        rec = self._start("agenerate", messages)
+        token = _current.set(rec)
+        started = time.perf_counter()
+        text: Optional[str] = None
+        error: Optional[Exception] = None
+        try:
+            text = await self.inner.agenerate(messages)
+            return text
+        except Exception as e:
+            error = e
+            raise
+        finally:
+            _current.reset(token)
+            self._finish(rec, started, text, error)
+
+    def stream(self, messages: List[Dict[str, str]]) -> Iterator[str]:
+        rec = self._start("stream", messages)
+        started = time.perf_counter()
+        parts: List[str] = []
+        error: Optional[Exception] = None
+        try:
+            iterator = self.inner.stream(messages)
+            while True:
+                # 呼び出し側のコードに計測中レコードが漏れないよう、内部の実行中のみ設定する
+                token = _current.set(rec)
+                try:
+                    delta = next(iterator)
+                except StopIteration:
+                    break
+                finally:
+                    _current.reset(token)
+                if rec.ttft is None:
+                    rec.ttft = round(time.perf_counter() - started, 4)
+                parts.append(delta)
+                yield delta
+        except Exception as e:
+            error = e
+            raise
+        finally:
+            self._finish(rec, started, "".join(parts), error)
+
+
+def percentile(values: Iterable[float], pct: float) -> Optional[float]:
+    """最近傍順位法によるパーセンタイル（値がなければ None）。"""
+    data = sorted(v for v in values if v is not None)
+    if not data:
+        return None
+    rank = max(1, math.ceil(pct / 100.0 * len(data)))
+    return data[rank - 1]
+
+
+def summarize(rows: Iterable[Dict[str, Any]], by: Sequence[str] = ("doc_type", "model")) -> List[Dict[str, Any]]:
+    """レコード（dict）をグループごとに集計する。"""
+    groups: Dict[tuple, List[Dict[str, Any]]] = {}
+    for row in rows:
+        key = tuple(row.get(k) for k in by)
+        groups.setdefault(key, []).append(row)
+
+    result: List[Dict[str, Any]] = []
+    for key, items in sorted(groups.items(), key=lambda kv: tuple(str(x) for x in kv[0])):
+        latencies = [r.get("latency") for r in items]
+        ttfts = [r.get("ttft") for r in items]
+        prompt = [r["prompt_tokens"] for r in items if r.get("prompt_tokens") is not None]
+        cached = [r["cached_tokens"] for r in items if r.get("cached_tokens") is not None]
+        completion = [r["completion_tokens"] for r in items if r.get("completion_tokens") is not None]
+        row: Dict[str, Any] = dict(zip(by, key))
+        row.update(
+            {
+                "calls": len(items),
+                "errors": sum(1 for r in items if not r.get("ok", True)),
+                "latency_p50": percentile(latencies, 50),
+                "latency_p95": percentile(latencies, 95),
+                "ttft_p50": percentile(ttfts, 50),
+                "ttft_p95": percentile(ttfts, 95),
+                "prompt_tokens_avg": round(sum(prompt) / len(prompt), 1) if prompt else None,
+                "completion_tokens_avg": round(sum(completion) / len(completion), 1) if completion else None,
+                "tokens_total": sum(prompt) + sum(completion),
+                "cached_tokens_total": sum(cached),
+                "context_saved_tokens_total": sum(int(r.get("context_saved_tokens") or 0) for r in items),
+                "context_trimmed_calls": sum(1 for r in items if r.get("context_trimmed")),
+                "prompt_cache_ratio": round(sum(cached) / sum(prompt), 3) if prompt and sum(prompt) else None,
+                "param_retries": sum(int(r.get("param_retries") or 0) for r in items),
+                "retries": sum(int(r.get("retries") or 0) for r in items),
+                "queue_wait_p95": percentile([r.get("queue_wait") for r in items], 95),
+                "stub_fallbacks": sum(1 for r in items if r.get("stub_fallback")),
+                "cache_hits": sum(1 for r in items if r.get("cache") == "hit"),
+            }
+        )
+        result.append(row)
+    return result
+
+
+def usage_totals(records: Iterable[Any]) -> Dict[str, Any]:
+    """呼び出し数と入力/キャッシュ済み/出力トークンの合計（CallRecord または dict）。"""
+    rows = [asdict(r) if isinstance(r, CallRecord) else r for r in records]
+    prompt = sum(int(r.get("prompt_tokens") or 0) for r in rows)
+    cached = sum(int(r.get("cached_tokens") or 0) for r in rows)
+    return {
+        "calls": len(rows),
+        "prompt_tokens": prompt,
+        "cached_tokens": cached,
+        "completion_tokens": sum(int(r.get("completion_tokens") or 0) for r in rows),
+        "context_saved_tokens": sum(int(r.get("context_saved_tokens") or 0) for r in rows),
+        "prompt_cache_ratio": round(cached / prompt, 3) if prompt else None,
+    }
+
+
+def rotated_path(path: Path) -> Path:
+    """サイズ上限で退避した1世代前のメトリクスファイル。"""
+    return path.with_name(path.name + ".1")
+
+
+def load_records(path: str) -> List[Dict[str, Any]]:
+    """JSON Lines のメトリクスファイル（退避済みの1世代前を含む）を読み込む（壊れた行は無視）。"""
+    rows: List[Dict[str, Any]] = []
+    if not path:
+        return rows
+    for p in (rotated_path(Path(path)), Path(path)):
+        if not p.is_file():
+            continue
+        with open(p, encoding="utf-8") as f:
+            for line in f:
+                line = line.strip()
+                if not line:
+                    continue
+                try:
+                    rows.append(json.loads(line))
+                except ValueError:
+                    continue
+    return rows
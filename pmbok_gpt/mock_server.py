@@ -0,0 +1,373 @@
+from __future__ import annotations
+
+import json
+import math
+import threading
+import time
+import uuid
+from email.parser import BytesParser
+from email.policy import HTTP
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Dict, Optional, Tuple
+
+from .bench import CallPlan, SimulatedAPIError, SimulationProfile, Simulator
+
+_ERROR_TYPES = {400: "invalid_request_error", 429: "requests", 500: "server_error"}
+
+
+def _error_body(err: SimulatedAPIError) -> Dict[str, Any]:
+    param = next((p for p in ("max_tokens", "temperature", "response_format", "max_output_tokens") if f"'{p}'" in err.message), None)
+    return {
+        "error": {
+            "message": err.message,
+            "type": _ERROR_TYPES.get(err.status_code, "server_error"),
+            "param": param,
+            "code": "unsupported_parameter" if err.status_code == 400 else None,
+        }
+    }
+
+
+def _chat_body(model: str, plan: CallPlan) -> Dict[str, Any]:
+    return {
+        "id": f"chatcmpl-{uuid.uuid4().hex[:24]}",
+        "object": "chat.completion",
+        "created": int(time.time()),
+        "model": model,
+        "choices": [{"index": 0, "message": {"role": "assistant", "content": plan.text}, "finish_reason": "stop"}],
+        "usage": {
+            "prompt_tokens": plan.prompt_tokens,
+            "completion_tokens": plan.completion_tokens,
+            "total_tokens": plan.prompt_tokens + plan.completion_tokens,
+            "prompt_tokens_details": {"cached_tokens": plan.cached_tokens},
+        },
+    }
+
+
+def _response_body(model: str, plan: CallPlan, *, rid: Optional[str] = None) -> Dict[str, Any]:
+    return {
+        "id": rid or f"resp_{uuid.uuid4().hex[:24]}",
+        "object": "response",
+        "created_at": int(time.time()),
+        "model": model,
+        "status": "completed",
+        "output": [
+            {
+                "type": "message",
+                "id": f"msg_{uuid.uuid4().hex[:24]}",
+                "role": "assistant",
+                "status": "completed",
+                "content": [{"type": "output_text", "text": plan.text, "annotations": []}],
+            }
+        ],
+        "usage": {
+            "input_tokens": plan.prompt_tokens,
+            "output_tokens": plan.completion_tokens,
+            "total_tokens": plan.prompt_tokens + plan.completion_tokens,
+            "input_tokens_details": {"cached_tokens": plan.cached_tokens},
+        },
+    }
+
+
+def _multipart(content_type: str, body: bytes) -> Dict[str, Tuple[Optional[str], bytes]]:
+    """multipart/form-data を {name: (filename, data)} に分解する（Files API のアップロード用）。"""
+    message = BytesParser(policy=HTTP).parsebytes(f"Content-Type: {content_type}\r\n\r\n".encode("latin-1") + body)
+    parts: Dict[str, Tuple[Optional[str], bytes]] = {}
+    for part in message.iter_parts():
+        name = part.get_param("name", header="content-disposition")
+        if name:
+            parts[str(name)] = (part.get_filename(), part.get_payload(decode=True) or b"")
+    return parts
+
+
+def _batch_line(custom_id: str, status: int, body: Dict[str, Any]) -> bytes:
+    line = {
+        "id": f"batch_req_{uuid.uuid4().hex[:24]}",
+        "custom_id": custom_id,
+        "response": {"status_code": status, "request_id": uuid.uuid4().hex, "body": body},
+        "error": None,
+    }
+    return (json.dumps(line, ensure_ascii=False) + "\n").encode("utf-8")
+
+
+class _Handler(BaseHTTPRequestHandler):
+    # keep-alive で接続を再利用させる（ストリーミングは chunked で返す）
+    protocol_version = "HTTP/1.1"
+    server: "_Server"
+
+    def setup(self) -> None:
+        super().setup()
+        self.server.count("connections")
+
+    def log_message(self, format: str, *args: Any) -> None:
+        if self.server.verbose:
+            super().log_message(format, *args)
+
+    def _send_json(self, status: int, body: Dict[str, Any], headers: Optional[Dict[str, str]] = None) -> None:
+        data = json.dumps(body, ensure_ascii=False).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        for k, v in (headers or {}).items():
+            self.send_header(k, v)
+        self.end_headers()
+        self.wfile.write(data)
+        self.server.count(f"status_{status}")
+
+    def _write_chunk(self, data: bytes) -> None:
+        self.wfile.write(f"{len(data):x}\r\n".encode("ascii") + data + b"\r\n")
+        self.wfile.flush()
+
+    def _sse(self, payload: Dict[str, Any], event: Optional[str] = None) -> None:
+        head = f"event: {event}\n" if event else ""
+        self._write_chunk(f"{head}data: {json.dumps(payload, ensure_ascii=False)}\n\n".encode("utf-8"))
+
+    def do_GET(self) -> None:
+        path = self.path.split("?", 1)[0].rstrip("/")
+        if path == "/stats":
+            self._send_json(200, self.server.stats())
+        elif path == "/v1/models":
+            self._send_json(200, {"object": "list", "data": []})
+        elif path.startswith("/v1/batches/") and path[len("/v1/batches/"):] in self.server.batches:
+            self._send_json(200, self.server.batch(path[len("/v1/batches/"):]))
+        elif path.startswith("/v1/files/") and path.endswith("/content") and path.split("/")[3] in self.server.files:
+            data = self.server.files[path.split("/")[3]][1]
+            self.send_response(200)
+            self.send_header("Content-Type", "application/octet-stream")
+            self.send_header("Content-Length", str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+            self.server.count("status_200")
+        else:
+            self._send_json(404, {"error": {"message": f"Not found: {self.path}", "type": "invalid_request_error"}})
+
+    def do_POST(self) -> None:
+        self.server.count("requests")
+        length = int(self.headers.get("Content-Length") or 0)
+        raw = self.rfile.read(length)
+        if self.path.rstrip("/").endswith("/files"):
+            self._upload(raw)
+            return
+        try:
+            params = json.loads(raw or b"{}")
+        except ValueError:
+            self._send_json(400, {"error": {"message": "Invalid JSON body", "type": "invalid_request_error"}})
+            return
+        path = self.path.rstrip("/")
+        if path.endswith("/batches"):
+            self._create_batch(params)
+            return
+        if path.endswith("/chat/completions"):
+            kind = "chat"
+        elif path.endswith("/responses"):
+            kind = "responses"
+        else:
+            self._send_json(404, {"error": {"message": f"Not found: {self.path}", "type": "invalid_request_error"}})
+            return
+
+        plan = self.server.simulator.plan(params)
+        time.sleep(plan.delay)
+        if plan.error is not None:
+            headers: Dict[str, str] = {}
+            if plan.error.retry_after is not None:
+                headers["retry-after-ms"] = str(int(plan.error.retry_after * 1000))
+                headers["retry-after"] = str(max(1, math.ceil(plan.error.retry_after)))
+            self._send_json(plan.error.status_code, _error_body(plan.error), headers)
+            return
+
+        model = str(params.get("model", ""))
+        if not params.get("stream"):
+            time.sleep(sum(d for d, _ in plan.chunks))
+            self._send_json(200, _chat_body(model, plan) if kind == "chat" else _response_body(model, plan))
+            return
+
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.send_header("Cache-Control", "no-cache")
+        self.send_header("Transfer-Encoding", "chunked")
+        self.end_headers()
+        self.server.count("status_200")
+        self.server.count("streams")
+        try:
+            if kind == "chat":
+                cid = f"chatcmpl-{uuid.uuid4().hex[:24]}"
+                for delay, text in plan.chunks:
+                    time.sleep(delay)
+                    self._sse({
+                        "id": cid,
+                        "object": "chat.completion.chunk",
+                        "created": int(time.time()),
+                        "model": model,
+                        "choices": [{"index": 0, "delta": {"content": text}, "finish_reason": None}],
+                    })
+                self._write_chunk(b"data: [DONE]\n\n")
+            else:
+                rid = f"resp_{uuid.uuid4().hex[:24]}"
+                for seq, (delay, text) in enumerate(plan.chunks):
+                    time.sleep(delay)
+                    self._sse(
+                        {"type": "response.output_text.delta", "delta": text, "output_index": 0,
+                         "content_index": 0, "item_id": rid, "sequence_number": seq},
+                        "response.output_text.delta",
+                    )
+                self._sse(
+                    {"type": "response.completed", "response": _response_body(model, plan, rid=rid),
+                     "sequence_number": len(plan.chunks)},
+                    "response.completed",
+                )
+            self._write_chunk(b"")
+        except (BrokenPipeError, ConnectionResetError):
+            # クライアントが途中で切断した
+            self.close_connection = True
+
+
+    def _upload(self, raw: bytes) -> None:
+        parts = _multipart(self.headers.get("Content-Type", ""), raw)
+        if "file" not in parts:
+            self._send_json(400, {"error": {"message": "Missing file", "type": "invalid_request_error"}})
+            return
+        filename, data = parts["file"]
+        file_id = self.server.add_file(filename or "upload.jsonl", data)
+        self._send_json(200, self.server.file_object(file_id, purpose=parts.get("purpose", (None, b"batch"))[1].decode()))
+
+    def _create_batch(self, params: Dict[str, Any]) -> None:
+        input_file_id = str(params.get("input_file_id", ""))
+        if input_file_id not in self.server.files:
+            self._send_json(400, {"error": {"message": f"No such file: {input_file_id}", "type": "invalid_request_error"}})
+            return
+        batch_id = self.server.create_batch(input_file_id, str(params.get("endpoint", "")), params)
+        self._send_json(200, self.server.batch(batch_id))
+
+
+class _Server(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, address: Any, simulator: Simulator, *, verbose: bool = False):
+        super().__init__(address, _Handler)
+        self.simulator = simulator
+        self.verbose = verbose
+        self._counts: Dict[str, int] = {}
+        self._lock = threading.Lock()
+        # Files / Batches API（バッチは作成直後から別スレッドで処理する）
+        self.files: Dict[str, Tuple[str, bytes]] = {}
+        self.batches: Dict[str, Dict[str, Any]] = {}
+
+    def count(self, name: str) -> None:
+        with self._lock:
+            self._counts[name] = self._counts.get(name, 0) + 1
+
+    def add_file(self, filename: str, data: bytes) -> str:
+        file_id = f"file-{uuid.uuid4().hex[:24]}"
+        with self._lock:
+            self.files[file_id] = (filename, data)
+        return file_id
+
+    def file_object(self, file_id: str, *, purpose: str) -> Dict[str, Any]:
+        filename, data = self.files[file_id]
+        return {
+            "id": file_id, "object": "file", "bytes": len(data), "created_at": int(time.time()),
+            "filename": filename, "purpose": purpose, "status": "processed",
+        }
+
+    def create_batch(self, input_file_id: str, endpoint: str, params: Dict[str, Any]) -> str:
+        batch_id = f"batch_{uuid.uuid4().hex[:24]}"
+        with self._lock:
+            self.batches[batch_id] = {
+                "id": batch_id, "object": "batch", "endpoint": endpoint, "errors": None,
+                "input_file_id": input_file_id, "completion_window": params.get("completion_window", "24h"),
+                "status": "validating", "output_file_id": None, "error_file_id": None,
+                "created_at": int(time.time()), "metadata": params.get("metadata"),
+                "request_counts": {"total": 0, "completed": 0, "failed": 0},
+            }
+        self.count("batches")
+        threading.Thread(target=self._run_batch, args=(batch_id,), daemon=True).start()
+        return batch_id
+
+    def batch(self, batch_id: str) -> Dict[str, Any]:
+        with self._lock:
+            return json.loads(json.dumps(self.batches[batch_id]))
+
+    def _run_batch(self, batch_id: str) -> None:
+        # 1行ずつシミュレータに通す（バッチでは応答の遅延は再現しない）
+        with self._lock:
+            batch = self.batches[batch_id]
+            batch["status"] = "in_progress"
+            lines = [json.loads(x) for x in self.files[batch["input_file_id"]][1].decode("utf-8").splitlines() if x.strip()]
+        output, errors, failed = b"", b"", 0
+        for line in lines:
+            body = line.get("body") or {}
+            plan = self.simulator.plan(body)
+            if plan.error is not None:
+                failed += 1
+                errors += _batch_line(line["custom_id"], plan.error.status_code, _error_body(plan.error))
+            else:
+                output += _batch_line(line["custom_id"], 200, _chat_body(str(body.get("model", "")), plan))
+        output_id = self.add_file(f"{batch_id}_output.jsonl", output) if output else None
+        error_id = self.add_file(f"{batch_id}_error.jsonl", errors) if errors else None
+        with self._lock:
+            batch.update({
+                "status": "completed", "output_file_id": output_id, "error_file_id": error_id,
+                "completed_at": int(time.time()),
+                "request_counts": {"total": len(lines), "completed": len(lines) - failed, "failed": failed},
+            })
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            counts = dict(self._counts)
+        sim = self.simulator
+        counts.update({
+            "rejections": sim.rejections,
+            "errors": sim.errors,
+            "rate_limited": sim.rate_limited,
+            "prompt_tokens": sim.prompt_tokens,
+            "cached_tokens": sim.cached_tokens,
+        })
+        return counts
+
+
+class MockOpenAIServer:
+    """Chat Completions / Responses API（と Files / Batches API）互換のローカル疑似サーバ。
+
+    応答の遅延・エラー注入・パラメータ拒否は bench.SimulationProfile で指定します。
+    OPENAI_BASE_URL に base_url を設定すると、実際の HTTP 経路（接続再利用・SDK のリトライ）を
+    ネットワークなしで通せます。
+
+        with MockOpenAIServer(profile=SimulationProfile(time_scale=0.01)) as server:
+            settings = AppSettings(openai_base_url=server.base_url, openai_api_key="sk-mock")
+    """
+
+    def __init__(self, host: str = "127.0.0.1", port: int = 0, *, profile: Optional[SimulationProfile] = None, verbose: bool = False):
+        self.profile = profile or SimulationProfile(time_scale=1.0)
+        self._server = _Server((host, port), Simulator(self.profile), verbose=verbose)
+        self._thread: Optional[threading.Thread] = None
+
+    @property
+    def base_url(self) -> str:
+        host, port = self._server.server_address[:2]
+        return f"http://{host}:{port}/v1"
+
+    def stats(self) -> Dict[str, Any]:
+        """リクエスト数・接続数・ステータス別件数など。"""
+        return self._server.stats()
+
+    def start(self) -> "MockOpenAIServer":
+        """バックグラウンドのスレッドで待ち受けを開始する。"""
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._server.serve_forever, name="mock-openai", daemon=True)
+            self._thread.start()
+        return self
+
+    def serve_forever(self) -> None:
+        self._server.serve_forever()
+
+    def stop(self) -> None:
+        self._server.shutdown()
+        self._server.server_close()
+        if self._thread is not None:
+            self._thread.join(timeout=5)
+            self._thread = None
+
+    def __enter__(self) -> "MockOpenAIServer":
+        return self.start()
+
+    def __exit__(self, *exc: Any) -> None:
+        self.stop()
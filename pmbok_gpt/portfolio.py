@@ -0,0 +1,204 @@
+from __future__ import annotations
+
+import asyncio
+import math
+import multiprocessing
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, as_completed
+from concurrent.futures.process import BrokenProcessPool
+from dataclasses import asdict
+from pathlib import Path
+from typing import Any, Callable, Dict, Iterator, List, Optional, Sequence, Tuple
+
+from . import metrics
+from .batch import BatchReport, DocumentResult, collect_project_files, load_contexts, plan_outputs, resolve_doc_types
+from .config import AppSettings
+from .generator import agenerate_sectioned_document, agenerate_text_document
+from .metrics import CallRecord
+from .providers import get_provider
+
+# 1プロセスあたりのシャード数（サイズのばらつきを動的に均す。多すぎると起動・読み込みの重複が増える）
+SHARDS_PER_PROCESS = 4
+
+
+def default_processes() -> int:
+    return os.cpu_count() or 1
+
+
+def shard_projects(files: Sequence[Path], shards: int) -> List[List[Path]]:
+    """プロジェクトJSONをファイルサイズで均等になるよう shards 個に分ける（大きい順に最も軽い組へ）。"""
+    groups: List[List[Path]] = [[] for _ in range(max(1, min(shards, len(files))))]
+    loads = [0] * len(groups)
+    for pf in sorted(files, key=lambda p: (-Path(p).stat().st_size, str(p))):
+        i = loads.index(min(loads))
+        groups[i].append(Path(pf))
+        loads[i] += Path(pf).stat().st_size
+    return [g for g in groups if g]
+
+
+def worker_settings(settings: AppSettings, processes: int) -> Dict[str, Any]:
+    """子プロセス用の設定。RPM/TPM と同時実行数の上限はプロセス数で割り、計測は親でまとめて書き出す。"""
+    data = settings.model_dump()
+    n = max(1, processes)
+    for name in ("rate_limit_rpm", "rate_limit_tpm"):
+        if data[name]:
+            data[name] = max(1, data[name] // n)
+    data["max_concurrency"] = max(1, math.ceil(data["max_concurrency"] / n))
+    data["metrics_path"] = ""
+    return data
+
+
+def _run_shard(job: Dict[str, Any]) -> Dict[str, Any]:
+    """子プロセスで1シャード分を生成する（JSONの読み込みから書き出しまで、1つのイベントループで並行）。"""
+    settings = AppSettings(**job["settings"])
+    recorder = metrics.get_recorder(settings)
+    mark = recorder.emitted
+    tasks = job["tasks"]
+    contexts = load_contexts([Path(p) for p in dict.fromkeys(t["project"] for t in tasks)])
+    sectioned = job["sectioned"]
+    generate = agenerate_sectioned_document if sectioned else agenerate_text_document
+
+    async def _all() -> List[DocumentResult]:
+        provider = None if sectioned else get_provider(settings)
+        limit = asyncio.Semaphore(max(1, job["concurrency"]))
+
+        async def _one(task: Dict[str, Any]) -> DocumentResult:
+            async with limit:
+                start = time.perf_counter()
+                try:
+                    await generate(
+                        doc_type=task["doc_type"],
+                        project_context=contexts[task["project"]],
+                        out_path=task["out_path"],
+                        language=job["language"],
+                        extra_instructions=job["extra_instructions"],
+                        settings=settings,
+                        provider=provider,
+                    )
+                    return DocumentResult(elapsed=time.perf_counter() - start, ok=True, **task)
+                except Exception as e:
+                    return DocumentResult(elapsed=time.perf_counter() - start, ok=False, error=str(e), **task)
+
+        return list(await asyncio.gather(*[_one(t) for t in tasks]))
+
+    results = asyncio.run(_all())
+    return {
+        "pid": os.getpid(),
+        "results": [asdict(r) for r in results],
+        "records": [asdict(r) for r in recorder.since(mark)],
+    }
+
+
+def _failed_shard(job: Dict[str, Any], error: str) -> Dict[str, Any]:
+    return {"records": [], "results": [{**t, "elapsed": 0.0, "ok": False, "error": error} for t in job["tasks"]]}
+
+
+def _pool(processes: int) -> ProcessPoolExecutor:
+    # fork は親のスレッド（接続プール・スケジューラ）を引き継いで固まることがあるため spawn を使う
+    return ProcessPoolExecutor(max_workers=processes, mp_context=multiprocessing.get_context("spawn"))
+
+
+def _run_isolated(worker: Callable[[Dict[str, Any]], Dict[str, Any]], job: Dict[str, Any]) -> Dict[str, Any]:
+    # 1シャードだけを専用のプロセスで実行する（異常終了しても、ほかのシャードを巻き込まない）
+    try:
+        with _pool(1) as ex:
+            return ex.submit(worker, job).result()
+    except BrokenProcessPool as e:
+        return _failed_shard(job, f"子プロセスが異常終了しました: {e}")
+    except Exception as e:
+        return _failed_shard(job, f"{type(e).__name__}: {e}")
+
+
+def run_shards(
+    jobs: Sequence[Dict[str, Any]],
+    processes: int,
+    worker: Callable[[Dict[str, Any]], Dict[str, Any]] = _run_shard,
+) -> Iterator[Tuple[Dict[str, Any], Dict[str, Any]]]:
+    """シャードをプロセスプールで実行し、終わったものから (job, 結果) を返す。
+
+    子プロセスが異常終了するとプール全体が使えなくなり、未完了のシャードもすべて BrokenProcessPool になる。
+    それらは1シャードずつ専用のプロセスで実行し直すため、失敗として返るのは実際に落ちたシャードのタスクだけです。
+    """
+    crashed: List[Dict[str, Any]] = []
+    with _pool(processes) as ex:
+        futures = {ex.submit(worker, job): job for job in jobs}
+        for fut in as_completed(futures):
+            job = futures[fut]
+            try:
+                out = fut.result()
+            except BrokenProcessPool:
+                crashed.append(job)
+                continue
+            except Exception as e:
+                out = _failed_shard(job, f"{type(e).__name__}: {e}")
+            yield job, out
+    if crashed:
+        with ThreadPoolExecutor(max_workers=max(1, min(processes, len(crashed)))) as tx:
+            yield from zip(crashed, tx.map(lambda job: _run_isolated(worker, job), crashed))
+
+
+def generate_portfolio(
+    project_dir: Path,
+    out_dir: Path,
+    *,
+    doc_types: Optional[Sequence[str]] = None,
+    language: Optional[str] = None,
+    extra_instructions: Optional[str] = None,
+    settings: Optional[AppSettings] = None,
+    processes: int = 0,
+    concurrency: int = 8,
+    sectioned: bool = False,
+    on_done: Optional[Callable[[DocumentResult], None]] = None,
+) -> BatchReport:
+    """プロジェクトJSONのディレクトリをプロセスプールで分担して生成する。
+
+    各プロセスは自前のイベントループで最大 concurrency 件を並行に待ち合わせ、JSON の読み込み・
+    プロンプト構築・後処理などの CPU 処理は GIL を越えてコア数に応じて分散されます。
+    出力配置は batch と同じです。計測レコードは親プロセスで集約して書き出します。
+    processes=0 は CPU コア数。on_done はシャードの完了ごとに親プロセスから呼ばれます。
+    子プロセスが異常終了した場合は、巻き込まれた未完了のシャードを別のプロセスで実行し直します（run_shards）。
+    """
+    settings = settings or AppSettings()
+    files = collect_project_files(project_dir)
+    if not files:
+        raise ValueError(f"プロジェクトJSONが見つかりません: {project_dir}")
+    doc_types = resolve_doc_types(doc_types)
+    processes = max(1, min(processes or default_processes(), len(files)))
+    tasks = plan_outputs([f.resolve() for f in files], doc_types, Path(out_dir).resolve())
+    for t in tasks:
+        Path(t["out_path"]).parent.mkdir(parents=True, exist_ok=True)
+
+    by_project: Dict[str, List[Dict[str, Any]]] = {}
+    for t in tasks:
+        by_project.setdefault(t["project"], []).append(t)
+    child_settings = worker_settings(settings, processes)
+    jobs = [
+        {
+            "settings": child_settings,
+            "tasks": [t for pf in shard for t in by_project[str(pf)]],
+            "language": language,
+            "extra_instructions": extra_instructions,
+            "sectioned": sectioned,
+            "concurrency": concurrency,
+        }
+        for shard in shard_projects([Path(p) for p in by_project], processes * SHARDS_PER_PROCESS)
+    ]
+
+    recorder = metrics.get_recorder(settings)
+    order = {(t["project"], t["doc_type"]): n for n, t in enumerate(tasks)}
+    results: List[DocumentResult] = []
+    report = BatchReport()
+    start = time.perf_counter()
+    for _, out in run_shards(jobs, processes):
+        if settings.metrics_enabled:
+            for row in out["records"]:
+                recorder.emit(CallRecord(**row))
+        for row in out["results"]:
+            result = DocumentResult(**row)
+            results.append(result)
+            if on_done is not None:
+                on_done(result)
+    report.wall_clock = time.perf_counter() - start
+    report.results = sorted(results, key=lambda r: order[(r.project, r.doc_type)])
+    return report
@@ -1,9 +1,17 @@
 from __future__ import annotations
 
+import json
 import os
-from typing import Any, Dict, List, Optional
+from abc import ABC, abstractmethod
+from typing import Any, Dict, Iterator, List, NamedTuple, Optional
 
+from . import metrics
+from .cache import CachedProvider, get_cache
+from .capabilities import capability_key, get_registry
+from .clients import get_async_client, get_client
 from .config import AppSettings
+from .ratelimit import estimate_request_tokens, get_scheduler
+from .routing import RoutingProvider, secondary_settings
 
 
 def _ensure_messages(messages: List[Dict[str, str]]) -> List[Dict[str, str]]:
@@ -41,267 +49,631 @@ class StubProvider:
             body.append(f"\n{i}. {sec}\n本文(スタブ): {sec} の要点を箇条書きで3点。\n- ポイント1\n- ポイント2\n- ポイント3")
         return "\n".join(body)
 
+    async def agenerate(self, messages: List[Dict[str, str]]) -> str:
+        return self.generate(messages)
+
+    def stream(self, messages: List[Dict[str, str]]) -> Iterator[str]:
+        # 行単位で逐次返す（ストリーミング経路の動作確認用）
+        for line in self.generate(messages).splitlines(keepends=True):
+            yield line
+
+
+class ChatShape(NamedTuple):
+    """Chat Completions に送るパラメータの組み合わせ。"""
+
+    use_completion_param: bool
+    include_temperature: bool
+    include_response_format: bool
+
+
+def _is_gpt5(model: Optional[str]) -> bool:
+    model_l = (model or "").lower()
+    return model_l.startswith("gpt-5") or "gpt-5" in model_l
+
+
+def _max_tokens_rejected(msg: str) -> bool:
+    return "max_tokens" in msg and "max_completion_tokens" in msg
+
+
+def _temperature_rejected(msg: str) -> bool:
+    return "temperature" in msg and ("unsupported" in msg or "Only the default" in msg)
+
+
+def _max_output_tokens_rejected(msg: str) -> bool:
+    # Responses API の出力上限。タイムアウト・5xx・429 等は該当しない（非対応と誤って記録しないように）
+    low = msg.lower()
+    return "max_output_tokens" in msg and any(w in low for w in ("unsupported", "not supported", "unknown", "unrecognized"))
 
-class OpenAIProvider:
-    def __init__(self, settings: AppSettings):
-        from openai import OpenAI  # lazy import
 
-        if settings.openai_api_key:
-            os.environ["OPENAI_API_KEY"] = settings.openai_api_key
-        if settings.openai_base_url:
-            os.environ["OPENAI_BASE_URL"] = settings.openai_base_url
+def _response_format_rejected(msg: str) -> bool:
+    return "response_format" in msg and ("unsupported" in msg or "Invalid" in msg or "Unknown" in msg)
+
+
+def fallback_shape(shape: ChatShape, error: Exception) -> Optional[ChatShape]:
+    """エラー文言から、次に試すパラメータの組み合わせを決める。
+
+    - max_tokens 非対応 -> max_completion_tokens に切替
+    - temperature 非対応 -> temperature を省略（API既定値）
+    - response_format 非対応 -> response_format を省略
+    いずれにも該当しない（または既に外している）場合は None（=再送しない）。
+    """
+    msg = str(error)
+    if not shape.use_completion_param and _max_tokens_rejected(msg):
+        return shape._replace(use_completion_param=True)
+    if shape.include_temperature and _temperature_rejected(msg):
+        return shape._replace(include_temperature=False)
+    if shape.include_response_format and _response_format_rejected(msg):
+        return shape._replace(include_response_format=False)
+    return None
+
+
+_SHAPE_BRANCHES = {
+    "use_completion_param": "param:max_completion_tokens",
+    "include_temperature": "param:-temperature",
+    "include_response_format": "param:-response_format",
+}
+
+
+def _note_fallback(shape: ChatShape, next_shape: ChatShape) -> None:
+    for name in ChatShape._fields:
+        if getattr(shape, name) != getattr(next_shape, name):
+            metrics.branch(_SHAPE_BRANCHES[name])
+
+
+def _extract_text_from_chat(resp: Any) -> str:
+    try:
+        choices = getattr(resp, "choices", []) or []
+        texts: List[str] = []
+        for ch in choices:
+            msg = getattr(ch, "message", None)
+            if msg is None:
+                continue
+            content = getattr(msg, "content", None)
+            if content:
+                texts.append(str(content))
+        return "\n\n".join([t for t in texts if t.strip()])
+    except Exception:
+        return ""
+
+
+def _extract_text_from_responses(r: Any) -> str:
+    text = getattr(r, "output_text", None)
+    if text and str(text).strip():
+        return str(text)
+    try:
+        outputs = getattr(r, "output", None) or getattr(r, "outputs", None) or []
+        chunks: List[str] = []
+        for out in outputs:
+            cont = getattr(out, "content", None) or []
+            for item in cont:
+                if getattr(item, "type", "") == "output_text":
+                    val = getattr(item, "text", "")
+                    if val:
+                        chunks.append(str(val))
+        if chunks:
+            return "\n".join(chunks)
+    except Exception:
+        pass
+    return ""
+
+
+def _messages_to_prompt(messages: List[Dict[str, str]]) -> str:
+    # Responses API 用にメッセージを単一テキストに畳み込み
+    prompt_lines = [f"{m.get('role','user').upper()}:\n{m.get('content','')}" for m in messages]
+    return "\n\n".join(prompt_lines)
+
+
+class _ChatCompletionsMixin(ABC):
+    """OpenAI / Azure 共通の Chat Completions 呼び出し（同期/非同期）。"""
+
+    settings: AppSettings
+    client: Any
+
+    @abstractmethod
+    def _make_async_client(self) -> Any:
+        """実行中のイベントループで共有する非同期クライアント。"""
+
+    @property
+    def aclient(self) -> Any:
+        # 明示的に差し替えられていなければ、実行中ループの共有クライアントを使う
+        if getattr(self, "_aclient", None) is not None:
+            return self._aclient
+        return self._make_async_client()
+
+    @abstractmethod
+    def _capability_key(self) -> str:
+        """互換情報・スケジューラを共有する単位（プロバイダ・エンドポイント・モデル）。"""
+
+    def _learned(self) -> Dict[str, Any]:
+        """過去の成功時に記録した送信形（未記録・無効時は空）。"""
+        if not self.settings.learn_capabilities:
+            return {}
+        return get_registry(self.settings).get(self._capability_key())
+
+    def _learn(self, **fields: Any) -> None:
+        if self.settings.learn_capabilities:
+            get_registry(self.settings).record(self._capability_key(), **fields)
+
+    def record_batch_shape(self, shape: ChatShape) -> None:
+        """バッチで受理された送信形を互換情報に記録する（以降の逐次呼び出しも同じ形から始める）。"""
+        self._learn(**shape._asdict())
+
+    def _send(self, create: Any, params: Dict[str, Any]) -> Any:
+        """API 呼び出しを共有スケジューラ経由で行う（RPM/TPM・429/5xx の再送）。"""
+        if not self.settings.scheduler_enabled:
+            return create(**params)
+        scheduler = get_scheduler(self.settings, self._capability_key())
+        tokens = estimate_request_tokens(params, self.settings.effective_max_tokens())
+        return scheduler.call(lambda: create(**params), tokens=tokens)
+
+    async def _asend(self, create: Any, params: Dict[str, Any]) -> Any:
+        if not self.settings.scheduler_enabled:
+            return await create(**params)
+        scheduler = get_scheduler(self.settings, self._capability_key())
+        tokens = estimate_request_tokens(params, self.settings.effective_max_tokens())
+        return await scheduler.acall(lambda: create(**params), tokens=tokens)
+
+    def _initial_shape(self) -> ChatShape:
+        learned = self._learned()
+        if all(k in learned for k in ChatShape._fields):
+            return ChatShape(**{k: bool(learned[k]) for k in ChatShape._fields})
+        # GPT-5 系のモデル名では temperature を最初から送らない（仕様互換）
+        return ChatShape(
+            use_completion_param=False,
+            include_temperature=not _is_gpt5(self.settings.model),
+            include_response_format=True,
+        )
+
+    def _chat_params(
+        self,
+        messages: List[Dict[str, str]],
+        shape: ChatShape,
+        response_format: Optional[Dict[str, Any]] = None,
+        **extra: Any,
+    ) -> Dict[str, Any]:
+        params: Dict[str, Any] = {
+            "model": self.settings.model,
+            "messages": messages,
+            **extra,
+        }
+        if shape.include_temperature:
+            params["temperature"] = self.settings.temperature
+        if shape.include_response_format:
+            # 新仕様モデルでの安全なテキスト出力を促す。未対応モデルではフォールバックする
+            params["response_format"] = response_format or {"type": "text"}
+        if shape.use_completion_param:
+            params["max_completion_tokens"] = self.settings.effective_max_tokens()
+        else:
+            params["max_tokens"] = self.settings.effective_max_tokens()
+        return params
+
+    def _create_chat(self, messages: List[Dict[str, str]], **extra: Any) -> Any:
+        shape = self._initial_shape()
+        while True:
+            try:
+                resp = self._send(self.client.chat.completions.create, self._chat_params(messages, shape, **extra))
+            except Exception as e:
+                next_shape = fallback_shape(shape, e)
+                if next_shape is None:
+                    raise
+                _note_fallback(shape, next_shape)
+                shape = next_shape
+                continue
+            self._learn(**shape._asdict())
+            metrics.note(api="chat")
+            metrics.note_usage(getattr(resp, "usage", None))
+            return resp
+
+    def _stream_chat(self, messages: List[Dict[str, str]]) -> Iterator[str]:
+        # パラメータ非対応のエラーはストリーム開始前（create 時）に返るため、同じフォールバックが効く
+        for chunk in self._create_chat(messages, stream=True):
+            for ch in getattr(chunk, "choices", None) or []:
+                delta = getattr(getattr(ch, "delta", None), "content", None)
+                if delta:
+                    yield str(delta)
+
+    async def _acreate_chat(self, messages: List[Dict[str, str]]) -> Any:
+        shape = self._initial_shape()
+        while True:
+            try:
+                resp = await self._asend(self.aclient.chat.completions.create, self._chat_params(messages, shape))
+            except Exception as e:
+                next_shape = fallback_shape(shape, e)
+                if next_shape is None:
+                    raise
+                _note_fallback(shape, next_shape)
+                shape = next_shape
+                continue
+            self._learn(**shape._asdict())
+            metrics.note(api="chat")
+            metrics.note_usage(getattr(resp, "usage", None))
+            return resp
+
+    # --- 構造化出力（JSON）: json_schema -> json_object -> 指定なし（プロンプトの指示のみ）の順に試す ---
+
+    def _json_formats(self, schema: Dict[str, Any], name: str) -> List[Optional[Dict[str, Any]]]:
+        formats: List[Optional[Dict[str, Any]]] = [
+            {"type": "json_schema", "json_schema": {"name": name, "schema": schema, "strict": True}},
+            {"type": "json_object"},
+            None,
+        ]
+        # 過去に通った形式から始める（非対応の形式で毎回エラーを受けないように）
+        learned = self._learned().get("json_format")
+        names = [f["type"] if f else "none" for f in formats]
+        return formats[names.index(learned):] if learned in names else formats
+
+    def generate_json(self, messages: List[Dict[str, str]], schema: Dict[str, Any], *, name: str = "result") -> str:
+        """schema に沿った JSON 文字列を返す。モデルが対応していれば API 側でスキーマを強制します。
+
+        json_object / 指定なしに落ちた場合はスキーマが保証されないため、呼び出し側で検証してください。
+        """
+        _ensure_messages(messages)
+        shape = self._initial_shape()._replace(include_response_format=True)
+        formats = self._json_formats(schema, name)
+        while True:
+            fmt = formats[0]
+            params = self._chat_params(messages, shape._replace(include_response_format=fmt is not None), fmt)
+            try:
+                resp = self._send(self.client.chat.completions.create, params)
+            except Exception as e:
+                if fmt is not None and _response_format_rejected(str(e)):
+                    metrics.branch(f"json:-{fmt['type']}")
+                    formats = formats[1:]
+                    continue
+                next_shape = fallback_shape(shape._replace(include_response_format=False), e)
+                if next_shape is None:
+                    raise
+                _note_fallback(shape, next_shape._replace(include_response_format=True))
+                shape = next_shape._replace(include_response_format=True)
+                continue
+            self._learn(
+                json_format=fmt["type"] if fmt else "none",
+                use_completion_param=shape.use_completion_param,
+                include_temperature=shape.include_temperature,
+            )
+            metrics.note(api="chat")
+            metrics.note_usage(getattr(resp, "usage", None))
+            return _extract_text_from_chat(resp)
+
+    # --- Batch API（大量生成向け。結果は最長 completion_window 後に取得） ---
+
+    _batch_endpoint = "/v1/chat/completions"
+
+    def batch_shape(self) -> ChatShape:
+        """バッチの各行に使う送信形。1行ずつのフォールバックができないため、学習結果がなければ
+        GPT-5 系では max_completion_tokens を最初から使う。"""
+        shape = self._initial_shape()
+        if not self._learned() and _is_gpt5(self.settings.model):
+            shape = shape._replace(use_completion_param=True)
+        return shape
+
+    def batch_line(self, custom_id: str, messages: List[Dict[str, str]], shape: ChatShape) -> Dict[str, Any]:
+        """バッチ入力ファイル(JSONL)の1行。"""
+        _ensure_messages(messages)
+        return {
+            "custom_id": custom_id,
+            "method": "POST",
+            "url": self._batch_endpoint,
+            "body": self._chat_params(messages, shape),
+        }
+
+    def submit_batch(self, lines: List[Dict[str, Any]], *, metadata: Optional[Dict[str, str]] = None) -> str:
+        """入力ファイルをアップロードしてバッチを作成し、バッチIDを返す。"""
+        data = "".join(json.dumps(line, ensure_ascii=False) + "\n" for line in lines).encode("utf-8")
+        uploaded = self.client.files.create(file=("pmbok_batch.jsonl", data), purpose="batch")
+        batch = self.client.batches.create(
+            input_file_id=uploaded.id,
+            endpoint=self._batch_endpoint,
+            completion_window=self.settings.batch_completion_window,
+            metadata=metadata,
+        )
+        return str(batch.id)
+
+    def retrieve_batch(self, batch_id: str) -> Any:
+        return self.client.batches.retrieve(batch_id)
+
+    def batch_results(self, batch: Any) -> Dict[str, Dict[str, Any]]:
+        """完了（または期限切れ・取消）したバッチの結果を custom_id ごとに返す。
+
+        値は {"status": HTTPステータス, "text": 本文, "usage": usage, "error": エラー文言}。
+        """
+        results: Dict[str, Dict[str, Any]] = {}
+        for file_id in (getattr(batch, "output_file_id", None), getattr(batch, "error_file_id", None)):
+            if not file_id:
+                continue
+            for raw in self.client.files.content(file_id).text.splitlines():
+                if not raw.strip():
+                    continue
+                line = json.loads(raw)
+                response = line.get("response") or {}
+                body = response.get("body") or {}
+                error = line.get("error") or body.get("error")
+                choices = body.get("choices") or []
+                text = "\n\n".join(
+                    str(c.get("message", {}).get("content") or "") for c in choices if c.get("message", {}).get("content")
+                )
+                results[str(line.get("custom_id"))] = {
+                    "status": response.get("status_code"),
+                    "text": text,
+                    "usage": body.get("usage"),
+                    "error": (error or {}).get("message") if isinstance(error, dict) else error,
+                }
+        return results
+
+
+class OpenAIProvider(_ChatCompletionsMixin):
+    def __init__(self, settings: AppSettings, *, client: Any = None, aclient: Any = None):
+        """client / aclient を渡すと共有プールの代わりにそのクライアントを使います（ベンチマーク・テスト用）。"""
+        api_key = settings.openai_api_key or os.getenv("OPENAI_API_KEY")
+        base_url = settings.openai_base_url or os.getenv("OPENAI_BASE_URL")
 
         # OPENAI_BASE_URL が空文字や不正な場合をガード
-        base_url = os.getenv("OPENAI_BASE_URL")
         if base_url is not None:
-            base_url_stripped = base_url.strip()
-            if base_url_stripped == "":
-                # 空の場合は環境変数自体を外して、SDKのデフォルト(https://api.openai.com/v1)を使う
-                os.environ.pop("OPENAI_BASE_URL", None)
-            elif not (base_url_stripped.startswith("http://") or base_url_stripped.startswith("https://")):
+            base_url = base_url.strip()
+            if base_url == "":
+                # 空の場合は未指定扱いにして、SDKのデフォルト(https://api.openai.com/v1)を使う
+                base_url = None
+            elif not (base_url.startswith("http://") or base_url.startswith("https://")):
                 raise RuntimeError(
                     "OPENAI_BASE_URL が不正です。'https://...' で始まる完全なURLを設定してください。例: https://api.openai.com/v1"
                 )
 
         # 明確なチェック
-        if not os.getenv("OPENAI_API_KEY"):
+        if not api_key and client is None:
             raise RuntimeError(
                 "OPENAI_API_KEY が設定されていません。.env または環境変数で設定してください。"
             )
 
-        self.client = OpenAI()
+        self.api_key = api_key
+        self.base_url = base_url
         self.settings = settings
+        # 資格情報・エンドポイントが同じならプロセス内で接続プールを共有（環境変数は書き換えない）
+        self.client = client if client is not None else get_client("openai", api_key, base_url, None, settings)
+        self._aclient = aclient
+
+    def _make_async_client(self) -> Any:
+        return get_async_client("openai", self.api_key, self.base_url, None, self.settings)
+
+    def _capability_key(self) -> str:
+        return capability_key("openai", self.base_url, self.settings.model)
+
+    def _prefer_responses(self) -> bool:
+        # Responses API を優先する条件（明示指定 > 学習結果 > gpt-5 系の既定）
+        if self.settings.use_responses_api:
+            return True
+        learned = self._learned().get("preferred_api")
+        if learned in ("chat", "responses"):
+            return learned == "responses"
+        return _is_gpt5(self.settings.model)
+
+    def _responses_params(self, messages: List[Dict[str, str]], with_max: bool) -> Dict[str, Any]:
+        r_params: Dict[str, Any] = {
+            "model": self.settings.model,
+            "input": _messages_to_prompt(messages),
+        }
+        if with_max:
+            r_params["max_output_tokens"] = self.settings.effective_max_tokens()
+        return r_params
+
+    @staticmethod
+    def _responses_text(r: Any) -> str:
+        metrics.note(api="responses")
+        metrics.note_usage(getattr(r, "usage", None))
+        return _extract_text_from_responses(r)
+
+    def _call_responses_api(self, messages: List[Dict[str, str]]) -> str:
+        # 出力長の指定が必要なモデル向けにまずは設定、エラーなら外して再試行
+        if self._learned().get("responses_max_output_tokens", True):
+            try:
+                r = self._send(self.client.responses.create, self._responses_params(messages, True))
+            except Exception as e:
+                if not _max_output_tokens_rejected(str(e)):
+                    raise
+                metrics.branch("param:-max_output_tokens")
+            else:
+                self._learn(responses_max_output_tokens=True)
+                return self._responses_text(r)
+        r = self._send(self.client.responses.create, self._responses_params(messages, False))
+        self._learn(responses_max_output_tokens=False)
+        return self._responses_text(r)
+
+    async def _acall_responses_api(self, messages: List[Dict[str, str]]) -> str:
+        if self._learned().get("responses_max_output_tokens", True):
+            try:
+                r = await self._asend(self.aclient.responses.create, self._responses_params(messages, True))
+            except Exception as e:
+                if not _max_output_tokens_rejected(str(e)):
+                    raise
+                metrics.branch("param:-max_output_tokens")
+            else:
+                self._learn(responses_max_output_tokens=True)
+                return self._responses_text(r)
+        r = await self._asend(self.aclient.responses.create, self._responses_params(messages, False))
+        self._learn(responses_max_output_tokens=False)
+        return self._responses_text(r)
 
     def generate(self, messages: List[Dict[str, str]]) -> str:
         """Call Chat Completions with compatibility fallbacks:
         - max_tokens -> fallback to max_completion_tokens when required
         - temperature unsupported -> fallback to API default by omitting temperature
         - If content is empty, fallback to Responses API
+        The parameter shape and API that worked are remembered per model (capabilities.py).
         """
         _ensure_messages(messages)
 
-        def _call(use_completion_param: bool, include_temperature: bool, include_response_format: bool):
-            params: Dict[str, Any] = {
-                "model": self.settings.model,
-                "messages": messages,
-            }
-            if include_temperature:
-                params["temperature"] = self.settings.temperature
-            if include_response_format:
-                # 新仕様モデルでの安全なテキスト出力を促す。未対応モデルではフォールバックする
-                params["response_format"] = {"type": "text"}
-            if use_completion_param:
-                params["max_completion_tokens"] = self.settings.max_tokens
-            else:
-                params["max_tokens"] = self.settings.max_tokens
-            return self.client.chat.completions.create(**params)
-
-        def _extract_text_from_chat(resp: Any) -> str:
-            try:
-                choices = getattr(resp, "choices", []) or []
-                texts: List[str] = []
-                for ch in choices:
-                    msg = getattr(ch, "message", None)
-                    if msg is None:
-                        continue
-                    content = getattr(msg, "content", None)
-                    if content:
-                        texts.append(str(content))
-                return "\n\n".join([t for t in texts if t.strip()])
-            except Exception:
-                return ""
-
-        def _call_responses_api(messages: List[Dict[str, str]]) -> str:
-            # メッセージを単一テキストに畳み込み
-            prompt_lines = [f"{m.get('role','user').upper()}:\n{m.get('content','')}" for m in messages]
-            prompt = "\n\n".join(prompt_lines)
-            r_params: Dict[str, Any] = {
-                "model": self.settings.model,
-                "input": prompt,
-            }
-            # 出力長の指定が必要なモデル向けにまずは設定、エラーなら外して再試行
-            try:
-                r_params["max_output_tokens"] = self.settings.max_tokens
-                r = self.client.responses.create(**r_params)
-            except Exception:
-                r_params.pop("max_output_tokens", None)
-                r = self.client.responses.create(**r_params)
-
-            text2 = getattr(r, "output_text", None)
-            if text2 and str(text2).strip():
-                return str(text2)
-            try:
-                outputs = getattr(r, "output", None) or getattr(r, "outputs", None) or []
-                chunks: List[str] = []
-                for out in outputs:
-                    cont = getattr(out, "content", None) or []
-                    for item in cont:
-                        if getattr(item, "type", "") == "output_text":
-                            val = getattr(item, "text", "")
-                            if val:
-                                chunks.append(str(val))
-                if chunks:
-                    return "\n".join(chunks)
-            except Exception:
-                pass
-            return ""
-
-        # Responses API を優先する条件
-        model_l = (self.settings.model or "").lower()
-        prefer_responses = self.settings.use_responses_api or model_l.startswith("gpt-5") or "gpt-5" in model_l
-
-        if prefer_responses:
-            text_r = _call_responses_api(messages)
+        if self._prefer_responses():
+            text_r = self._call_responses_api(messages)
             if text_r and text_r.strip():
+                self._learn(preferred_api="responses")
                 return text_r
             # Responsesでダメなら従来の Chat Completions にもトライ
+            metrics.branch("responses:empty")
 
-        # GPT-5 系のモデル名では temperature を最初から送らない（仕様互換）
-        default_include_temp = not (model_l.startswith("gpt-5") or "gpt-5" in model_l)
+        text = _extract_text_from_chat(self._create_chat(messages))
+        if text and text.strip():
+            self._learn(preferred_api="chat")
+            return text
+        metrics.branch("chat:empty")
 
+        # 最後の手段: Responses API での再試行
+        text_r2 = self._call_responses_api(messages)
+        if text_r2 and text_r2.strip():
+            self._learn(preferred_api="responses")
+            return text_r2
+
+        return ""
+
+    def _stream_responses_api(self, messages: List[Dict[str, str]]) -> Iterator[str]:
+        with_max = bool(self._learned().get("responses_max_output_tokens", True))
         try:
-            resp = _call(use_completion_param=False, include_temperature=default_include_temp, include_response_format=True)
+            events = self._send(self.client.responses.create, {**self._responses_params(messages, with_max), "stream": True})
         except Exception as e:
-            msg = str(e)
-            # max_tokens が非対応 → max_completion_tokens に切替
-            if "max_tokens" in msg and "max_completion_tokens" in msg:
-                try:
-                    resp = _call(use_completion_param=True, include_temperature=True, include_response_format=True)
-                except Exception as e2:
-                    msg2 = str(e2)
-                    # temperature が非対応 → temperature を省略
-                    if "temperature" in msg2 and ("unsupported" in msg2 or "Only the default" in msg2):
-                        resp = _call(use_completion_param=True, include_temperature=False, include_response_format=True)
-                    # response_format が非対応 → 省略
-                    elif "response_format" in msg2 and ("unsupported" in msg2 or "Invalid" in msg2 or "Unknown" in msg2):
-                        resp = _call(use_completion_param=True, include_temperature=True, include_response_format=False)
-                    else:
-                        raise
-            # temperature が非対応（max_tokensは許容）
-            elif "temperature" in msg and ("unsupported" in msg or "Only the default" in msg):
-                # omit temperature with original max_tokens param
-                try:
-                    resp = _call(use_completion_param=False, include_temperature=False, include_response_format=True)
-                except Exception as e3:
-                    # さらに max_tokens も非対応だった場合の合わせ技
-                    msg3 = str(e3)
-                    if "max_tokens" in msg3 and "max_completion_tokens" in msg3:
-                        resp = _call(use_completion_param=True, include_temperature=False, include_response_format=True)
-                    elif "response_format" in msg3 and ("unsupported" in msg3 or "Invalid" in msg3 or "Unknown" in msg3):
-                        resp = _call(use_completion_param=False, include_temperature=False, include_response_format=False)
-                    else:
-                        raise
-            # response_format が非対応（max_tokens/temperatureは許容）
-            elif "response_format" in msg and ("unsupported" in msg or "Invalid" in msg or "Unknown" in msg):
-                try:
-                    resp = _call(use_completion_param=False, include_temperature=True, include_response_format=False)
-                except Exception as e4:
-                    msg4 = str(e4)
-                    if "max_tokens" in msg4 and "max_completion_tokens" in msg4:
-                        resp = _call(use_completion_param=True, include_temperature=True, include_response_format=False)
-                    elif "temperature" in msg4 and ("unsupported" in msg4 or "Only the default" in msg4):
-                        resp = _call(use_completion_param=False, include_temperature=False, include_response_format=False)
-                    else:
-                        raise
-            else:
+            if not with_max or not _max_output_tokens_rejected(str(e)):
                 raise
+            metrics.branch("param:-max_output_tokens")
+            events = self._send(self.client.responses.create, {**self._responses_params(messages, False), "stream": True})
+            with_max = False
+        self._learn(responses_max_output_tokens=with_max)
+        metrics.note(api="responses")
+        for event in events:
+            etype = getattr(event, "type", "")
+            if etype == "response.output_text.delta":
+                delta = getattr(event, "delta", "")
+                if delta:
+                    yield str(delta)
+            elif etype == "response.completed":
+                metrics.note_usage(getattr(getattr(event, "response", None), "usage", None))
+
+    def stream(self, messages: List[Dict[str, str]]) -> Iterator[str]:
+        """generate のストリーミング版。本文の差分を到着順に yield する。
+
+        API の選択と空出力時の切替は generate と同じです（先の API が何も返さなければ次を試す）。
+        """
+        _ensure_messages(messages)
 
-        text = _extract_text_from_chat(resp)
+        if self._prefer_responses():
+            got = False
+            for delta in self._stream_responses_api(messages):
+                got = True
+                yield delta
+            if got:
+                self._learn(preferred_api="responses")
+                return
+            metrics.branch("responses:empty")
+
+        got = False
+        for delta in self._stream_chat(messages):
+            got = True
+            yield delta
+        if got:
+            self._learn(preferred_api="chat")
+            return
+        metrics.branch("chat:empty")
+
+        for delta in self._stream_responses_api(messages):
+            got = True
+            yield delta
+        if got:
+            self._learn(preferred_api="responses")
+
+    async def agenerate(self, messages: List[Dict[str, str]]) -> str:
+        """generate の非同期版（AsyncOpenAI を使用。フォールバック手順は同一）。"""
+        _ensure_messages(messages)
+
+        if self._prefer_responses():
+            text_r = await self._acall_responses_api(messages)
+            if text_r and text_r.strip():
+                self._learn(preferred_api="responses")
+                return text_r
+            metrics.branch("responses:empty")
+
+        text = _extract_text_from_chat(await self._acreate_chat(messages))
         if text and text.strip():
+            self._learn(preferred_api="chat")
             return text
+        metrics.branch("chat:empty")
 
-        # 最後の手段: Responses API での再試行
-        text_r2 = _call_responses_api(messages)
+        text_r2 = await self._acall_responses_api(messages)
         if text_r2 and text_r2.strip():
+            self._learn(preferred_api="responses")
             return text_r2
 
         return ""
 
 
-class AzureOpenAIProvider:
-    def __init__(self, settings: AppSettings):
-        from openai import AzureOpenAI  # lazy import
+class AzureOpenAIProvider(_ChatCompletionsMixin):
+    # Azure のバッチはデプロイ名を model に指定し、エンドポイントに /v1 を付けない
+    _batch_endpoint = "/chat/completions"
 
+    def __init__(self, settings: AppSettings):
         if not settings.azure_openai_api_key or not settings.azure_openai_endpoint:
             raise RuntimeError(
                 "Azure OpenAI の資格情報が不足しています。AZURE_OPENAI_API_KEY と AZURE_OPENAI_ENDPOINT を設定してください。"
             )
 
-        self.client = AzureOpenAI(
-            api_key=settings.azure_openai_api_key,
-            api_version=settings.azure_openai_api_version,
-            azure_endpoint=settings.azure_openai_endpoint,
-        )
         self.settings = settings
+        self.client = get_client(
+            "azure",
+            settings.azure_openai_api_key,
+            settings.azure_openai_endpoint,
+            settings.azure_openai_api_version,
+            settings,
+        )
+        self._aclient = None
+
+    def _make_async_client(self) -> Any:
+        return get_async_client(
+            "azure",
+            self.settings.azure_openai_api_key,
+            self.settings.azure_openai_endpoint,
+            self.settings.azure_openai_api_version,
+            self.settings,
+        )
+
+    def _capability_key(self) -> str:
+        return capability_key("azure", self.settings.azure_openai_endpoint, self.settings.model)
 
     def generate(self, messages: List[Dict[str, str]]) -> str:
         _ensure_messages(messages)
+        resp = self._create_chat(messages)
+        return resp.choices[0].message.content or ""
 
-        def _call(use_completion_param: bool, include_temperature: bool, include_response_format: bool):
-            params: Dict[str, Any] = {
-                "model": self.settings.model,
-                "messages": messages,
-            }
-            if include_temperature:
-                params["temperature"] = self.settings.temperature
-            if include_response_format:
-                params["response_format"] = {"type": "text"}
-            if use_completion_param:
-                params["max_completion_tokens"] = self.settings.max_tokens
-            else:
-                params["max_tokens"] = self.settings.max_tokens
-            return self.client.chat.completions.create(**params)
-
-        model_l = (self.settings.model or "").lower()
-        default_include_temp = not (model_l.startswith("gpt-5") or "gpt-5" in model_l)
-
-        try:
-            resp = _call(use_completion_param=False, include_temperature=default_include_temp, include_response_format=True)
-        except Exception as e:
-            msg = str(e)
-            if "max_tokens" in msg and "max_completion_tokens" in msg:
-                try:
-                    resp = _call(use_completion_param=True, include_temperature=True, include_response_format=True)
-                except Exception as e2:
-                    msg2 = str(e2)
-                    if "temperature" in msg2 and ("unsupported" in msg2 or "Only the default" in msg2):
-                        resp = _call(use_completion_param=True, include_temperature=False, include_response_format=True)
-                    elif "response_format" in msg2 and ("unsupported" in msg2 or "Invalid" in msg2 or "Unknown" in msg2):
-                        resp = _call(use_completion_param=True, include_temperature=True, include_response_format=False)
-                    else:
-                        raise
-            elif "temperature" in msg and ("unsupported" in msg or "Only the default" in msg):
-                try:
-                    resp = _call(use_completion_param=False, include_temperature=False, include_response_format=True)
-                except Exception as e3:
-                    msg3 = str(e3)
-                    if "max_tokens" in msg3 and "max_completion_tokens" in msg3:
-                        resp = _call(use_completion_param=True, include_temperature=False, include_response_format=True)
-                    elif "response_format" in msg3 and ("unsupported" in msg3 or "Invalid" in msg3 or "Unknown" in msg3):
-                        resp = _call(use_completion_param=False, include_temperature=False, include_response_format=False)
-                    else:
-                        raise
-            elif "response_format" in msg and ("unsupported" in msg or "Invalid" in msg or "Unknown" in msg):
-                try:
-                    resp = _call(use_completion_param=False, include_temperature=True, include_response_format=False)
-                except Exception as e4:
-                    msg4 = str(e4)
-                    if "max_tokens" in msg4 and "max_completion_tokens" in msg4:
-                        resp = _call(use_completion_param=True, include_temperature=True, include_response_format=False)
-                    elif "temperature" in msg4 and ("unsupported" in msg4 or "Only the default" in msg4):
-                        resp = _call(use_completion_param=False, include_temperature=False, include_response_format=False)
-                    else:
-                        raise
-            else:
-                raise
-
+    async def agenerate(self, messages: List[Dict[str, str]]) -> str:
+        """generate の非同期版（AsyncAzureOpenAI を使用）。"""
+        _ensure_messages(messages)
+        resp = await self._acreate_chat(messages)
         return resp.choices[0].message.content or ""
 
+    def stream(self, messages: List[Dict[str, str]]) -> Iterator[str]:
+        """generate のストリーミング版（Chat Completions の stream=True）。"""
+        _ensure_messages(messages)
+        yield from self._stream_chat(messages)
 
-def get_provider(settings: AppSettings):
+
+def build_backend(settings: AppSettings):
+    """設定に応じた API バックエンド（キャッシュ・計測・フェイルオーバーのラッパなし）。"""
     kind = settings.provider_kind()
     if kind == "stub":
         return StubProvider(settings)
     if kind == "azure":
         return AzureOpenAIProvider(settings)
     return OpenAIProvider(settings)
+
+
+def wrap_provider(provider: Any, settings: AppSettings):
+    """設定に応じてキャッシュ・計測のラッパを重ねる。"""
+    if settings.cache_enabled:
+        provider = CachedProvider(provider, get_cache(settings), settings)
+    if settings.metrics_enabled:
+        # キャッシュの外側で計測し、ヒット/ミスも記録する
+        provider = metrics.InstrumentedProvider(provider, settings)
+    return provider
+
+
+def get_provider(settings: AppSettings):
+    provider = build_backend(settings)
+    secondary = secondary_settings(settings)
+    if secondary is not None:
+        # 予備バックエンドへのフェイルオーバー・ヘッジ（キャッシュ・計測はその外側で1回分として扱う）
+        provider = RoutingProvider(provider, build_backend(secondary), settings, secondary)
+    return wrap_provider(provider, settings)
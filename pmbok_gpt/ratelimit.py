@@ -0,0 +1,309 @@
+from __future__ import annotations
+
+import asyncio
+import random
+import threading
+import time
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Tuple, TypeVar
+
+from . import metrics
+from .config import AppSettings
+from .context import estimate_tokens
+
+T = TypeVar("T")
+
+# 再送する HTTP ステータス（レート制限・一時的なサーバエラー）
+RETRYABLE_STATUS = frozenset({408, 409, 429, 500, 502, 503, 504})
+# 接続系の例外（openai を import せずにクラス名で判定する）
+_CONNECTION_ERRORS = frozenset({"APIConnectionError", "APITimeoutError", "ConnectError", "ReadTimeout", "RemoteProtocolError"})
+
+
+def estimate_request_tokens(params: Dict[str, Any], max_tokens: int) -> int:
+    """送信パラメータから TPM 消費量を見積もる（入力 + 出力上限。API 側の計上方法に合わせる）。"""
+    messages = params.get("messages")
+    if messages:
+        text = "".join(str(m.get("content", "")) for m in messages)
+    else:
+        text = str(params.get("input", ""))
+    return estimate_tokens(text) + max(0, int(max_tokens))
+
+
+def _status(error: BaseException) -> Optional[int]:
+    status = getattr(error, "status_code", None)
+    if status is None:
+        status = getattr(getattr(error, "response", None), "status_code", None)
+    return status if isinstance(status, int) else None
+
+
+def retry_reason(error: BaseException) -> Optional[str]:
+    """再送すべきエラーなら理由（"429" / "503" / "connection"）、そうでなければ None。"""
+    status = _status(error)
+    if status is not None:
+        return str(status) if status in RETRYABLE_STATUS else None
+    if any(c.__name__ in _CONNECTION_ERRORS for c in type(error).__mro__):
+        return "connection"
+    return None
+
+
+def retry_after(error: BaseException) -> Optional[float]:
+    """エラー応答の retry-after-ms / retry-after ヘッダ（秒）。なければ None。"""
+    headers = getattr(getattr(error, "response", None), "headers", None)
+    if headers is not None:
+        for name, scale in (("retry-after-ms", 0.001), ("retry-after", 1.0)):
+            value = headers.get(name)
+            if value is None:
+                continue
+            try:
+                return max(0.0, float(value) * scale)
+            except ValueError:
+                # HTTP-date 形式は扱わない（バックオフに任せる）
+                continue
+    value = getattr(error, "retry_after", None)
+    return float(value) if isinstance(value, (int, float)) else None
+
+
+class TokenBucket:
+    """1分あたり rate_per_minute のトークンバケット（予約方式）。
+
+    reserve() は残量を先に差し引き、足りない分が貯まるまでの待ち秒数を返します。
+    残量がマイナスになるのを許すため、容量を超える要求も順番に捌けます。rate 0 は無制限。
+    """
+
+    def __init__(self, rate_per_minute: float, *, burst_seconds: float = 6.0):
+        self.rate = rate_per_minute / 60.0
+        self.capacity = max(1.0, self.rate * burst_seconds)
+        self._available = self.capacity
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def reserve(self, amount: float = 1.0) -> float:
+        if self.rate <= 0:
+            return 0.0
+        with self._lock:
+            now = time.monotonic()
+            self._available = min(self.capacity, self._available + (now - self._updated) * self.rate)
+            self._updated = now
+            self._available -= amount
+            return max(0.0, -self._available / self.rate)
+
+
+def _wake(fut: "asyncio.Future[None]") -> None:
+    if not fut.done():
+        fut.set_result(None)
+
+
+class RequestScheduler:
+    """エンドポイント/モデル単位で共有する呼び出しスケジューラ。
+
+    - RPM / TPM のトークンバケットで送信ペースを制御
+    - 同時実行数は AIMD で調整（429 で半減、成功ごとに 1/limit ずつ回復）
+    - 429 / 5xx / 接続エラーは Retry-After を優先し、ジッタ付き指数バックオフで再送
+    - 429 を受けたら Retry-After の間は全呼び出しの送信を止める（エラーの連鎖を防ぐ）
+    ストリーミングでは応答ヘッダを受け取った時点でスロットを返します。
+    """
+
+    def __init__(
+        self,
+        *,
+        rpm: int = 0,
+        tpm: int = 0,
+        max_concurrency: int = 16,
+        max_attempts: int = 6,
+        base_delay: float = 0.5,
+        max_delay: float = 30.0,
+    ):
+        self.rpm = TokenBucket(rpm)
+        self.tpm = TokenBucket(tpm)
+        self.max_concurrency = max(1, max_concurrency)
+        self.max_attempts = max(1, max_attempts)
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.limit = float(self.max_concurrency)
+        self.in_flight = 0
+        self.paused_until = 0.0
+        self._last_decrease = 0.0
+        self._cond = threading.Condition()
+        # スロットの空きを待つ非同期の呼び出し（複数のイベントループから共有されるため、ループごとの Future で起こす）
+        self._async_waiters: List[Tuple[asyncio.AbstractEventLoop, "asyncio.Future[None]"]] = []
+        self._rng = random.Random()
+        self.stats: Dict[str, float] = {"requests": 0, "retries": 0, "throttled": 0, "waited": 0.0}
+
+    # --- 同時実行数（AIMD） ---
+
+    def _try_enter(self) -> bool:
+        with self._cond:
+            if self.in_flight < int(self.limit):
+                self.in_flight += 1
+                return True
+            return False
+
+    def _notify_locked(self) -> None:
+        self._cond.notify_all()
+        waiters, self._async_waiters = self._async_waiters, []
+        for loop, fut in waiters:
+            try:
+                loop.call_soon_threadsafe(_wake, fut)
+            except RuntimeError:
+                pass  # ループが閉じている
+
+    async def _wait_slot(self) -> None:
+        """スロットが空く（_leave / 上限の回復）まで待つ。空きがあればすぐ返る。"""
+        loop = asyncio.get_running_loop()
+        fut: "asyncio.Future[None]" = loop.create_future()
+        with self._cond:
+            if self.in_flight < int(self.limit):
+                return
+            self._async_waiters.append((loop, fut))
+        try:
+            await fut
+        finally:
+            with self._cond:
+                if (loop, fut) in self._async_waiters:
+                    self._async_waiters.remove((loop, fut))
+
+    def _leave(self) -> None:
+        with self._cond:
+            self.in_flight -= 1
+            self._notify_locked()
+
+    def _on_success(self) -> None:
+        with self._cond:
+            self.limit = min(float(self.max_concurrency), self.limit + 1.0 / self.limit)
+            self.stats["requests"] += 1
+            self._notify_locked()
+
+    def _on_retry(self, reason: str, delay: float) -> None:
+        now = time.monotonic()
+        with self._cond:
+            self.stats["retries"] += 1
+            if reason == "429":
+                self.stats["throttled"] += 1
+                self.paused_until = max(self.paused_until, now + delay)
+                # 同時に届いた 429 で何度も半減しないよう、1回の減少のあとは少し待つ
+                if now - self._last_decrease > max(self.base_delay, delay):
+                    self.limit = max(1.0, self.limit / 2.0)
+                    self._last_decrease = now
+        metrics.branch(f"retry:{reason}")
+
+    def _backoff(self, attempt: int, error: BaseException) -> float:
+        hinted = retry_after(error)
+        with self._cond:
+            jittered = self._rng.uniform(0, min(self.max_delay, self.base_delay * (2 ** attempt)))
+        return min(self.max_delay, max(hinted or 0.0, jittered))
+
+    def _admission_wait(self, tokens: int) -> float:
+        wait = max(self.rpm.reserve(1), self.tpm.reserve(tokens))
+        return max(wait, self.paused_until - time.monotonic())
+
+    # --- 呼び出し ---
+
+    def call(self, fn: Callable[[], T], *, tokens: int = 0) -> T:
+        """fn() をレート制御・再送付きで実行する。"""
+        attempt = 0
+        while True:
+            started = time.monotonic()
+            wait = self._admission_wait(tokens)
+            if wait > 0:
+                time.sleep(wait)
+            with self._cond:
+                while self.in_flight >= int(self.limit):
+                    self._cond.wait(timeout=0.5)
+                self.in_flight += 1
+            self._add_wait(time.monotonic() - started)
+            try:
+                # KeyboardInterrupt 等でもスロットは必ず返す（返さないと以降の呼び出しが永久に待つ）
+                try:
+                    result = fn()
+                finally:
+                    self._leave()
+            except Exception as e:
+                reason = retry_reason(e)
+                attempt += 1
+                if reason is None or attempt >= self.max_attempts:
+                    raise
+                delay = self._backoff(attempt, e)
+                self._on_retry(reason, delay)
+                time.sleep(delay)
+                continue
+            self._on_success()
+            return result
+
+    async def acall(self, fn: Callable[[], Awaitable[T]], *, tokens: int = 0) -> T:
+        """call の非同期版。待機はイベントループ上で行い、スロットの空きは通知を待つ。"""
+        attempt = 0
+        while True:
+            started = time.monotonic()
+            wait = self._admission_wait(tokens)
+            if wait > 0:
+                await asyncio.sleep(wait)
+            while not self._try_enter():
+                await self._wait_slot()
+            self._add_wait(time.monotonic() - started)
+            try:
+                # キャンセル（CancelledError は BaseException）でもスロットは必ず返す
+                try:
+                    result = await fn()
+                finally:
+                    self._leave()
+            except Exception as e:
+                reason = retry_reason(e)
+                attempt += 1
+                if reason is None or attempt >= self.max_attempts:
+                    raise
+                delay = self._backoff(attempt, e)
+                self._on_retry(reason, delay)
+                await asyncio.sleep(delay)
+                continue
+            self._on_success()
+            return result
+
+    def _add_wait(self, waited: float) -> None:
+        with self._cond:
+            self.stats["waited"] += waited
+        if waited > 0.001:
+            metrics.add_queue_wait(waited)
+
+    def snapshot(self) -> Dict[str, Any]:
+        with self._cond:
+            return {
+                **self.stats,
+                "waited": round(self.stats["waited"], 3),
+                "limit": round(self.limit, 2),
+                "in_flight": self.in_flight,
+            }
+
+
+_schedulers: Dict[Tuple[Any, ...], RequestScheduler] = {}
+_schedulers_lock = threading.Lock()
+
+
+def get_scheduler(settings: AppSettings, key: str) -> RequestScheduler:
+    """provider/エンドポイント/モデル（key）ごとに共有のスケジューラを返す。"""
+    rkey = (
+        key,
+        settings.rate_limit_rpm,
+        settings.rate_limit_tpm,
+        settings.max_concurrency,
+        settings.retry_max_attempts,
+        settings.retry_base_delay,
+        settings.retry_max_delay,
+    )
+    with _schedulers_lock:
+        scheduler = _schedulers.get(rkey)
+        if scheduler is None:
+            scheduler = RequestScheduler(
+                rpm=settings.rate_limit_rpm,
+                tpm=settings.rate_limit_tpm,
+                max_concurrency=settings.max_concurrency,
+                max_attempts=settings.retry_max_attempts,
+                base_delay=settings.retry_base_delay,
+                max_delay=settings.retry_max_delay,
+            )
+            _schedulers[rkey] = scheduler
+        return scheduler
+
+
+def scheduler_stats() -> Dict[str, Dict[str, Any]]:
+    with _schedulers_lock:
+        items = [(k[0], s) for k, s in _schedulers.items()]
+    return {k: s.snapshot() for k, s in items}
@@ -0,0 +1,236 @@
+from __future__ import annotations
+
+import json
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, field
+from typing import Any, Dict, Iterator, List, Optional, Sequence, Tuple
+
+from . import metrics
+from .config import AppSettings, max_tokens_limit
+from .excel import create_risk_register_excel
+from .generator import SYSTEM_PROMPT, project_preamble, prepare_context
+from .providers import build_backend
+
+# 1回の呼び出しで展開するリスクの件数と、1件あたりに見込む出力トークン数
+DEFAULT_CHUNK_SIZE = 20
+_TOKENS_PER_RISK = 160
+
+# 登録簿の列（excel.RISK_KEYS）のうち、LLM に埋めさせる項目
+RISK_FIELDS: List[str] = ["event", "category", "cause", "impact", "probability", "strategy", "response", "owner", "trigger"]
+_SCALE = (1, 5)
+
+RISK_SCHEMA: Dict[str, Any] = {
+    "type": "object",
+    "properties": {
+        "risks": {
+            "type": "array",
+            "items": {
+                "type": "object",
+                "properties": {
+                    "seed": {"type": "integer"},
+                    **{k: {"type": "integer"} if k in ("impact", "probability") else {"type": "string"} for k in RISK_FIELDS},
+                },
+                "required": ["seed", *RISK_FIELDS],
+                "additionalProperties": False,
+            },
+        }
+    },
+    "required": ["risks"],
+    "additionalProperties": False,
+}
+
+
+@dataclass
+class RiskExpansionReport:
+    """リスク展開の集計（expand_risks が逐次更新する）。"""
+
+    seeds: int = 0
+    calls: int = 0
+    rows: int = 0
+    # 展開できず、シードの文言だけで書き出した行
+    fallback_rows: int = 0
+    errors: List[str] = field(default_factory=list)
+    wall_clock: float = 0.0
+
+
+def build_risk_messages(
+    language: str,
+    project_context: Dict[str, Any],
+    seeds: Sequence[Tuple[int, str]],
+) -> List[Dict[str, str]]:
+    """シード（番号, 文言）の一覧をまとめて展開するメッセージ。前置きは build_messages と共通。"""
+    instruction = (
+        "上記のプロジェクト情報をもとに、以下のリスクの種（seeds）をそれぞれリスク登録簿の1行に展開し、JSONで返してください。\n"
+        '形式: {"risks": [{"seed": 種の番号, "event": リスク事象, "category": カテゴリ, "cause": 原因, '
+        '"impact": 影響(1-5の整数), "probability": 発生確率(1-5の整数), "strategy": 対応戦略（回避/転嫁/軽減/受容/エスカレーション 等）, '
+        '"response": 対応計画の要旨, "owner": オーナー（役割）, "trigger": トリガー}]}\n'
+        "種ごとに1件ずつ、同じ順で返してください。厳禁: 機密情報の推測、虚偽の数値\n"
+        + json.dumps({"seeds": [{"seed": n, "text": text} for n, text in seeds]}, ensure_ascii=False)
+    )
+    return [
+        {"role": "system", "content": SYSTEM_PROMPT},
+        {"role": "user", "content": project_preamble(language, project_context)},
+        {"role": "user", "content": instruction},
+    ]
+
+
+def _scale(value: Any) -> Optional[int]:
+    try:
+        number = int(round(float(value)))
+    except (TypeError, ValueError):
+        return None
+    return min(max(number, _SCALE[0]), _SCALE[1])
+
+
+def parse_risk_rows(text: str, seeds: Sequence[Tuple[int, str]]) -> Tuple[List[Dict[str, Any]], List[int]]:
+    """応答の JSON を検証して登録簿の行にする。返り値は (シード順の行, 展開できなかったシード番号)。
+
+    JSON として読めない場合は ValueError。列にない項目は捨て、影響・発生確率は 1-5 の整数に丸めます。
+    """
+    data = json.loads(text)
+    items = data.get("risks") if isinstance(data, dict) else data
+    if not isinstance(items, list):
+        raise ValueError("risks の配列がありません")
+    by_seed: Dict[int, Dict[str, Any]] = {}
+    wanted = {n for n, _ in seeds}
+    for item in items:
+        if not isinstance(item, dict):
+            continue
+        seed = item.get("seed")
+        if isinstance(seed, str) and seed.isdigit():
+            seed = int(seed)
+        if seed not in wanted or seed in by_seed:
+            continue
+        row = {k: item.get(k) for k in RISK_FIELDS}
+        row["impact"], row["probability"] = _scale(row["impact"]), _scale(row["probability"])
+        row = {k: (str(v).strip() if isinstance(v, str) else v) for k, v in row.items() if v not in (None, "")}
+        by_seed[seed] = row
+    rows: List[Dict[str, Any]] = []
+    missing: List[int] = []
+    for n, text_ in seeds:
+        row = by_seed.get(n)
+        if row is None:
+            missing.append(n)
+            rows.extend(_unexpanded([(n, text_)]))
+            continue
+        row.setdefault("event", text_)
+        row["seed"], row["status"] = text_, "評価済み"
+        rows.append(row)
+    return rows, missing
+
+
+def _unexpanded(seeds: Sequence[Tuple[int, str]]) -> List[Dict[str, Any]]:
+    # 展開できなかった種はシードの文言だけを残す（excel.risk_rows_from_project と同じ形）
+    return [{"event": text, "seed": text, "status": "未評価"} for _, text in seeds]
+
+
+def _stub_rows(seeds: Sequence[Tuple[int, str]]) -> List[Dict[str, Any]]:
+    # API なし（スタブ設定）のときの行。列の埋まり方を確認するためのダミー
+    return [
+        {
+            "event": text, "seed": text, "category": "(スタブ)", "cause": f"(スタブ) {text} の原因", "impact": 3, "probability": 3,
+            "strategy": "軽減", "response": f"(スタブ) {text} への対応", "owner": "PM", "trigger": "(スタブ) 兆候", "status": "評価済み",
+        }
+        for _, text in seeds
+    ]
+
+
+def expand_risks(
+    project_context: Dict[str, Any],
+    *,
+    seeds: Optional[Sequence[str]] = None,
+    language: Optional[str] = None,
+    settings: Optional[AppSettings] = None,
+    chunk_size: int = DEFAULT_CHUNK_SIZE,
+    max_workers: int = 4,
+    provider: Any = None,
+    report: Optional[RiskExpansionReport] = None,
+) -> Iterator[Dict[str, Any]]:
+    """リスクの種（未指定はプロジェクトJSONの risk_seeds）を chunk_size 件ずつまとめて登録簿の行に展開する。
+
+    複数のチャンクを並行に呼び出し、行はシード順に逐次返します（create_risk_register_excel にそのまま渡せます）。
+    JSON が壊れていたチャンクは半分に分けて呼び直し、それでも展開できない種はシードの文言だけの行にします。
+    """
+    settings = settings or AppSettings()
+    language = language or settings.default_language
+    report = report if report is not None else RiskExpansionReport()
+    source = seeds if seeds is not None else project_context.get("risk_seeds") or []
+    # risk_seeds には文言のほか、リスク項目の dict も書ける（excel.risk_rows_from_project と同じ）
+    texts = [str(s.get("event") or json.dumps(s, ensure_ascii=False)) if isinstance(s, dict) else str(s) for s in source]
+    numbered = list(enumerate(texts, start=1))
+    report.seeds = len(numbered)
+    chunk_size = max(1, chunk_size)
+    chunks = [numbered[i:i + chunk_size] for i in range(0, len(numbered), chunk_size)]
+    call_settings = settings.model_copy(update={"max_tokens": max(settings.max_tokens, _TOKENS_PER_RISK * chunk_size)})
+    context, tags = prepare_context(language, "risk_management_plan", project_context, None, call_settings)
+    if provider is None and chunks:
+        provider = build_backend(call_settings)
+
+    lock = threading.Lock()
+
+    def _call(chunk: Sequence[Tuple[int, str]]) -> List[Dict[str, Any]]:
+        if not hasattr(provider, "generate_json"):
+            return _stub_rows(chunk)
+        messages = build_risk_messages(language, context, chunk)
+        with lock:
+            report.calls += 1
+        error: Optional[Exception] = None
+        with metrics.recording(call_settings, "json", doc_type="risk_register", **tags) as rec:
+            started = time.perf_counter()
+            try:
+                # provider を渡された場合も、チャンクの件数に見合う出力上限で呼ぶ
+                with max_tokens_limit(call_settings.max_tokens):
+                    text = provider.generate_json(messages, RISK_SCHEMA, name="risk_register")
+                rows, missing = parse_risk_rows(text, chunk)
+                if missing:
+                    metrics.branch(f"json:missing:{len(missing)}")
+            except Exception as e:
+                error = e
+                if rec is not None:
+                    rec.ok, rec.error = False, f"{type(e).__name__}: {e}"[:500]
+                if len(chunk) > 1:
+                    metrics.branch("json:split")
+            if rec is not None:
+                rec.latency = round(time.perf_counter() - started, 4)
+        if error is None:
+            return rows
+        if len(chunk) > 1:
+            # 出力が長すぎて途切れた等。半分ずつ呼び直す
+            half = len(chunk) // 2
+            return [*_call(chunk[:half]), *_call(chunk[half:])]
+        with lock:
+            report.errors.append(f"{chunk[0][1]}: {error}")
+        return _unexpanded(chunk)
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=max(1, max_workers)) as ex:
+        # map は完了順ではなくシード順に結果を返す（先頭のチャンクが返り次第、書き出しを始められる）
+        for rows in ex.map(_call, chunks):
+            for row in rows:
+                report.rows += 1
+                if row.get("status") == "未評価":
+                    report.fallback_rows += 1
+                yield row
+    report.wall_clock = time.perf_counter() - start
+
+
+def write_risk_register(
+    project_context: Dict[str, Any],
+    out_path: str,
+    *,
+    language: Optional[str] = None,
+    settings: Optional[AppSettings] = None,
+    chunk_size: int = DEFAULT_CHUNK_SIZE,
+    max_workers: int = 4,
+    provider: Any = None,
+) -> RiskExpansionReport:
+    """risk_seeds を展開したリスク登録簿を書き出す（展開した行はそのままワークブックへ逐次書き込む）。"""
+    report = RiskExpansionReport()
+    rows = expand_risks(
+        project_context, language=language, settings=settings, chunk_size=chunk_size,
+        max_workers=max_workers, provider=provider, report=report,
+    )
+    create_risk_register_excel(out_path, rows)
+    return report
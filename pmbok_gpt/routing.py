@@ -0,0 +1,224 @@
+from __future__ import annotations
+
+import asyncio
+import contextvars
+import threading
+import time
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from typing import Any, Deque, Dict, Iterator, List, NamedTuple, Optional
+
+from . import metrics
+from .config import AppSettings
+
+# ヘッジ待ち時間の算出に使う、主バックエンドの直近の応答時間の件数
+_WINDOW = 200
+
+_latencies: Dict[str, Deque[float]] = {}
+_latencies_lock = threading.Lock()
+
+
+def secondary_settings(settings: AppSettings) -> Optional[AppSettings]:
+    """予備バックエンドの設定（secondary_provider / secondary_model が未設定、またはスタブ運用なら None）。"""
+    if settings.use_stub or not (settings.secondary_provider or settings.secondary_model):
+        return None
+    kind = settings.secondary_provider or settings.provider_kind()
+    update: Dict[str, Any] = {"model": settings.secondary_model or settings.model}
+    if kind == "openai":
+        # Azure の資格情報があると provider_kind が azure になるため外す
+        update.update(azure_openai_api_key=None, azure_openai_endpoint=None)
+    elif kind == "azure":
+        if not (settings.azure_openai_api_key and settings.azure_openai_endpoint):
+            raise ValueError("secondary_provider=azure には AZURE_OPENAI_API_KEY と AZURE_OPENAI_ENDPOINT が必要です")
+    else:
+        raise ValueError(f"Unknown secondary_provider: {kind}（openai | azure）")
+    return settings.model_copy(update=update)
+
+
+def route_key(settings: AppSettings) -> str:
+    endpoint = settings.azure_openai_endpoint if settings.provider_kind() == "azure" else settings.openai_base_url
+    return f"{settings.provider_kind()}|{(endpoint or '').rstrip('/')}|{settings.model}"
+
+
+def observe_latency(key: str, seconds: float) -> None:
+    with _latencies_lock:
+        _latencies.setdefault(key, deque(maxlen=_WINDOW)).append(seconds)
+
+
+def observed_percentile(key: str, pct: float, min_samples: int) -> Optional[float]:
+    """key の直近の応答時間のパーセンタイル（min_samples 件に満たなければ None）。"""
+    with _latencies_lock:
+        data = list(_latencies.get(key, ()))
+    if len(data) < max(1, min_samples):
+        return None
+    return metrics.percentile(data, pct)
+
+
+class _Outcome(NamedTuple):
+    backend: str  # primary | secondary
+    text: Optional[str]
+    error: Optional[BaseException]
+    record: metrics.CallRecord
+
+    @property
+    def ok(self) -> bool:
+        return self.error is None and bool(self.text and self.text.strip())
+
+    @property
+    def reason(self) -> str:
+        return "error" if self.error is not None else "empty"
+
+
+class RoutingProvider:
+    """主バックエンドが遅い・失敗した・空を返した場合に、予備バックエンドへ回すプロバイダ。
+
+    - フェイルオーバー: 主がエラーまたは空出力なら予備で生成し直す（両方だめなら空を返し、
+      generator 側のスタブへのフォールバックに任せる。両方エラーなら主のエラーを送出）
+    - ヘッジ（hedge_enabled）: 主がヘッジ待ち時間を過ぎても返らなければ予備にも送り、先に本文を
+      返した方を使って他方を取り消す。待ち時間は p95 程度にするため、追加の呼び出しは全体の数%に収まります
+    同期版の取り消しは結果を捨てるだけで、送信済みの HTTP 呼び出しは応答まで続きます（非同期版は接続ごと中断）。
+    """
+
+    def __init__(self, primary: Any, secondary: Any, settings: AppSettings, secondary_settings: AppSettings):
+        self.primary = primary
+        self.secondary = secondary
+        self.settings = settings
+        self.secondary_settings = secondary_settings
+        self._key = route_key(settings)
+
+    def hedge_delay(self) -> Optional[float]:
+        """予備にも送るまでの秒数（ヘッジしない場合は None）。"""
+        if not self.settings.hedge_enabled:
+            return None
+        if self.settings.hedge_delay > 0:
+            return self.settings.hedge_delay
+        return observed_percentile(self._key, self.settings.hedge_percentile, self.settings.hedge_min_samples)
+
+    def _backend(self, name: str) -> Any:
+        return self.primary if name == "primary" else self.secondary
+
+    def _finish(self, name: str, started: float, text: Optional[str], error: Optional[BaseException], rec: metrics.CallRecord) -> _Outcome:
+        if name == "primary" and error is None:
+            observe_latency(self._key, time.perf_counter() - started)
+        return _Outcome(name, text, error, rec)
+
+    def _attempt(self, name: str, messages: List[Dict[str, str]]) -> _Outcome:
+        started = time.perf_counter()
+        text: Optional[str] = None
+        error: Optional[BaseException] = None
+        with metrics.detached() as rec:
+            try:
+                text = self._backend(name).generate(messages)
+            except Exception as e:
+                error = e
+        return self._finish(name, started, text, error, rec)
+
+    async def _aattempt(self, name: str, messages: List[Dict[str, str]]) -> _Outcome:
+        started = time.perf_counter()
+        text: Optional[str] = None
+        error: Optional[BaseException] = None
+        with metrics.detached() as rec:
+            try:
+                text = await self._backend(name).agenerate(messages)
+            except Exception as e:
+                error = e
+        return self._finish(name, started, text, error, rec)
+
+    def _adopt(self, winner: _Outcome, failed: List[_Outcome]) -> str:
+        for out in failed:
+            metrics.merge(out.record, usage=False)
+        metrics.merge(winner.record)
+        if winner.backend == "secondary":
+            metrics.branch("route:secondary")
+            metrics.note(provider=self.secondary_settings.provider_kind(), model=self.secondary_settings.model)
+        return winner.text or ""
+
+    def _give_up(self, failed: List[_Outcome]) -> str:
+        for out in failed:
+            metrics.merge(out.record, usage=False)
+        errors = [out.error for out in failed if out.error is not None]
+        if len(errors) == len(failed) and errors:
+            raise errors[0]
+        # どちらかは空の本文を返した（スタブへのフォールバックは呼び出し側で行う）
+        return ""
+
+    def generate(self, messages: List[Dict[str, str]]) -> str:
+        delay = self.hedge_delay()
+        if delay is None:
+            first = self._attempt("primary", messages)
+            if first.ok:
+                return self._adopt(first, [])
+            metrics.branch(f"route:failover:{first.reason}")
+            second = self._attempt("secondary", messages)
+            return self._adopt(second, [first]) if second.ok else self._give_up([first, second])
+
+        ex = ThreadPoolExecutor(max_workers=2, thread_name_prefix="pmbok-hedge")
+        try:
+            # 計測中のレコード（contextvars）をワーカースレッドに引き継ぐ
+            pending = {ex.submit(contextvars.copy_context().run, self._attempt, "primary", messages)}
+            failed: List[_Outcome] = []
+            sent_secondary = False
+            while pending:
+                done, pending = wait(pending, timeout=None if sent_secondary else delay, return_when=FIRST_COMPLETED)
+                if not done:
+                    metrics.branch("route:hedge")
+                for fut in done:
+                    out = fut.result()
+                    if out.ok:
+                        return self._adopt(out, failed)
+                    failed.append(out)
+                    if not sent_secondary:
+                        metrics.branch(f"route:failover:{out.reason}")
+                if not sent_secondary:
+                    sent_secondary = True
+                    pending.add(ex.submit(contextvars.copy_context().run, self._attempt, "secondary", messages))
+            return self._give_up(failed)
+        finally:
+            ex.shutdown(wait=False, cancel_futures=True)
+
+    async def agenerate(self, messages: List[Dict[str, str]]) -> str:
+        delay = self.hedge_delay()
+        pending = {asyncio.ensure_future(self._aattempt("primary", messages))}
+        failed: List[_Outcome] = []
+        sent_secondary = False
+        try:
+            while pending:
+                timeout = None if sent_secondary else delay
+                done, pending = await asyncio.wait(pending, timeout=timeout, return_when=asyncio.FIRST_COMPLETED)
+                if not done:
+                    metrics.branch("route:hedge")
+                for task in done:
+                    out = task.result()
+                    if out.ok:
+                        return self._adopt(out, failed)
+                    failed.append(out)
+                    if not sent_secondary:
+                        metrics.branch(f"route:failover:{out.reason}")
+                if not sent_secondary:
+                    sent_secondary = True
+                    pending.add(asyncio.ensure_future(self._aattempt("secondary", messages)))
+            return self._give_up(failed)
+        finally:
+            # 負けた側（または呼び出し元の取り消し時は両方）を中断する
+            for task in pending:
+                task.cancel()
+            if pending:
+                await asyncio.gather(*pending, return_exceptions=True)
+
+    def stream(self, messages: List[Dict[str, str]]) -> Iterator[str]:
+        """ストリーミングはヘッジせず、主が本文を1文字も返さずに失敗・終了した場合だけ予備に切り替える。"""
+        started = False
+        try:
+            for delta in self.primary.stream(messages):
+                started = started or bool(delta)
+                yield delta
+            if started:
+                return
+            metrics.branch("route:failover:empty")
+        except Exception:
+            if started:
+                raise
+            metrics.branch("route:failover:error")
+        metrics.branch("route:secondary")
+        metrics.note(provider=self.secondary_settings.provider_kind(), model=self.secondary_settings.model)
+        yield from self.secondary.stream(messages)
@@ -1,6 +1,9 @@
 from __future__ import annotations
 
-from typing import Dict, List
+import json
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Any, Dict, List, Mapping
 
 # PMBOK の一般的な成果物名を用いた、汎用セクションリスト（著作権本文の複製は行わない）
 DOC_TEMPLATES: Dict[str, Dict[str, List[str] | str]] = {
@@ -110,3 +113,101 @@ DOC_TEMPLATES: Dict[str, Dict[str, List[str] | str]] = {
         ],
     },
 }
+
+
+# ドキュメント種別ごとに参照するプロジェクト情報のトップレベル項目（wizard.SCHEMA_DESCRIPTION_EXTENDED のキー）。
+# AICPM_CONTEXT_PROJECTION=true（任意）のときは、生成時にここに挙げた項目だけを送ります（既定は全項目）。
+# 射影しない場合も、予算を超えたときに関連の薄い項目から切り詰める順序に使います。
+# name / objectives はすべての種別で前提として扱い、スキーマにない独自の項目はそのまま送ります。
+DOC_CONTEXT_FIELDS: Dict[str, List[str]] = {
+    "project_charter": [
+        "sponsor", "scope", "milestones", "budget", "constraints", "assumptions", "stakeholders",
+        "risk_seeds", "project_code", "department", "governance",
+    ],
+    "scope_statement": [
+        "scope", "acceptance_criteria", "non_functional_requirements", "constraints",
+        "assumptions", "wbs",
+    ],
+    "wbs_outline": ["scope", "wbs", "milestones", "dependencies"],
+    "schedule_overview": ["milestones", "wbs", "dependencies", "constraints"],
+    "risk_management_plan": [
+        "risk_seeds", "constraints", "assumptions", "dependencies", "budget",
+        "compliance_requirements",
+    ],
+    "stakeholder_register": ["sponsor", "stakeholders", "department", "communication_cadence"],
+    "communication_plan": [
+        "sponsor", "stakeholders", "communication_cadence", "governance", "data_classification",
+    ],
+    "quality_management_plan": [
+        "acceptance_criteria", "non_functional_requirements", "compliance_requirements", "scope",
+    ],
+    "procurement_plan": [
+        "scope", "budget", "dependencies", "constraints", "compliance_requirements",
+    ],
+    "change_management_plan": ["governance", "scope", "stakeholders", "constraints"],
+    "lessons_learned": ["milestones", "risk_seeds", "constraints", "assumptions", "stakeholders"],
+}
+
+
+@dataclass(frozen=True)
+class TemplateSet:
+    """ドキュメント種別ごとのテンプレート（title / sections）と、参照する項目（DOC_CONTEXT_FIELDS）の組。
+
+    生成・入力ハッシュ・コンテキストの絞り込みはこの組を引数で受け取ります（省略時は組み込み）。
+    上書きは with_overrides で新しい組として作り、モジュールの辞書は書き換えません。
+    """
+
+    templates: Mapping[str, Mapping[str, Any]]
+    context_fields: Mapping[str, List[str]]
+
+    def template(self, doc_type: str) -> Mapping[str, Any]:
+        """doc_type のテンプレート。未知の種別は ValueError。"""
+        if doc_type not in self.templates:
+            raise ValueError(f"Unknown doc_type: {doc_type}")
+        return self.templates[doc_type]
+
+    def with_overrides(self, overrides: Dict[str, Dict[str, Any]]) -> "TemplateSet":
+        """上書き（load_template_overrides の形式）を適用した新しい組を返す。"""
+        templates = {k: {"title": v["title"], "sections": [*v["sections"]]} for k, v in self.templates.items()}
+        fields = {k: [*v] for k, v in self.context_fields.items()}
+        for key, tpl in overrides.items():
+            base = templates.get(key, {})
+            templates[key] = {"title": tpl.get("title", base.get("title")), "sections": [*tpl["sections"]]}
+            if tpl.get("context_fields") is not None:
+                fields[key] = [*tpl["context_fields"]]
+        return TemplateSet(templates, fields)
+
+    def changed(self, other: "TemplateSet") -> List[str]:
+        """other と内容が異なる種別（追加・削除を含む）。"""
+        return [
+            k for k in {**self.templates, **other.templates}
+            if self.templates.get(k) != other.templates.get(k)
+            or self.context_fields.get(k) != other.context_fields.get(k)
+        ]
+
+
+# 組み込みのテンプレート（上書きファイルの適用元）
+BUILTIN_TEMPLATES = TemplateSet(DOC_TEMPLATES, DOC_CONTEXT_FIELDS)
+
+
+def load_template_overrides(path: str | Path) -> Dict[str, Dict[str, Any]]:
+    """テンプレート上書きファイル(JSON)を読み込んで検証する。
+
+    形式: {"<doc_type>": {"title": "...", "sections": ["..."], "context_fields": ["..."]}}
+    title / context_fields は省略可（新しい種別では title 必須）。不正な内容は ValueError。
+    """
+    data = json.loads(Path(path).read_text(encoding="utf-8"))
+    if not isinstance(data, dict):
+        raise ValueError("テンプレート上書きはオブジェクト形式で指定してください")
+    for key, tpl in data.items():
+        if not isinstance(tpl, dict):
+            raise ValueError(f"{key}: オブジェクトではありません")
+        sections = tpl.get("sections")
+        if not isinstance(sections, list) or not sections or not all(isinstance(s, str) for s in sections):
+            raise ValueError(f"{key}: sections は文字列のリストで指定してください")
+        if key not in DOC_TEMPLATES and not isinstance(tpl.get("title"), str):
+            raise ValueError(f"{key}: 新しい種別には title が必要です")
+        fields = tpl.get("context_fields")
+        if fields is not None and not (isinstance(fields, list) and all(isinstance(f, str) for f in fields)):
+            raise ValueError(f"{key}: context_fields は文字列のリストで指定してください")
+    return data
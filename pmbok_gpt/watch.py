@@ -0,0 +1,226 @@
+from __future__ import annotations
+
+import asyncio
+import json
+import time
+from pathlib import Path
+from typing import Any, Callable, Dict, List, Optional, Sequence, Tuple
+
+from .batch import collect_project_files, plan_outputs, resolve_doc_types
+from .build import BuildItem, BuildManifest, plan_build
+from .config import AppSettings
+from .generator import agenerate_sectioned_document, agenerate_text_document
+from .providers import get_provider
+from .templates import BUILTIN_TEMPLATES, TemplateSet, load_template_overrides
+
+# on_event(kind, label, detail)。kind は start / ok / error / cancel / skip / reload
+EventHandler = Callable[[str, str, str], None]
+
+
+def _signature(path: Path) -> Optional[Tuple[int, int]]:
+    try:
+        st = path.stat()
+    except OSError:
+        return None
+    return st.st_mtime_ns, st.st_size
+
+
+class ProjectWatcher:
+    """プロジェクトJSON（とテンプレート上書き）の変更を監視し、影響のあるドキュメントだけを再生成する。
+
+    - 変更は debounce 秒だけ落ち着くのを待ってから読み込む（保存途中の不正なJSONは無視して次の変更を待つ）
+    - 再生成の要否は build と同じマニフェストの入力ハッシュで判定する
+    - 生成は1つのイベントループで max_workers 件まで同時に行い、より新しい入力で
+      置き換えられた生成中のドキュメントはキャンセルする
+    監視対象のファイル一覧は開始時に確定します（ディレクトリに後から追加したJSONは対象外）。
+    テンプレート上書きはこの監視の中だけで使い（template_set）、組み込みのテンプレートは変更しません。
+    """
+
+    def __init__(
+        self,
+        projects: Sequence[Path],
+        out_dir: Path,
+        *,
+        templates: Optional[Path] = None,
+        doc_types: Optional[Sequence[str]] = None,
+        language: Optional[str] = None,
+        extra_instructions: Optional[str] = None,
+        settings: Optional[AppSettings] = None,
+        max_workers: int = 4,
+        sectioned: bool = False,
+        debounce: float = 0.5,
+        interval: float = 0.25,
+        provider: Any = None,
+        on_event: Optional[EventHandler] = None,
+    ):
+        self.settings = settings or AppSettings()
+        self.files: List[Path] = [f for p in projects for f in collect_project_files(Path(p))]
+        if not self.files:
+            raise ValueError(f"プロジェクトJSONが見つかりません: {', '.join(str(p) for p in projects)}")
+        self.out_dir = Path(out_dir)
+        self.templates = Path(templates) if templates else None
+        self.template_set: TemplateSet = BUILTIN_TEMPLATES
+        self.doc_types = doc_types
+        self.language = language or self.settings.default_language
+        self.extra_instructions = extra_instructions
+        self.max_workers = max(1, max_workers)
+        self.sectioned = sectioned
+        self.debounce = debounce
+        self.interval = interval
+        self.on_event = on_event or (lambda kind, label, detail: None)
+        self.manifest = BuildManifest(self.out_dir)
+        self.stats: Dict[str, int] = {"generated": 0, "failed": 0, "cancelled": 0, "skipped": 0}
+        self._provider = provider
+        self._contexts: Dict[str, Dict[str, Any]] = {}
+        self._running: Dict[str, Tuple[asyncio.Task, Dict[str, str]]] = {}
+        self._limit: Optional[asyncio.Semaphore] = None
+
+    # --- 読み込み ---
+
+    def _watched(self) -> List[Path]:
+        return [*self.files, *([self.templates] if self.templates else [])]
+
+    def _load_templates(self) -> bool:
+        if self.templates is None:
+            return False
+        try:
+            loaded = BUILTIN_TEMPLATES.with_overrides(
+                load_template_overrides(self.templates) if self.templates.exists() else {}
+            )
+        except (OSError, ValueError) as e:
+            self.on_event("error", str(self.templates), f"テンプレート上書きを読み込めません: {e}")
+            return False
+        changed = self.template_set.changed(loaded)
+        self.template_set = loaded
+        if changed:
+            self.on_event("reload", str(self.templates), ", ".join(changed))
+        return bool(changed)
+
+    def _load_project(self, path: Path) -> bool:
+        try:
+            self._contexts[str(path)] = json.loads(path.read_text(encoding="utf-8"))
+        except (OSError, ValueError) as e:
+            self.on_event("error", path.stem, f"JSONを読み込めません（修正を待ちます）: {e}")
+            return False
+        return True
+
+    # --- 再生成 ---
+
+    def _plan(self, files: Sequence[Path]) -> List[BuildItem]:
+        tasks = plan_outputs(self.files, resolve_doc_types(self.doc_types, self.template_set), self.out_dir)
+        targets = {str(f) for f in files}
+        tasks = [t for t in tasks if t["project"] in targets and t["project"] in self._contexts]
+        return plan_build(
+            tasks, self._contexts, self.manifest, language=self.language,
+            extra_instructions=self.extra_instructions, settings=self.settings, sectioned=self.sectioned,
+            templates=self.template_set,
+        )
+
+    def sync(self, changed: Optional[Sequence[Path]] = None) -> List[BuildItem]:
+        """変更のあったファイル（None なら全件）を読み込み、古くなったドキュメントの生成を始める。
+
+        イベントループ内から呼び出します。開始した（または継続中の）ドキュメントを返します。
+        """
+        if self._limit is None:
+            self._limit = asyncio.Semaphore(self.max_workers)
+        changed = list(self._watched() if changed is None else changed)
+        files = [f for f in self.files if f in changed]
+        if self.templates is not None and self.templates in changed and self._load_templates():
+            files = self.files
+        files = [f for f in files if self._load_project(f)]
+
+        started: List[BuildItem] = []
+        for item in self._plan(files):
+            running = self._running.get(item.out_path)
+            if running is not None and running[1] == item.inputs:
+                started.append(item)
+                continue
+            if running is not None:
+                # より新しい入力で置き換えられた生成は待たずに打ち切る
+                running[0].cancel()
+                del self._running[item.out_path]
+                self.stats["cancelled"] += 1
+                self.on_event("cancel", self._label(item), "入力が更新されました")
+            if not item.stale:
+                self.stats["skipped"] += 1
+                continue
+            task = asyncio.ensure_future(self._generate(item))
+            self._running[item.out_path] = (task, item.inputs)
+            started.append(item)
+        return started
+
+    def _label(self, item: BuildItem) -> str:
+        return f"{Path(item.project).stem}/{item.doc_type}"
+
+    async def _generate(self, item: BuildItem) -> None:
+        assert self._limit is not None
+        label = self._label(item)
+        try:
+            async with self._limit:
+                self.on_event("start", label, ", ".join(item.reasons))
+                started = time.perf_counter()
+                Path(item.out_path).parent.mkdir(parents=True, exist_ok=True)
+                generate = agenerate_sectioned_document if self.sectioned else agenerate_text_document
+                await generate(
+                    doc_type=item.doc_type,
+                    project_context=self._contexts[item.project],
+                    out_path=item.out_path,
+                    language=self.language,
+                    extra_instructions=self.extra_instructions,
+                    settings=self.settings,
+                    provider=self._get_provider(),
+                    templates=self.template_set,
+                )
+            self.manifest.record(item.out_path, item.inputs, project=Path(item.project).name, doc_type=item.doc_type)
+            self.stats["generated"] += 1
+            self.on_event("ok", label, f"{time.perf_counter() - started:.2f}s: {item.out_path}")
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            self.stats["failed"] += 1
+            self.on_event("error", label, str(e))
+        finally:
+            running = self._running.get(item.out_path)
+            if running is not None and running[0] is asyncio.current_task():
+                del self._running[item.out_path]
+
+    def _get_provider(self) -> Any:
+        # セクション単位生成はトークン予算が異なるため各生成で用意する（batch と同じ）
+        if self._provider is None and not self.sectioned:
+            self._provider = get_provider(self.settings)
+        return self._provider
+
+    @property
+    def in_flight(self) -> int:
+        return len(self._running)
+
+    async def wait_idle(self) -> None:
+        """生成中のドキュメントがすべて終わる（またはキャンセルされる）まで待つ。"""
+        while self._running:
+            await asyncio.gather(*(t for t, _ in list(self._running.values())), return_exceptions=True)
+
+    # --- 監視ループ ---
+
+    async def run(self, stop: Optional[asyncio.Event] = None) -> None:
+        """初回に古いドキュメントを再生成し、以降は変更を監視し続ける（stop がセットされるまで）。"""
+        seen = {p: _signature(p) for p in self._watched()}
+        self.sync()
+        pending: Dict[Path, float] = {}
+        try:
+            while stop is None or not stop.is_set():
+                await asyncio.sleep(self.interval)
+                now = time.monotonic()
+                for path in self._watched():
+                    sig = _signature(path)
+                    if sig != seen[path]:
+                        seen[path] = sig
+                        pending[path] = now
+                ready = [p for p, t in pending.items() if now - t >= self.debounce]
+                if ready:
+                    for p in ready:
+                        del pending[p]
+                    self.sync(ready)
+        finally:
+            for task, _ in list(self._running.values()):
+                task.cancel()
+            await asyncio.gather(*(t for t, _ in list(self._running.values())), return_exceptions=True)
@@ -3,13 +3,12 @@ from __future__ import annotations
 import json
 from pathlib import Path
 import time
-from concurrent.futures import ThreadPoolExecutor
 from typing import Any, Dict, List
 
 import pandas as pd
 import streamlit as st
 
-from pmbok_gpt.generator import generate_text_document
+from pmbok_gpt.generator import generate_text_document, stream_text_document
 from pmbok_gpt.config import AppSettings
 
 st.set_page_config(page_title="AICreateProjectByPMBOK - Project JSON UI", layout="wide")
@@ -71,6 +70,11 @@ with st.sidebar:
         value=True,
         help="LLMが空の本文を返した場合でも空ファイルにしないための保険です。無効にすると空出力をエラーとして検出できます。"
     )
+    use_cache = st.checkbox(
+        "生成結果キャッシュを使う",
+        value=False,
+        help="同じプロジェクト情報・doc_type・言語・モデル設定での再生成時、保存済みの結果を即座に返します（.cache/ に保存）。"
+    )
     if (model or "").lower().find("gpt-5") >= 0:
         st.caption("ヒント: gpt-5 系モデルでは Responses API 優先が推奨です。temperature は無視される場合があります。")
     if provider == "openai":
@@ -333,7 +337,9 @@ if st.button("ドキュメント生成"):
     # プロバイダ設定を反映
     settings = None
     if provider == "stub":
-        settings = AppSettings(model=model, temperature=temperature, max_tokens=int(max_tokens), use_stub=True)
+        settings = AppSettings(
+            model=model, temperature=temperature, max_tokens=int(max_tokens), use_stub=True, cache_enabled=use_cache
+        )
     elif provider == "openai":
         if not openai_key:
             st.error("OPENAI_API_KEY を入力してください。")
@@ -345,6 +351,7 @@ if st.button("ドキュメント生成"):
             use_stub=False,
             use_responses_api=prefer_responses_api,
             fallback_to_stub_on_empty=fallback_stub,
+            cache_enabled=use_cache,
             openai_api_key=openai_key,
             openai_base_url=openai_base_url or None,
         )
@@ -359,6 +366,7 @@ if st.button("ドキュメント生成"):
             use_stub=False,
             use_responses_api=prefer_responses_api,
             fallback_to_stub_on_empty=fallback_stub,
+            cache_enabled=use_cache,
             azure_openai_api_key=azure_key,
             azure_openai_endpoint=azure_endpoint,
             azure_openai_api_version=azure_api_version,
@@ -372,50 +380,51 @@ if st.button("ドキュメント生成"):
             use_stub=True,
             use_responses_api=prefer_responses_api,
             fallback_to_stub_on_empty=fallback_stub,
+            cache_enabled=use_cache,
         )
 
     try:
         Path(Path(out_doc).parent).mkdir(parents=True, exist_ok=True)
         status_placeholder = st.empty()
         status_placeholder.info("作成中...")
-        progress_bar = st.progress(0)
         elapsed_placeholder = st.empty()
-
-        def _run_generation():
-            return generate_text_document(
-                doc_type=doc_type,
-                project_context=ctx,
-                out_path=out_doc,
-                language=language_sel,
-                extra_instructions=note,
-                settings=settings,
-            )
+        st.subheader("生成結果プレビュー")
+        preview_placeholder = st.empty()
 
         start_time = time.time()
-        percent = 0
-        with ThreadPoolExecutor(max_workers=1) as ex:
-            future = ex.submit(_run_generation)
-            # 疑似的な進行度アニメーション＋経過時間表示
-            while not future.done():
-                elapsed = time.time() - start_time
-                percent = (percent + 3) % 100
-                progress_bar.progress(percent)
-                elapsed_placeholder.write(f"経過時間: {elapsed:.1f} 秒")
-                time.sleep(0.1)
-            # 完了処理
-            path = future.result()
-        progress_bar.progress(100)
+        first_byte = None
+        last_render = 0.0
+        received: List[str] = []
+        # 到着したトークンを逐次ファイルへ追記しつつ、画面にも順次描画
+        for delta in stream_text_document(
+            doc_type=doc_type,
+            project_context=ctx,
+            out_path=out_doc,
+            language=language_sel,
+            extra_instructions=note,
+            settings=settings,
+        ):
+            received.append(delta)
+            now = time.time()
+            if first_byte is None:
+                first_byte = now - start_time
+            # 再描画は 0.1 秒間隔に間引く
+            if now - last_render >= 0.1:
+                preview_placeholder.code("".join(received), language="markdown")
+                elapsed_placeholder.write(f"経過時間: {now - start_time:.1f} 秒（初回出力 {first_byte:.1f} 秒）")
+                last_render = now
+        path = out_doc
         total_elapsed = time.time() - start_time
         status_placeholder.success(f"作成が完了しました（経過 {total_elapsed:.1f} 秒）")
+        elapsed_placeholder.write(f"経過時間: {total_elapsed:.1f} 秒（初回出力 {(first_byte or total_elapsed):.1f} 秒）")
         st.success(f"生成しました: {path}")
-        # 生成したテキストの内容をプレビュー表示
+        # 保存されたテキストの内容で最終表示（フォールバック時の注意書きを含む）
         try:
             content = Path(path).read_text(encoding="utf-8")
         except Exception as e:
             st.warning(f"ファイル読み込みに失敗しました: {e}")
         else:
-            st.subheader("生成結果プレビュー")
-            st.code(content, language="markdown")
+            preview_placeholder.code(content, language="markdown")
     except Exception as e:
         try:
             status_placeholder.error("生成に失敗しました")
@@ -439,6 +448,7 @@ if st.button("ドキュメント生成"):
                     use_stub=False,
                     use_responses_api=True,
                     fallback_to_stub_on_empty=fallback_stub,
+                    cache_enabled=use_cache,
                     openai_api_key=openai_key,
                     openai_base_url=openai_base_url or None,
                 )
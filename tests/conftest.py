@@ -0,0 +1,14 @@
+from __future__ import annotations
+
+import pytest
+
+
+@pytest.fixture(autouse=True)
+def _isolated_state(tmp_path_factory, monkeypatch):
+    """計測ログ・互換情報・キャッシュ・ジョブ記録をテストごとの一時ディレクトリに向ける。"""
+    state = tmp_path_factory.mktemp("state")
+    monkeypatch.setenv("AICPM_METRICS_PATH", str(state / "metrics.jsonl"))
+    monkeypatch.setenv("AICPM_CAPABILITIES_PATH", str(state / "capabilities.json"))
+    monkeypatch.setenv("AICPM_CACHE_DIR", str(state / "responses"))
+    monkeypatch.setenv("AICPM_BATCH_JOBS_DIR", str(state / "batch_jobs"))
+    monkeypatch.setenv("AICPM_JOBS_DIR", str(state / "jobs"))
@@ -0,0 +1,41 @@
+from __future__ import annotations
+
+import json
+from pathlib import Path
+
+import pytest
+
+from pmbok_gpt.batch import generate_documents
+from pmbok_gpt.config import AppSettings
+from pmbok_gpt.templates import DOC_TEMPLATES
+
+
+def _write_project(path: Path, name: str) -> Path:
+    path.write_text(json.dumps({"name": name, "objectives": ["品質向上"]}, ensure_ascii=False), encoding="utf-8")
+    return path
+
+
+def test_generate_documents_all_types(tmp_path: Path):
+    project = _write_project(tmp_path / "p.json", "デモ")
+    report = generate_documents(project, tmp_path / "out", settings=AppSettings(use_stub=True))
+    assert len(report.results) == len(DOC_TEMPLATES)
+    assert report.summary()["failed"] == 0
+    for r in report.results:
+        assert Path(r.out_path).read_text(encoding="utf-8")
+
+
+def test_generate_documents_directory(tmp_path: Path):
+    src = tmp_path / "projects"
+    src.mkdir()
+    _write_project(src / "a.json", "A")
+    _write_project(src / "b.json", "B")
+    report = generate_documents(
+        src, tmp_path / "out", doc_types=["project_charter"], settings=AppSettings(use_stub=True), max_workers=2
+    )
+    assert [Path(r.out_path).parent.name for r in report.results] == ["a", "b"]
+
+
+def test_generate_documents_unknown_doc_type(tmp_path: Path):
+    project = _write_project(tmp_path / "p.json", "デモ")
+    with pytest.raises(ValueError):
+        generate_documents(project, tmp_path / "out", doc_types=["nope"], settings=AppSettings(use_stub=True))
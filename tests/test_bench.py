@@ -0,0 +1,26 @@
+from pmbok_gpt.bench import SimulationProfile, run_benchmark
+
+
+def _fast(**kw):
+    return SimulationProfile(ttft=0.01, per_token=0.0, output_tokens=32, jitter=0.0, time_scale=1.0, **kw)
+
+
+def test_benchmark_scenarios_report_throughput(tmp_path):
+    report = run_benchmark(projects=2, doc_types=["project_charter", "scope_statement"], workers=4, profile=_fast(), work_dir=tmp_path)
+    names = [s.name for s in report.scenarios]
+    assert names == ["serial", "concurrent", "async", "cached"]
+    for s in report.scenarios:
+        assert s.documents == 4 and s.failed == 0
+        assert s.throughput > 0 and s.latency_p99 is not None
+    out = tmp_path / "out" / "serial" / "project_000" / "project_charter.txt"
+    assert "シミュレーション出力" in out.read_text(encoding="utf-8")
+
+
+def test_rejections_are_learned_once(tmp_path):
+    profile = _fast(reject_params=("max_tokens", "temperature"))
+    report = run_benchmark(projects=1, doc_types=["project_charter"], workers=1, profile=profile, scenarios=["serial", "concurrent"], work_dir=tmp_path)
+    first, second = report.scenarios
+    # 1回目でフォールバック先を学習し、以降は最初から通る形で送る
+    assert first.param_rejections == 2
+    assert second.param_rejections == 0
+    assert first.failed == 0 and second.failed == 0
@@ -0,0 +1,100 @@
+from __future__ import annotations
+
+import json
+import threading
+from pathlib import Path
+from typing import Dict, List
+
+from pmbok_gpt.build import MANIFEST_NAME, build_documents, input_fingerprint
+from pmbok_gpt.config import AppSettings
+from pmbok_gpt.generator import build_messages
+from pmbok_gpt.templates import BUILTIN_TEMPLATES, DOC_CONTEXT_FIELDS, DOC_TEMPLATES
+
+SAMPLE = json.loads((Path(__file__).resolve().parents[1] / "examples" / "project_sample.json").read_text(encoding="utf-8"))
+
+
+class _Counting:
+    def __init__(self) -> None:
+        self.calls = 0
+        self._lock = threading.Lock()
+
+    def generate(self, messages: List[Dict[str, str]]) -> str:
+        with self._lock:
+            self.calls += 1
+        return "本文"
+
+
+def _build(project: Path, out: Path, provider: _Counting, **kwargs):
+    return build_documents(project, out, settings=kwargs.pop("settings", AppSettings(use_stub=True)), provider=provider, **kwargs)
+
+
+def test_build_skips_up_to_date_documents(tmp_path: Path):
+    project = tmp_path / "p.json"
+    project.write_text(json.dumps(SAMPLE, ensure_ascii=False), encoding="utf-8")
+    out = tmp_path / "out"
+    provider = _Counting()
+
+    first = _build(project, out, provider)
+    assert provider.calls == len(DOC_TEMPLATES) and first.summary()["rebuilt"] == len(DOC_TEMPLATES)
+    assert (out / MANIFEST_NAME).is_file()
+
+    second = _build(project, out, provider)
+    assert provider.calls == len(DOC_TEMPLATES)
+    assert len(second.skipped) == len(DOC_TEMPLATES)
+
+    # 射影なし（既定）ではプロンプトに全項目が入るため、どの項目を変えても全種別が再生成される
+    edited = dict(SAMPLE, milestones=[{"name": "リリース", "target": "2099-01-01"}])
+    project.write_text(json.dumps(edited, ensure_ascii=False), encoding="utf-8")
+    third = _build(project, out, provider)
+    assert all(i.stale for i in third.items)
+    assert all(i.reasons == ["context"] for i in third.items if i.stale)
+    assert provider.calls == 2 * len(DOC_TEMPLATES)
+
+
+def test_build_with_projection_skips_unaffected_documents(tmp_path: Path):
+    project = tmp_path / "p.json"
+    project.write_text(json.dumps(SAMPLE, ensure_ascii=False), encoding="utf-8")
+    out = tmp_path / "out"
+    provider = _Counting()
+    settings = AppSettings(use_stub=True, context_projection=True)
+    _build(project, out, provider, settings=settings)
+
+    # マイルストーンを参照する種別だけが再生成される
+    edited = dict(SAMPLE, milestones=[{"name": "リリース", "target": "2099-01-01"}])
+    project.write_text(json.dumps(edited, ensure_ascii=False), encoding="utf-8")
+    report = _build(project, out, provider, settings=settings)
+    expected = {k for k, fields in DOC_CONTEXT_FIELDS.items() if "milestones" in fields}
+    assert {i.doc_type for i in report.items if i.stale} == expected
+    assert all(i.reasons == ["context"] for i in report.items if i.stale)
+    assert provider.calls == len(DOC_TEMPLATES) + len(expected)
+
+
+def test_build_detects_missing_output_and_model_change(tmp_path: Path):
+    project = tmp_path / "p.json"
+    project.write_text(json.dumps(SAMPLE, ensure_ascii=False), encoding="utf-8")
+    out = tmp_path / "out"
+    provider = _Counting()
+    _build(project, out, provider, doc_types=["project_charter", "wbs_outline"])
+
+    (out / "wbs_outline.txt").unlink()
+    report = _build(project, out, provider, doc_types=["project_charter", "wbs_outline"], dry_run=True)
+    assert [i.reasons for i in report.items] == [[], ["missing"]]
+
+    report = _build(project, out, provider, doc_types=["project_charter"], settings=AppSettings(use_stub=True, model="gpt-4o"))
+    assert report.items[0].reasons == ["model"]
+
+
+def test_template_overrides_do_not_touch_builtin_templates():
+    builtin = {k: dict(v) for k, v in DOC_TEMPLATES.items()}
+    custom = BUILTIN_TEMPLATES.with_overrides({
+        "wbs_outline": {"sections": ["成果物", "作業"]},
+        "kickoff": {"title": "キックオフ資料", "sections": ["目的"], "context_fields": ["milestones"]},
+    })
+    assert custom.changed(BUILTIN_TEMPLATES) == ["wbs_outline", "kickoff"]
+    assert DOC_TEMPLATES == builtin and "kickoff" not in DOC_CONTEXT_FIELDS
+
+    kwargs = dict(language="ja", extra_instructions=None, settings=AppSettings(use_stub=True))
+    assert input_fingerprint("wbs_outline", SAMPLE, templates=custom, **kwargs)["template"] != (
+        input_fingerprint("wbs_outline", SAMPLE, **kwargs)["template"]
+    )
+    assert "キックオフ資料" in build_messages("ja", "kickoff", SAMPLE, templates=custom)[-1]["content"]
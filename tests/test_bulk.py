@@ -0,0 +1,86 @@
+from __future__ import annotations
+
+import json
+from pathlib import Path
+
+import pytest
+
+from pmbok_gpt.bench import SimulationProfile
+from pmbok_gpt.build import BuildManifest
+from pmbok_gpt.bulk import load_job, poll_bulk, submit_bulk
+from pmbok_gpt.config import AppSettings
+from pmbok_gpt.metrics import load_records
+from pmbok_gpt.mock_server import MockOpenAIServer
+
+SAMPLE = json.loads((Path(__file__).resolve().parents[1] / "examples" / "project_sample.json").read_text(encoding="utf-8"))
+DOC_TYPES = ["project_charter", "wbs_outline"]
+
+
+@pytest.fixture
+def project(tmp_path: Path) -> Path:
+    path = tmp_path / "p.json"
+    path.write_text(json.dumps(SAMPLE, ensure_ascii=False), encoding="utf-8")
+    return path
+
+
+def _settings(server: MockOpenAIServer) -> AppSettings:
+    return AppSettings(openai_base_url=server.base_url, openai_api_key="sk-mock", use_stub=False)
+
+
+def test_bulk_resubmits_rejected_params_and_writes_outputs(tmp_path: Path, project: Path):
+    profile = SimulationProfile(time_scale=0.0, output_tokens=40, reject_params=("response_format",))
+    out = tmp_path / "out"
+    with MockOpenAIServer(profile=profile) as server:
+        settings = _settings(server)
+        job = submit_bulk(project, out, doc_types=DOC_TYPES, settings=settings)
+        assert job is not None
+        # 別プロセスからの再開と同じく、保存したジョブ記録から続ける
+        job = poll_bulk(load_job(job.id, settings), settings=settings, poll_interval=0.02, timeout=10)
+        assert job.status == "completed"
+        assert job.counts()["ok"] == 2
+        assert [r["shape"]["include_response_format"] for r in job.rounds] == [True, False]
+        assert server.stats()["batches"] == 2
+        # 出力済みはマニフェストに記録され、次の投入対象にならない
+        assert submit_bulk(project, out, doc_types=DOC_TYPES, settings=settings) is None
+
+    manifest = BuildManifest(out)
+    assert sorted(manifest.entries) == ["project_charter.txt", "wbs_outline.txt"]
+    assert "シミュレーション出力" in (out / "wbs_outline.txt").read_text(encoding="utf-8")
+    rows = load_records(settings.metrics_path)
+    assert [(r["mode"], r["api"]) for r in rows] == [("batch", "batch")] * 2
+    assert all(r["completion_tokens"] == 40 for r in rows)
+
+
+def test_bulk_resume_restores_model_settings(tmp_path: Path, project: Path):
+    profile = SimulationProfile(time_scale=0.0, output_tokens=40, reject_params=("response_format",))
+    out = tmp_path / "out"
+    with MockOpenAIServer(profile=profile) as server:
+        settings = _settings(server).model_copy(update={"model": "gpt-job", "temperature": 0.7, "max_tokens": 321})
+        job = submit_bulk(project, out, doc_types=["project_charter"], settings=settings)
+        # 別の設定で再開しても、再投入するバッチは作成時の設定で送る
+        job = poll_bulk(load_job(job.id, settings), settings=_settings(server), poll_interval=0.02, timeout=10)
+        assert job.status == "completed" and len(job.rounds) == 2
+        inputs = [data for name, data in server._server.files.values() if name == "pmbok_batch.jsonl"]
+        bodies = [json.loads(line)["body"] for data in inputs for line in data.decode("utf-8").splitlines()]
+        assert [(b["model"], b["temperature"], b["max_tokens"]) for b in bodies] == [("gpt-job", 0.7, 321)] * 2
+
+        other = AppSettings(openai_base_url="http://127.0.0.1:9/v1", openai_api_key="sk-mock", use_stub=False)
+        with pytest.raises(ValueError, match="endpoint"):
+            poll_bulk(load_job(job.id, settings), settings=other, wait=False)
+    assert {r["model"] for r in load_records(settings.metrics_path)} == {"gpt-job"}
+
+
+def test_bulk_empty_output_falls_back_to_stub(tmp_path: Path, project: Path):
+    profile = SimulationProfile(time_scale=0.0, output_tokens=0)
+    out = tmp_path / "out"
+    with MockOpenAIServer(profile=profile) as server:
+        settings = _settings(server)
+        job = submit_bulk(project, out, doc_types=["project_charter"], settings=settings)
+        job = poll_bulk(job, settings=settings, poll_interval=0.02, timeout=10)
+    assert job.counts()["fallback"] == 1
+    assert "スタブ生成にフォールバック" in (out / "project_charter.txt").read_text(encoding="utf-8")
+
+
+def test_bulk_requires_api_provider(tmp_path: Path, project: Path):
+    with pytest.raises(ValueError):
+        submit_bulk(project, tmp_path / "out", settings=AppSettings(use_stub=True))
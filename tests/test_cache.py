@@ -0,0 +1,68 @@
+from __future__ import annotations
+
+import asyncio
+import os
+import time
+from pathlib import Path
+from typing import Dict, List
+
+from pmbok_gpt.cache import CachedProvider, ResponseCache
+from pmbok_gpt.config import AppSettings
+
+
+class _CountingProvider:
+    def __init__(self) -> None:
+        self.calls = 0
+
+    def generate(self, messages: List[Dict[str, str]]) -> str:
+        self.calls += 1
+        return f"text-{self.calls}"
+
+    async def agenerate(self, messages: List[Dict[str, str]]) -> str:
+        return self.generate(messages)
+
+
+MESSAGES = [{"role": "user", "content": "hello"}]
+
+
+def _cached(tmp_path: Path, **kwargs):
+    settings = AppSettings(use_stub=True, cache_enabled=True, cache_dir=str(tmp_path), **kwargs)
+    inner = _CountingProvider()
+    cache = ResponseCache(str(tmp_path), ttl_seconds=settings.cache_ttl_seconds, max_entries=2)
+    return CachedProvider(inner, cache, settings), inner, cache
+
+
+def test_cache_hit_and_miss(tmp_path: Path):
+    provider, inner, cache = _cached(tmp_path)
+    assert provider.generate(MESSAGES) == "text-1"
+    assert provider.generate(MESSAGES) == "text-1"
+    assert asyncio.run(provider.agenerate(MESSAGES)) == "text-1"
+    assert inner.calls == 1
+    assert (cache.hits, cache.misses) == (2, 1)
+
+
+def test_cache_key_depends_on_model_params(tmp_path: Path):
+    provider, inner, _ = _cached(tmp_path)
+    provider.generate(MESSAGES)
+    provider.settings = AppSettings(use_stub=True, temperature=0.9)
+    provider.generate(MESSAGES)
+    assert inner.calls == 2
+
+
+def test_cache_bypass_refreshes_entry(tmp_path: Path):
+    provider, inner, _ = _cached(tmp_path, cache_bypass=True)
+    provider.generate(MESSAGES)
+    assert provider.generate(MESSAGES) == "text-2"
+    provider.settings.cache_bypass = False
+    assert provider.generate(MESSAGES) == "text-2"
+
+
+def test_cache_prune_ttl_and_max_entries(tmp_path: Path):
+    cache = ResponseCache(str(tmp_path), ttl_seconds=60, max_entries=2)
+    for i in range(4):
+        cache.put(f"{i:02d}" + "a" * 62, f"v{i}")
+    old = tmp_path / "00" / ("00" + "a" * 62 + ".json")
+    past = time.time() - 3600
+    os.utime(old, (past, past))
+    assert cache.prune() == 2
+    assert cache.stats()["entries"] == 2
@@ -0,0 +1,33 @@
+from __future__ import annotations
+
+import json
+from pathlib import Path
+
+from typer.testing import CliRunner
+
+from pmbok_gpt.cli import app
+from pmbok_gpt.generator import generate_text_document
+
+SAMPLE = Path(__file__).resolve().parents[1] / "examples" / "project_sample.json"
+
+
+def test_context_command_reports_budget_per_doc_type(monkeypatch):
+    monkeypatch.setenv("AICPM_USE_STUB", "true")
+    monkeypatch.setenv("AICPM_PROMPT_TOKEN_BUDGET", "4000")
+    result = CliRunner().invoke(
+        app, ["context", "--project-file", str(SAMPLE), "--doc-type", "project_charter", "--doc-type", "wbs_outline", "--show"]
+    )
+    assert result.exit_code == 0, result.output
+    assert "project_charter" in result.output and "wbs_outline" in result.output
+    assert "# project_charter" in result.output
+
+
+def test_stats_reads_metrics_written_by_default(tmp_path: Path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.delenv("AICPM_METRICS_PATH")
+    monkeypatch.setenv("AICPM_USE_STUB", "true")
+    generate_text_document("project_charter", {"name": "x"}, out_path=str(tmp_path / "out.txt"))
+    result = CliRunner().invoke(app, ["stats", "--json"])
+    assert result.exit_code == 0, result.output
+    (row,) = json.loads(result.output)
+    assert row["doc_type"] == "project_charter" and row["calls"] == 1
@@ -0,0 +1,47 @@
+from __future__ import annotations
+
+import asyncio
+import os
+
+from pmbok_gpt.clients import close_clients, pool_stats
+from pmbok_gpt.config import AppSettings
+from pmbok_gpt.providers import AzureOpenAIProvider, OpenAIProvider
+
+
+def _settings(**kwargs) -> AppSettings:
+    return AppSettings(use_stub=False, **kwargs)
+
+
+def test_openai_clients_are_shared_per_credentials(monkeypatch):
+    monkeypatch.delenv("OPENAI_API_KEY", raising=False)
+    monkeypatch.delenv("OPENAI_BASE_URL", raising=False)
+    close_clients()
+    a = OpenAIProvider(_settings(openai_api_key="key-a"))
+    b = OpenAIProvider(_settings(openai_api_key="key-a", model="other-model"))
+    c = OpenAIProvider(_settings(openai_api_key="key-b"))
+    d = OpenAIProvider(_settings(openai_api_key="key-a", openai_base_url="http://localhost:9/v1"))
+    assert a.client is b.client
+    assert a.client is not c.client
+    assert a.client is not d.client
+    assert pool_stats()["clients"] == 3
+    # 環境変数は書き換えない
+    assert "OPENAI_API_KEY" not in os.environ
+    close_clients()
+
+
+def test_azure_and_async_clients(monkeypatch):
+    close_clients()
+    settings = _settings(azure_openai_api_key="k", azure_openai_endpoint="https://example.openai.azure.com/")
+    a = AzureOpenAIProvider(settings)
+    b = AzureOpenAIProvider(settings)
+    assert a.client is b.client
+
+    async def _get():
+        return a.aclient, b.aclient
+
+    first = asyncio.run(_get())
+    assert first[0] is first[1]
+    # 別のイベントループでは別クライアント
+    second = asyncio.run(_get())
+    assert second[0] is not first[0]
+    close_clients()
@@ -0,0 +1,95 @@
+from __future__ import annotations
+
+import json
+from pathlib import Path
+
+from pmbok_gpt.config import AppSettings
+from pmbok_gpt.context import CORE_FIELDS, canonical_json, compact_context, count_tokens, project_fields, prune_empty
+from pmbok_gpt.generator import generate_text_document
+from pmbok_gpt.metrics import load_records
+from pmbok_gpt.templates import DOC_CONTEXT_FIELDS, DOC_TEMPLATES
+from pmbok_gpt.wizard import SCHEMA_DESCRIPTION_EXTENDED
+
+SAMPLE = json.loads((Path(__file__).resolve().parents[1] / "examples" / "project_sample.json").read_text(encoding="utf-8"))
+
+
+def test_prune_and_canonical_order():
+    data = {"b": [" x ", "", None], "a": {"c": {}, "d": 0, "e": False}, "f": ""}
+    assert prune_empty(data) == {"b": ["x"], "a": {"d": 0, "e": False}}
+    assert canonical_json({"b": 1, "a": "日本"}) == canonical_json({"a": "日本", "b": 1}) == '{"a":"日本","b":1}'
+
+
+def test_no_budget_keeps_everything():
+    compacted, report = compact_context(SAMPLE)
+    assert compacted == prune_empty(SAMPLE)
+    assert report.trimmed == []
+    assert report.compact_tokens < report.raw_tokens
+
+
+def test_budget_trims_irrelevant_fields_first():
+    ctx = dict(SAMPLE, stakeholders=[{"name": f"担当者{i}", "role": "メンバー" * 5} for i in range(20)])
+    compacted, report = compact_context(ctx, doc_type="wbs_outline", budget=150)
+    assert report.tokens <= 150 == report.budget
+    assert report.tokens == count_tokens(canonical_json(compacted))
+    assert compacted["name"] == SAMPLE["name"] and compacted["objectives"]
+    assert "stakeholders" not in compacted or "…他" in canonical_json(compacted["stakeholders"])
+    assert report.trimmed
+
+
+def test_generate_records_context_tokens(tmp_path: Path):
+    metrics_path = tmp_path / "m.jsonl"
+    settings = AppSettings(use_stub=True, metrics_path=str(metrics_path), prompt_token_budget=150)
+    generate_text_document("wbs_outline", SAMPLE, out_path=str(tmp_path / "a.txt"), settings=settings)
+    (row,) = load_records(str(metrics_path))
+    assert row["context_tokens"] <= 150
+    assert row["context_saved_tokens"] > 0
+    assert row["context_trimmed"]
+
+
+def test_relevance_map_covers_templates_and_schema():
+    assert set(DOC_CONTEXT_FIELDS) == set(DOC_TEMPLATES)
+    used = set(CORE_FIELDS).union(*DOC_CONTEXT_FIELDS.values())
+    assert used == set(SCHEMA_DESCRIPTION_EXTENDED)
+
+
+def test_projection_keeps_relevant_and_custom_fields():
+    ctx = dict(SAMPLE, wbs=[{"deliverable": "基盤", "work_packages": ["設計"]}], internal_memo="独自項目")
+    projected, omitted = project_fields(ctx, "communication_plan")
+    assert set(projected) == {"name", "objectives", "sponsor", "stakeholders", "internal_memo"}
+    assert "wbs" in omitted and "scope" in omitted
+    assert project_fields(ctx, "unknown_type") == (ctx, [])
+
+
+def test_generate_sends_only_projected_fields(tmp_path: Path):
+    sent = []
+
+    class _Capture:
+        def generate(self, messages):
+            sent.append(messages)
+            return "本文"
+
+    ctx = dict(SAMPLE, wbs=[{"deliverable": "基盤", "work_packages": ["設計"]}])
+    for projection in (True, False):
+        settings = AppSettings(use_stub=True, context_projection=projection)
+        generate_text_document("communication_plan", ctx, out_path=str(tmp_path / "a.txt"), settings=settings, provider=_Capture())
+    projected, full = (m[1]["content"] for m in sent)
+    assert "work_packages" not in projected and "在庫連携の安定" in projected
+    assert "work_packages" in full
+
+
+def test_default_settings_share_prompt_prefix_across_documents():
+    import json
+
+    from pmbok_gpt.generator import build_messages, prepare_context
+    from pmbok_gpt.templates import DOC_TEMPLATES
+
+    sample = json.loads((Path(__file__).resolve().parents[1] / "examples" / "project_sample.json").read_text(encoding="utf-8"))
+    settings = AppSettings(use_stub=True)
+    prefixes = set()
+    for doc_type in DOC_TEMPLATES:
+        context, _ = prepare_context("ja", doc_type, sample, None, settings)
+        messages = build_messages("ja", doc_type, context)
+        prefixes.add(json.dumps(messages[:2], ensure_ascii=False))
+    # 既定設定では全ドキュメントで前置き（システムプロンプト + プロジェクト情報）が同一
+    assert len(prefixes) == 1
+    assert "外部APIのスループット制限" in next(iter(prefixes))
@@ -1,6 +1,7 @@
 from __future__ import annotations
 
 import os
+import re
 from pathlib import Path
 
 from pmbok_gpt.excel import create_risk_register_excel, create_stakeholder_register_excel
@@ -16,3 +17,139 @@ def test_create_stakeholder_register_excel(tmp_path: Path):
     out = tmp_path / "stake.xlsx"
     path = create_stakeholder_register_excel(str(out))
     assert os.path.exists(path)
+
+
+def test_risk_register_rows_from_project_and_extra(tmp_path: Path):
+    from openpyxl import load_workbook
+
+    from pmbok_gpt.excel import DEFAULT_SPARE_ROWS, create_register_excel
+
+    project = {"risk_seeds": ["要件肥大化による遅延"]}
+    extra = ({"event": f"リスク{i}", "impact": "3", "probability": 0.5, "owner": ["PM", "PMO"]} for i in range(5000))
+    out = tmp_path / "risk.xlsx"
+    create_register_excel("risk-register", str(out), project=project, rows=extra)
+
+    ws = load_workbook(out).active
+    rows = list(ws.iter_rows(values_only=True))
+    # ヘッダ + データ 5001 行 + 手入力用の空行（数式はデータ量に合わせる）
+    assert len(rows) == 1 + 5001 + DEFAULT_SPARE_ROWS
+    assert re.fullmatch(r"R-[0-9a-f]{16}", rows[1][0]) and rows[1][1] == "要件肥大化による遅延" and rows[1][11] == "未評価"
+    assert rows[2][4:7] == (3, 0.5, '=IF(AND(ISNUMBER(E3),ISNUMBER(F3)),E3*F3,"")')
+    assert rows[2][9] == "PM、PMO"
+    assert rows[-1][6].endswith(f'E{len(rows)}*F{len(rows)},"")')
+    assert ws.freeze_panes == "A2"
+
+
+def test_stakeholder_register_from_project(tmp_path: Path):
+    from openpyxl import load_workbook
+
+    from pmbok_gpt.excel import create_register_excel, load_register_rows
+
+    extra = tmp_path / "extra.jsonl"
+    extra.write_text('{"氏名/組織": "情シス", "influence": "High"}\n\n', encoding="utf-8")
+    out = tmp_path / "stake.xlsx"
+    project = {"stakeholders": [{"name": "営業部", "interest": "在庫連携の安定"}]}
+    create_register_excel("stakeholder-register", str(out), project=project, rows=load_register_rows(extra))
+    rows = list(load_workbook(out).active.iter_rows(values_only=True))
+    assert [r[1:5] for r in rows[1:]] == [
+        ("営業部", None, "在庫連携の安定", None),
+        ("情シス", None, None, "High"),
+    ]
+    assert all(re.fullmatch(r"S-[0-9a-f]{16}", r[0]) for r in rows[1:]) and rows[1][0] != rows[2][0]
+
+
+def test_upsert_register_keeps_manual_edits_and_formatting(tmp_path: Path):
+    from openpyxl import load_workbook
+    from openpyxl.styles import Font
+
+    from pmbok_gpt.excel import upsert_register_excel
+
+    out = tmp_path / "risk.xlsx"
+    rows = [{"id": f"R-00{i}", "event": f"リスク{i}", "owner": "PM", "impact": 2, "probability": 3} for i in (1, 2, 3)]
+    assert upsert_register_excel("risk-register", str(out), rows=rows).added == 3
+
+    # 利用者の手修正: オーナーの変更、独自の列、書式
+    wb = load_workbook(out)
+    ws = wb["RiskRegister"]
+    ws["J3"] = "田中"
+    ws["N1"], ws["N2"] = "社内メモ", "要確認"
+    ws["B2"].font = Font(bold=True)
+    wb.save(out)
+
+    rows[0]["event"] = "リスク1（改訂）"
+    rows.append({"id": "R-004", "event": "リスク4", "impact": 1, "probability": 1})
+    report = upsert_register_excel("risk-register", str(out), rows=rows)
+    assert (report.added, report.updated, report.unchanged, report.kept) == (1, 1, 2, 1)
+
+    ws = load_workbook(out)["RiskRegister"]
+    assert ws["B2"].value == "リスク1（改訂）" and ws["B2"].font.bold
+    assert ws["J3"].value == "田中" and ws["N2"].value == "要確認"
+    # 新しい ID はデータ行の後ろ（手入力用の空行）に追加し、数式は実際の行を参照する
+    assert ws["A5"].value == "R-004" and ws["G5"].value.endswith('E5*F5,"")')
+
+    # 変更がなければ保存しない。元データが変わったセルは手修正より優先する
+    mtime = out.stat().st_mtime_ns
+    assert not upsert_register_excel("risk-register", str(out), rows=rows).saved
+    assert out.stat().st_mtime_ns == mtime
+    rows[1]["owner"] = "PMO"
+    assert upsert_register_excel("risk-register", str(out), rows=rows).cells == 1
+    assert load_workbook(out)["RiskRegister"]["J3"].value == "PMO"
+
+
+def test_upsert_keeps_manual_edits_on_the_same_risk_after_inserting_a_seed(tmp_path: Path):
+    from openpyxl import load_workbook
+
+    from pmbok_gpt.excel import upsert_register_excel
+
+    out = tmp_path / "risk.xlsx"
+    project = {"risk_seeds": ["ベンダ遅延", "要員不足"]}
+    upsert_register_excel("risk-register", str(out), project=project)
+    wb = load_workbook(out)
+    ws = wb["RiskRegister"]
+    ws["J3"] = "田中"  # 「要員不足」のオーナー
+    wb.save(out)
+    ids = {ws.cell(row=r, column=2).value: ws.cell(row=r, column=1).value for r in (2, 3)}
+
+    # 先頭に種を挿入しても、既存の種の ID は変わらない
+    project["risk_seeds"].insert(0, "仕様変更")
+    report = upsert_register_excel("risk-register", str(out), project=project)
+    assert (report.added, report.updated, report.unchanged) == (1, 0, 2)
+    ws = load_workbook(out)["RiskRegister"]
+    rows = {ws.cell(row=r, column=2).value: (ws.cell(row=r, column=1).value, ws.cell(row=r, column=10).value) for r in (2, 3, 4)}
+    assert rows["要員不足"] == (ids["要員不足"], "田中")
+    assert rows["ベンダ遅延"] == (ids["ベンダ遅延"], None)
+    assert rows["仕様変更"][0] not in ids.values()
+
+
+def test_register_ids_do_not_depend_on_row_order():
+    import random
+    from collections import Counter
+
+    from pmbok_gpt.excel import register_values
+
+    rows = [{"event": f"リスク{i}"} for i in range(40)] + [{"event": "重複"}] * 3
+
+    def ids(order):
+        _, values = register_values("risk-register", rows=order)
+        return Counter((v[1], v[0]) for v in values)
+
+    baseline = ids(rows)
+    assert all(re.fullmatch(r"R-[0-9a-f]{16}(-[234])?", i) for _, i in baseline)
+    assert len({i for _, i in baseline}) == len(rows)
+    shuffled = rows[:]
+    for seed in range(5):
+        random.Random(seed).shuffle(shuffled)
+        assert ids(shuffled) == baseline
+
+
+def test_register_id_collision_between_different_texts_is_an_error(monkeypatch):
+    import pytest
+
+    from pmbok_gpt import excel
+
+    # 桁数を 1 に絞って別の文言どうしを衝突させる。並び順で勝ち負けを決めず、どの順でもエラーにする
+    monkeypatch.setattr(excel, "_ID_DIGITS", 1)
+    rows = [{"event": f"リスク{i}"} for i in range(20)]
+    for order in (rows, rows[::-1]):
+        with pytest.raises(ValueError, match="衝突"):
+            list(excel.register_values("risk-register", rows=order)[1])
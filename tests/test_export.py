@@ -0,0 +1,81 @@
+from __future__ import annotations
+
+import csv
+import json
+import re
+from pathlib import Path
+
+import pytest
+
+from pmbok_gpt.batch import DocumentResult
+from pmbok_gpt.excel import RISK_HEADERS
+from pmbok_gpt.export import PROJECT_HEADER, export_portfolio, export_register, open_table
+
+
+def _read_csv(path: Path):
+    with open(path, encoding="utf-8", newline="") as f:
+        return list(csv.reader(f))
+
+
+def test_export_register_csv_computes_score(tmp_path: Path):
+    out = tmp_path / "risk.csv"
+    rows = [{"event": "遅延", "impact": "4", "probability": 2}, {"id": "X-9", "event": "要員不足", "impact": "高"}]
+    export_register("risk-register", out, project={"risk_seeds": ["外部API"]}, rows=rows)
+    data = _read_csv(out)
+    assert data[0] == RISK_HEADERS
+    ids = [r[0] for r in data[1:]]
+    assert all(re.fullmatch(r"R-[0-9a-f]{16}", i) for i in ids[:2]) and ids[0] != ids[1] and ids[2] == "X-9"
+    # xlsx の数式の代わりに計算済みのスコアを書く。数値でなければ空欄
+    assert data[2][4:7] == ["4", "2", "8"] and data[3][4:7] == ["高", "", ""]
+    with pytest.raises(ValueError):
+        export_register("risk-register", tmp_path / "risk.txt")
+
+
+def test_export_portfolio_consolidates_projects(tmp_path: Path):
+    pa = pytest.importorskip("pyarrow.parquet")
+    files = []
+    for name, seeds in (("alpha", ["遅延"]), ("beta", ["予算超過", {"event": "品質", "impact": 5, "probability": 3}])):
+        pf = tmp_path / f"{name}.json"
+        pf.write_text(json.dumps({"risk_seeds": seeds, "stakeholders": [name]}, ensure_ascii=False), encoding="utf-8")
+        files.append(pf)
+    doc = tmp_path / "beta" / "charter.txt"
+    doc.parent.mkdir()
+    doc.write_text("憲章", encoding="utf-8")
+    results = [
+        DocumentResult(project=str(files[1]), doc_type="charter", out_path=str(doc), elapsed=1.5, ok=True),
+        DocumentResult(project=str(files[0]), doc_type="charter", out_path="", elapsed=0.1, ok=False, error="boom"),
+    ]
+    written = export_portfolio(files, tmp_path / "out", formats=["csv", "parquet"], results=results)
+    assert written[str(tmp_path / "out" / "risk_register.parquet")] == 3
+
+    risks = _read_csv(tmp_path / "out" / "risk_register.csv")
+    assert risks[0] == [PROJECT_HEADER, *RISK_HEADERS]
+    assert [(r[0], r[2]) for r in risks[1:]] == [("alpha", "遅延"), ("beta", "予算超過"), ("beta", "品質")]
+    assert len({r[1] for r in risks[1:]}) == 3
+    table = pa.read_table(tmp_path / "out" / "risk_register.parquet")
+    assert table.column("スコア(影響×確率)").to_pylist() == [None, None, 15.0]
+    docs = pa.read_table(tmp_path / "out" / "documents.parquet").to_pylist()
+    assert [(d["成否"], d["文字数"], d["本文"], d["エラー"]) for d in docs] == [(True, 2.0, "憲章", None), (False, None, None, "boom")]
+    stakeholders = _read_csv(tmp_path / "out" / "stakeholder_register.csv")
+    assert stakeholders[2][0] == stakeholders[2][2] == "beta" and stakeholders[2][1].startswith("S-")
+
+
+def test_parquet_streams_in_row_groups_and_failed_export_keeps_output(tmp_path: Path):
+    pq = pytest.importorskip("pyarrow.parquet")
+    out = tmp_path / "t.parquet"
+    table = open_table(out, ["ID", "影響"], batch_rows=2)
+    for n in range(5):
+        table.write([f"R-{n}", n])
+    table.close()
+    assert pq.ParquetFile(out).metadata.num_row_groups == 3
+
+    def broken():
+        yield {"event": "ok"}
+        raise RuntimeError("中断")
+
+    csv_out = tmp_path / "risk.csv"
+    export_register("risk-register", csv_out, rows=[{"event": "前回"}])
+    with pytest.raises(RuntimeError):
+        export_register("risk-register", csv_out, rows=broken())
+    assert _read_csv(csv_out)[1][1] == "前回"
+    assert sorted(p.name for p in tmp_path.iterdir()) == ["risk.csv", "t.parquet"]
@@ -0,0 +1,127 @@
+from __future__ import annotations
+
+import asyncio
+import threading
+import time
+from pathlib import Path
+from typing import Dict, List
+
+from pmbok_gpt.config import AppSettings
+from pmbok_gpt.generator import (
+    agenerate_sectioned_document,
+    build_messages,
+    build_section_messages,
+    generate_sectioned_document,
+    section_token_budget,
+)
+from pmbok_gpt.templates import DOC_TEMPLATES
+
+
+class _SlowEchoProvider:
+    """対象セクション名を本文として返す（見出し付きで返すケースも含む）。"""
+
+    def __init__(self) -> None:
+        self.active = 0
+        self.peak = 0
+        self._lock = threading.Lock()
+
+    def _section(self, messages: List[Dict[str, str]]) -> str:
+        for line in messages[-1]["content"].splitlines():
+            if line.startswith("- セクション: "):
+                return line[len("- セクション: "):]
+        raise AssertionError("section line missing")
+
+    def generate(self, messages: List[Dict[str, str]]) -> str:
+        with self._lock:
+            self.active += 1
+            self.peak = max(self.peak, self.active)
+        time.sleep(0.05)
+        with self._lock:
+            self.active -= 1
+        sec = self._section(messages)
+        return f"## {sec}\n本文: {sec}"
+
+    async def agenerate(self, messages: List[Dict[str, str]]) -> str:
+        await asyncio.sleep(0.01)
+        return f"本文: {self._section(messages)}"
+
+
+def test_section_token_budget():
+    assert section_token_budget(1800, 8) == 225
+    assert section_token_budget(1800, 8, minimum=256) == 256
+
+
+def test_section_messages_share_preamble():
+    a = build_section_messages("ja", "project_charter", {"name": "x"}, 0)
+    b = build_section_messages("ja", "project_charter", {"name": "x"}, 5)
+    assert a[:2] == b[:2]
+    assert a[-1] != b[-1]
+
+
+def test_documents_share_project_prefix():
+    ctx_a = {"name": "x", "budget": {"amount": 1, "currency": "JPY"}}
+    ctx_b = {"budget": {"currency": "JPY", "amount": 1}, "name": "x"}
+    charter = build_messages("ja", "project_charter", ctx_a)
+    wbs = build_messages("ja", "wbs_outline", ctx_b, extra_instructions="簡潔に")
+    # キー順が違っても同じ前置き（プロンプトキャッシュに載る）になり、ドキュメント固有の指示は末尾のみ
+    assert charter[:2] == wbs[:2]
+    assert '{"budget":{"amount":1,"currency":"JPY"},"name":"x"}' in charter[1]["content"]
+    assert "追加指示: 簡潔に" in wbs[-1]["content"]
+    assert build_section_messages("ja", "wbs_outline", ctx_a, 0)[:2] == charter[:2]
+
+
+def test_generate_sectioned_document_in_order(tmp_path: Path):
+    provider = _SlowEchoProvider()
+    out = tmp_path / "charter.txt"
+    generate_sectioned_document(
+        "project_charter", {"name": "x"}, out_path=str(out), settings=AppSettings(use_stub=True), provider=provider
+    )
+    text = out.read_text(encoding="utf-8")
+    sections = DOC_TEMPLATES["project_charter"]["sections"]
+    positions = [text.index(f"{i}. {sec}\n本文: {sec}") for i, sec in enumerate(sections, start=1)]
+    assert positions == sorted(positions)
+    assert "## " not in text
+    assert provider.peak > 1
+
+
+def test_agenerate_sectioned_document(tmp_path: Path):
+    out = tmp_path / "scope.txt"
+    asyncio.run(
+        agenerate_sectioned_document(
+            "scope_statement", {"name": "x"}, out_path=str(out), settings=AppSettings(use_stub=True),
+            provider=_SlowEchoProvider(),
+        )
+    )
+    assert out.read_text(encoding="utf-8").startswith(DOC_TEMPLATES["scope_statement"]["title"])
+
+
+def test_sectioned_budget_applies_to_injected_provider(monkeypatch, tmp_path: Path):
+    from types import SimpleNamespace
+
+    from pmbok_gpt.providers import OpenAIProvider
+
+    sent: List[int] = []
+
+    class _Completions:
+        def create(self, **params):
+            sent.append(params["max_tokens"])
+            return SimpleNamespace(choices=[SimpleNamespace(message=SimpleNamespace(content="本文"))], usage=None)
+
+    class _AsyncCompletions:
+        async def create(self, **params):
+            return _Completions().create(**params)
+
+    monkeypatch.setenv("OPENAI_API_KEY", "sk-test")
+    settings = AppSettings(use_stub=False, max_tokens=1800, section_min_tokens=0, scheduler_enabled=False)
+    provider = OpenAIProvider(settings, client=SimpleNamespace(chat=SimpleNamespace(completions=_Completions())))
+    provider._aclient = SimpleNamespace(chat=SimpleNamespace(completions=_AsyncCompletions()))
+    sections = len(DOC_TEMPLATES["project_charter"]["sections"])
+    budget = section_token_budget(1800, sections)
+
+    # 呼び出し側のプロバイダ（max_tokens=1800）でも、各セクションは分割後の予算で送る
+    generate_sectioned_document("project_charter", {"name": "x"}, out_path=str(tmp_path / "a.txt"), settings=settings, provider=provider)
+    asyncio.run(
+        agenerate_sectioned_document("project_charter", {"name": "x"}, out_path=str(tmp_path / "b.txt"), settings=settings, provider=provider)
+    )
+    assert sent == [budget] * (2 * sections)
+    assert provider.settings.max_tokens == 1800
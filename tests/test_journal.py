@@ -0,0 +1,91 @@
+from __future__ import annotations
+
+import json
+import os
+from pathlib import Path
+from typing import Dict, List
+
+import pytest
+
+from pmbok_gpt.batch import generate_documents, resume_documents
+from pmbok_gpt.config import AppSettings
+from pmbok_gpt.generator import write_output
+from pmbok_gpt.journal import JobJournal
+
+
+class _Flaky:
+    """fail に含まれる種別の生成で例外を送出する（それ以外は呼び出しを記録して本文を返す）。"""
+
+    def __init__(self, fail: str = "") -> None:
+        self.fail = fail
+        self.seen: List[str] = []
+
+    def generate(self, messages: List[Dict[str, str]]) -> str:
+        doc_type = messages[-1]["content"].split("(", 1)[1].split(")", 1)[0]
+        if self.fail and self.fail == doc_type:
+            raise RuntimeError("connection reset")
+        self.seen.append(doc_type)
+        return f"{doc_type} 本文"
+
+
+def test_resume_runs_only_unfinished_tasks(tmp_path: Path):
+    project = tmp_path / "p.json"
+    project.write_text(json.dumps({"name": "デモ", "objectives": ["品質向上"]}, ensure_ascii=False), encoding="utf-8")
+    settings = AppSettings(use_stub=True)
+    doc_types = ["project_charter", "wbs_outline", "scope_statement"]
+
+    first = generate_documents(
+        project, tmp_path / "out", doc_types=doc_types, settings=settings, provider=_Flaky("wbs_outline"), journal=True
+    )
+    assert first.job_id and [r.ok for r in first.results] == [True, False, True]
+    journal = JobJournal.open(first.job_id, settings)
+    # クラッシュで書きかけになった最終行は無視される
+    with open(journal.path, "a", encoding="utf-8") as f:
+        f.write('{"event": "task", "key": ')
+    assert journal.state().counts() == {"documents": 3, "done": 2, "failed": 1, "pending": 0}
+
+    retry = _Flaky()
+    report = resume_documents(first.job_id, settings=settings, provider=retry)
+    assert retry.seen == ["wbs_outline"]
+    assert [r.ok for r in report.results] == [True]
+    state = JobJournal.open(first.job_id, settings).state()
+    assert state.complete and state.runs == 2
+    assert (tmp_path / "out" / "wbs_outline.txt").read_text(encoding="utf-8") == "wbs_outline 本文"
+
+    # 完了済みでも出力が消えていれば作り直す
+    (tmp_path / "out" / "project_charter.txt").unlink()
+    retry = _Flaky()
+    resume_documents(first.job_id, settings=settings, provider=retry)
+    assert retry.seen == ["project_charter"]
+
+
+def test_resume_reuses_start_settings_and_refuses_other_backend(tmp_path: Path, monkeypatch):
+    import pmbok_gpt.batch as batch
+
+    project = tmp_path / "p.json"
+    project.write_text(json.dumps({"name": "デモ", "objectives": ["品質向上"]}, ensure_ascii=False), encoding="utf-8")
+    started = AppSettings(use_stub=True, model="gpt-4o", max_tokens=900)
+    first = generate_documents(
+        project, tmp_path / "out", doc_types=["project_charter"], settings=started, provider=_Flaky("project_charter"), journal=True
+    )
+
+    # 別のバックエンドでは再開しない（途中から別のモデルの出力が混ざるため）
+    with pytest.raises(ValueError, match="provider"):
+        resume_documents(first.job_id, settings=AppSettings(use_stub=False, openai_api_key="sk-test"), provider=_Flaky())
+
+    # モデル・出力上限は開始時の値に戻して再開する
+    seen: List[AppSettings] = []
+    run_tasks = batch.run_tasks
+    monkeypatch.setattr(batch, "run_tasks", lambda *a, **kw: seen.append(kw["settings"]) or run_tasks(*a, **kw))
+    resume_documents(first.job_id, settings=AppSettings(use_stub=True, model="gpt-4.1", max_tokens=100), provider=_Flaky())
+    assert (seen[0].model, seen[0].max_tokens) == ("gpt-4o", 900)
+
+
+def test_write_output_is_atomic_and_keeps_mode(tmp_path: Path):
+    out = tmp_path / "doc.txt"
+    out.write_text("old", encoding="utf-8")
+    os.chmod(out, 0o640)
+    write_output(str(out), "new")
+    assert out.read_text(encoding="utf-8") == "new"
+    assert out.stat().st_mode & 0o777 == 0o640
+    assert [p.name for p in tmp_path.iterdir()] == ["doc.txt"]
@@ -0,0 +1,79 @@
+from __future__ import annotations
+
+from pathlib import Path
+from typing import Dict, List
+
+from pmbok_gpt.config import AppSettings
+from pmbok_gpt.generator import generate_text_document, stream_text_document
+from pmbok_gpt.metrics import InstrumentedProvider, load_records, percentile, rotated_path, summarize
+
+
+def test_generate_records_jsonl(tmp_path: Path):
+    metrics_path = tmp_path / "m.jsonl"
+    settings = AppSettings(use_stub=True, metrics_path=str(metrics_path))
+    generate_text_document("project_charter", {"name": "x"}, out_path=str(tmp_path / "a.txt"), settings=settings)
+    for _ in stream_text_document("wbs_outline", {"name": "x"}, out_path=str(tmp_path / "b.txt"), settings=settings):
+        pass
+    rows = load_records(str(metrics_path))
+    assert [(r["doc_type"], r["mode"], r["api"]) for r in rows] == [
+        ("project_charter", "generate", "stub"),
+        ("wbs_outline", "stream", "stub"),
+    ]
+    assert rows[1]["ttft"] is not None
+
+
+def test_metrics_persist_by_default_and_rotate(tmp_path: Path, monkeypatch):
+    monkeypatch.delenv("AICPM_METRICS_PATH")
+    # 既定で記録するため、通常の実行後に stats がそのまま使える
+    assert AppSettings().metrics_path == ".cache/pmbok_gpt/metrics.jsonl"
+
+    path = tmp_path / "m.jsonl"
+    settings = AppSettings(use_stub=True, metrics_path=str(path), metrics_max_bytes=2000)
+    for n in range(10):
+        generate_text_document("project_charter", {"name": "x"}, out_path=str(tmp_path / f"{n}.txt"), settings=settings)
+    # 上限を超えたら1世代前に退避し、現在のファイルは上限以下に保つ（stats は両方を読む）
+    assert path.stat().st_size <= 2000 and rotated_path(path).exists()
+    assert 0 < len(load_records(str(path))) < 10
+
+
+def test_stub_fallback_is_recorded(tmp_path: Path):
+    metrics_path = tmp_path / "m.jsonl"
+    settings = AppSettings(use_stub=True, metrics_path=str(metrics_path))
+
+    class _Empty:
+        def generate(self, messages: List[Dict[str, str]]) -> str:
+            return ""
+
+    provider = InstrumentedProvider(_Empty(), settings)
+    out = tmp_path / "c.txt"
+    generate_text_document("scope_statement", {}, out_path=str(out), settings=settings, provider=provider)
+    (row,) = load_records(str(metrics_path))
+    assert row["stub_fallback"] is True
+    assert row["branches"] == ["stub_fallback"]
+    assert "スタブ生成にフォールバック" in out.read_text(encoding="utf-8")
+
+
+def test_summarize_percentiles():
+    rows = [{"doc_type": "a", "model": "m", "latency": float(i), "prompt_tokens": 10, "completion_tokens": 5} for i in range(1, 21)]
+    (row,) = summarize(rows)
+    assert row["calls"] == 20
+    assert row["latency_p50"] == 10.0
+    assert row["latency_p95"] == 19.0
+    assert row["tokens_total"] == 300
+    assert percentile([], 50) is None
+
+
+def test_cached_tokens_from_prompt_cache(tmp_path: Path):
+    from pmbok_gpt.bench import SimulationProfile, Simulator, bench_settings, simulated_provider
+    from pmbok_gpt.providers import wrap_provider
+
+    settings = bench_settings(metrics_path=str(tmp_path / "m.jsonl"), capabilities_path=str(tmp_path / "c.json"))
+    sim = Simulator(SimulationProfile(ttft=0.0, per_token=0.0, output_tokens=8, jitter=0.0, prompt_cache_min_tokens=0))
+    provider = wrap_provider(simulated_provider(settings, sim), settings)
+    ctx = {"name": "x", "notes": "長い説明" * 1500}
+    for doc_type in ("project_charter", "wbs_outline"):
+        generate_text_document(doc_type, ctx, out_path=str(tmp_path / f"{doc_type}.txt"), settings=settings, provider=provider)
+    first, second = load_records(str(tmp_path / "m.jsonl"))
+    # 2件目はシステムプロンプト + プロジェクト情報の前置きがキャッシュに載る
+    assert first["cached_tokens"] == 0
+    assert second["cached_tokens"] > 0.8 * second["prompt_tokens"]
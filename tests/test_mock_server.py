@@ -0,0 +1,52 @@
+import json
+import urllib.error
+import urllib.request
+
+import pytest
+
+from pmbok_gpt.bench import SimulationProfile
+from pmbok_gpt.config import AppSettings
+from pmbok_gpt.mock_server import MockOpenAIServer
+from pmbok_gpt.providers import OpenAIProvider
+
+MESSAGES = [{"role": "system", "content": "sys"}, {"role": "user", "content": "hello"}]
+
+
+def _profile(**kw):
+    return SimulationProfile(ttft=0.01, per_token=0.0, output_tokens=40, jitter=0.0, time_scale=1.0, **kw)
+
+
+def test_provider_ladder_and_stream_over_http(tmp_path):
+    with MockOpenAIServer(profile=_profile()) as server:
+        settings = AppSettings(
+            use_stub=False,
+            openai_api_key="sk-mock",
+            openai_base_url=server.base_url,
+            model="o1-mini",
+            capabilities_path=str(tmp_path / "caps.json"),
+        )
+        provider = OpenAIProvider(settings)
+        text = provider.generate(MESSAGES)
+        streamed = "".join(provider.stream(MESSAGES))
+        stats = server.stats()
+    assert "シミュレーション出力" in text
+    assert streamed == text
+    # max_tokens / temperature / response_format の3段階を学習し、2回目は拒否されない
+    assert stats["rejections"] == 3
+    assert stats["streams"] == 1
+    # 同期クライアントの接続は使い回される
+    assert stats["connections"] == 1
+
+
+def test_rate_limit_returns_retry_after():
+    with MockOpenAIServer(profile=_profile(rate_limit_rate=1.0, retry_after=2.0)) as server:
+        req = urllib.request.Request(
+            f"{server.base_url}/chat/completions",
+            data=json.dumps({"model": "gpt-4o-mini", "messages": MESSAGES}).encode("utf-8"),
+            headers={"Content-Type": "application/json"},
+        )
+        with pytest.raises(urllib.error.HTTPError) as exc:
+            urllib.request.urlopen(req, timeout=5)
+    assert exc.value.code == 429
+    assert exc.value.headers["retry-after"] == "2"
+    assert json.loads(exc.value.read())["error"]["message"].startswith("Rate limit")
@@ -0,0 +1,69 @@
+from __future__ import annotations
+
+import json
+import os
+import time
+from pathlib import Path
+
+from pmbok_gpt.config import AppSettings
+from pmbok_gpt.metrics import load_records
+from pmbok_gpt.portfolio import generate_portfolio, run_shards, shard_projects, worker_settings
+
+
+def _write_project(path: Path, name: str, risks: int = 0) -> Path:
+    data = {"name": name, "objectives": ["品質向上"], "risks": [f"リスク{i}" for i in range(risks)]}
+    path.write_text(json.dumps(data, ensure_ascii=False), encoding="utf-8")
+    return path
+
+
+def test_shard_projects_balances_by_size(tmp_path: Path):
+    files = [_write_project(tmp_path / f"p{i}.json", f"P{i}", risks=n) for i, n in enumerate([40, 10, 10, 10, 10])]
+    shards = shard_projects(files, 2)
+    # 最大のファイルは単独、残りはもう一方にまとまる
+    assert sorted(len(s) for s in shards) == [1, 4]
+    assert shard_projects(files[:1], 8) == [[files[0]]]
+
+
+def test_worker_settings_split_rate_limits():
+    data = worker_settings(AppSettings(rate_limit_rpm=100, rate_limit_tpm=0, max_concurrency=16), 3)
+    assert (data["rate_limit_rpm"], data["rate_limit_tpm"], data["max_concurrency"]) == (33, 0, 6)
+    assert data["metrics_path"] == ""
+
+
+def test_generate_portfolio_across_processes(tmp_path: Path):
+    src = tmp_path / "projects"
+    src.mkdir()
+    for name in ("a", "b", "c"):
+        _write_project(src / f"{name}.json", name.upper())
+    settings = AppSettings(use_stub=True)
+    report = generate_portfolio(
+        src, tmp_path / "out", doc_types=["project_charter", "wbs_outline"], settings=settings, processes=2
+    )
+    assert report.summary()["failed"] == 0
+    # 結果は batch と同じ並び・出力配置
+    assert [(Path(r.out_path).parent.name, r.doc_type) for r in report.results] == [
+        (p, d) for p in "abc" for d in ("project_charter", "wbs_outline")
+    ]
+    assert all(Path(r.out_path).read_text(encoding="utf-8") for r in report.results)
+    # 子プロセスの計測は親で1つのファイルにまとめて書き出す
+    rows = load_records(settings.metrics_path)
+    assert len(rows) == 6 and {r["doc_type"] for r in rows} == {"project_charter", "wbs_outline"}
+
+
+def _crash_on_bad(job):
+    # 子プロセスで実行されるワーカ。"bad" のシャードはプロセスごと落ちる
+    if job["name"] == "bad":
+        os._exit(1)
+    time.sleep(0.2)
+    return {"records": [], "results": [{**t, "elapsed": 0.0, "ok": True, "error": None} for t in job["tasks"]]}
+
+
+def test_crashed_child_fails_only_its_own_shard():
+    jobs = [
+        {"name": name, "tasks": [{"project": name, "doc_type": "project_charter", "out_path": f"{name}.txt"}]}
+        for name in ("bad", "a", "b", "c")
+    ]
+    outcome = {job["name"]: out["results"][0] for job, out in run_shards(jobs, 2, _crash_on_bad)}
+    assert sorted(outcome) == ["a", "b", "bad", "c"]
+    assert [n for n, r in outcome.items() if not r["ok"]] == ["bad"]
+    assert "異常終了" in outcome["bad"]["error"]
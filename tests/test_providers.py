@@ -0,0 +1,191 @@
+from __future__ import annotations
+
+import asyncio
+from pathlib import Path
+from types import SimpleNamespace
+from typing import Any, Dict, List
+
+import pytest
+
+from pmbok_gpt.capabilities import get_registry
+from pmbok_gpt.config import AppSettings
+from pmbok_gpt.generator import agenerate_text_document, stream_text_document
+from pmbok_gpt.providers import OpenAIProvider, StubProvider
+
+
+def _chat_response(text: str) -> Any:
+    return SimpleNamespace(choices=[SimpleNamespace(message=SimpleNamespace(content=text))])
+
+
+class _FakeCompletions:
+    """max_tokens と temperature を拒否するモデルを模したフェイク。"""
+
+    def __init__(self) -> None:
+        self.calls: List[Dict[str, Any]] = []
+
+    def _check(self, params: Dict[str, Any]) -> Any:
+        self.calls.append(params)
+        if "max_tokens" in params:
+            raise RuntimeError("Unsupported parameter: 'max_tokens'. Use 'max_completion_tokens' instead.")
+        if "temperature" in params:
+            raise RuntimeError("Unsupported value: 'temperature'. Only the default (1) value is supported.")
+        return _chat_response("OK")
+
+    def create(self, **params: Any) -> Any:
+        return self._check(params)
+
+
+class _AsyncFakeCompletions(_FakeCompletions):
+    async def create(self, **params: Any) -> Any:  # type: ignore[override]
+        return self._check(params)
+
+
+def _provider(monkeypatch, tmp_path: Path) -> OpenAIProvider:
+    monkeypatch.setenv("OPENAI_API_KEY", "test-key")
+    monkeypatch.delenv("OPENAI_BASE_URL", raising=False)
+    settings = AppSettings(model="o-test", use_stub=False, capabilities_path=str(tmp_path / "caps.json"))
+    return OpenAIProvider(settings)
+
+
+def test_openai_parameter_fallback(monkeypatch, tmp_path: Path):
+    provider = _provider(monkeypatch, tmp_path)
+    fake = _FakeCompletions()
+    provider.client = SimpleNamespace(chat=SimpleNamespace(completions=fake))
+    assert provider.generate([{"role": "user", "content": "hi"}]) == "OK"
+    assert len(fake.calls) == 3
+    assert "max_completion_tokens" in fake.calls[-1]
+    assert "temperature" not in fake.calls[-1]
+
+
+def test_openai_agenerate_parameter_fallback(monkeypatch, tmp_path: Path):
+    provider = _provider(monkeypatch, tmp_path)
+    fake = _AsyncFakeCompletions()
+    provider._aclient = SimpleNamespace(chat=SimpleNamespace(completions=fake))
+    text = asyncio.run(provider.agenerate([{"role": "user", "content": "hi"}]))
+    assert text == "OK"
+    assert len(fake.calls) == 3
+
+
+def test_learned_capabilities_skip_retries(monkeypatch, tmp_path: Path):
+    first = _provider(monkeypatch, tmp_path)
+    first.client = SimpleNamespace(chat=SimpleNamespace(completions=_FakeCompletions()))
+    first.generate([{"role": "user", "content": "hi"}])
+
+    # 別インスタンス（=別プロセス相当）でも記録済みの形で1回目から成功する
+    second = _provider(monkeypatch, tmp_path)
+    fake = _FakeCompletions()
+    second.client = SimpleNamespace(chat=SimpleNamespace(completions=fake))
+    assert second.generate([{"role": "user", "content": "hi"}]) == "OK"
+    assert len(fake.calls) == 1
+
+    registry = get_registry(second.settings)
+    assert registry.get(second._capability_key())["preferred_api"] == "chat"
+    assert registry.reset() == 1
+
+
+def test_agenerate_text_document_stub(tmp_path: Path):
+    settings = AppSettings(use_stub=True)
+    out = tmp_path / "doc.txt"
+
+    async def _run() -> List[str]:
+        return await asyncio.gather(
+            *[
+                agenerate_text_document(
+                    "project_charter", {"name": "demo"}, out_path=str(out), settings=settings,
+                    provider=StubProvider(settings),
+                )
+                for _ in range(3)
+            ]
+        )
+
+    assert asyncio.run(_run()) == [str(out)] * 3
+    assert "スタブ出力" in out.read_text(encoding="utf-8")
+
+
+def test_openai_stream_chat_deltas(monkeypatch, tmp_path: Path):
+    provider = _provider(monkeypatch, tmp_path)
+
+    def _chunk(text: str) -> Any:
+        return SimpleNamespace(choices=[SimpleNamespace(delta=SimpleNamespace(content=text))])
+
+    class _StreamingCompletions(_FakeCompletions):
+        def create(self, **params: Any) -> Any:
+            self._check(params)
+            assert params["stream"] is True
+            return iter([_chunk("A"), _chunk(None), _chunk("B")])
+
+    provider.client = SimpleNamespace(chat=SimpleNamespace(completions=_StreamingCompletions()))
+    assert list(provider.stream([{"role": "user", "content": "hi"}])) == ["A", "B"]
+
+
+def test_stream_text_document_writes_incrementally(tmp_path: Path):
+    settings = AppSettings(use_stub=True)
+    out = tmp_path / "doc.txt"
+    sizes = []
+    deltas = []
+    for delta in stream_text_document("wbs_outline", {"name": "demo"}, out_path=str(out), settings=settings):
+        deltas.append(delta)
+        # 受信中は同じディレクトリの一時ファイルに追記し、out_path は最後まで受け取ってから置き換える
+        (tmp,) = tmp_path.glob(".*.txt.tmp")
+        sizes.append(tmp.stat().st_size)
+        assert not out.exists()
+    assert len(deltas) > 1
+    assert sizes == sorted(sizes) and sizes[0] < sizes[-1]
+    assert out.read_text(encoding="utf-8") == "".join(deltas)
+    assert list(tmp_path.iterdir()) == [out]
+
+
+def test_interrupted_stream_keeps_previous_output(tmp_path: Path):
+    class _Failing(StubProvider):
+        def stream(self, messages):
+            yield "書きかけ"
+            raise RuntimeError("connection reset")
+
+    settings = AppSettings(use_stub=True)
+    out = tmp_path / "doc.txt"
+    out.write_text("前回の出力", encoding="utf-8")
+    with pytest.raises(RuntimeError):
+        list(stream_text_document("wbs_outline", {"name": "demo"}, out_path=str(out), settings=settings, provider=_Failing(settings)))
+    # 途中で読むのをやめた場合（Ctrl+C 等）も同じ
+    stream = stream_text_document("wbs_outline", {"name": "demo"}, out_path=str(out), settings=settings)
+    next(stream)
+    stream.close()
+    assert out.read_text(encoding="utf-8") == "前回の出力"
+    assert list(tmp_path.iterdir()) == [out]
+
+
+class _FakeResponses:
+    """max_output_tokens 付きの呼び出しで error を送出し、外すと成功する Responses API のフェイク。"""
+
+    def __init__(self, error: Exception) -> None:
+        self.error = error
+        self.calls: List[Dict[str, Any]] = []
+
+    def create(self, **params: Any) -> Any:
+        self.calls.append(params)
+        if "max_output_tokens" in params:
+            raise self.error
+        return SimpleNamespace(output_text="R", usage=None)
+
+
+def test_responses_learns_only_real_max_output_tokens_rejection(monkeypatch, tmp_path: Path):
+    messages = [{"role": "user", "content": "hi"}]
+    for error in (TimeoutError("Request timed out."), RuntimeError("Error code: 503 - Service Unavailable")):
+        provider = _provider(monkeypatch, tmp_path)
+        provider.settings.use_responses_api = True
+        provider.settings.scheduler_enabled = False
+        fake = _FakeResponses(error)
+        provider.client = SimpleNamespace(responses=fake)
+        # タイムアウト・5xx は上限なしで再送せず、互換情報も書き換えない
+        with pytest.raises(type(error)):
+            provider.generate(messages)
+        assert len(fake.calls) == 1
+        assert "responses_max_output_tokens" not in get_registry(provider.settings).get(provider._capability_key())
+
+    provider = _provider(monkeypatch, tmp_path)
+    provider.settings.use_responses_api = True
+    provider.client = SimpleNamespace(
+        responses=_FakeResponses(RuntimeError("Unsupported parameter: 'max_output_tokens' is not supported with this model."))
+    )
+    assert provider.generate(messages) == "R"
+    assert get_registry(provider.settings).get(provider._capability_key())["responses_max_output_tokens"] is False
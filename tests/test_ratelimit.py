@@ -0,0 +1,121 @@
+import asyncio
+from types import SimpleNamespace
+
+import pytest
+
+from pmbok_gpt.bench import SimulationProfile
+from pmbok_gpt.config import AppSettings
+from pmbok_gpt.mock_server import MockOpenAIServer
+from pmbok_gpt.providers import OpenAIProvider
+from pmbok_gpt.ratelimit import RequestScheduler, TokenBucket, retry_after, retry_reason
+
+
+class _HTTPError(Exception):
+    def __init__(self, status, headers=None):
+        super().__init__(f"Error code: {status}")
+        self.status_code = status
+        self.response = SimpleNamespace(status_code=status, headers=headers or {})
+
+
+def _flaky(errors):
+    calls = {"n": 0}
+
+    def fn():
+        calls["n"] += 1
+        if errors:
+            raise errors.pop(0)
+        return "ok"
+
+    return fn, calls
+
+
+def test_retries_throttling_and_halves_concurrency():
+    scheduler = RequestScheduler(max_concurrency=8, base_delay=0.001, max_delay=0.05)
+    fn, calls = _flaky([_HTTPError(429, {"retry-after-ms": "10"}), _HTTPError(503)])
+    assert scheduler.call(fn) == "ok"
+    assert calls["n"] == 3
+    snap = scheduler.snapshot()
+    assert snap["retries"] == 2 and snap["throttled"] == 1
+    assert snap["limit"] < 8
+
+
+def test_non_retryable_errors_are_raised_immediately():
+    scheduler = RequestScheduler(base_delay=0.001)
+    fn, calls = _flaky([_HTTPError(400)])
+    with pytest.raises(_HTTPError):
+        scheduler.call(fn)
+    assert calls["n"] == 1
+    assert retry_reason(ValueError("x")) is None
+    assert retry_after(_HTTPError(429, {"retry-after": "2"})) == 2.0
+
+
+def test_async_call_gives_up_after_max_attempts():
+    scheduler = RequestScheduler(max_attempts=3, base_delay=0.001, max_delay=0.01)
+    calls = {"n": 0}
+
+    async def fn():
+        calls["n"] += 1
+        raise _HTTPError(500)
+
+    with pytest.raises(_HTTPError):
+        asyncio.run(scheduler.acall(fn))
+    assert calls["n"] == 3
+
+
+def test_token_bucket_paces_after_burst():
+    bucket = TokenBucket(60, burst_seconds=3)  # 1件/秒、3件までまとめて通す
+    assert [bucket.reserve(1) for _ in range(3)] == [0.0, 0.0, 0.0]
+    assert bucket.reserve(1) == pytest.approx(1.0, abs=0.05)
+
+
+def test_provider_recovers_from_429_over_http(tmp_path):
+    # seed=1 の最初の抽選は 0.13 → 1回目だけ 429 になる
+    profile = SimulationProfile(ttft=0.01, per_token=0.0, output_tokens=16, jitter=0.0, time_scale=1.0,
+                                rate_limit_rate=0.5, retry_after=0.05, seed=1)
+    with MockOpenAIServer(profile=profile) as server:
+        settings = AppSettings(
+            use_stub=False,
+            openai_api_key="sk-mock",
+            openai_base_url=server.base_url,
+            model="gpt-4o-mini",
+            capabilities_path=str(tmp_path / "caps.json"),
+            retry_base_delay=0.01,
+        )
+        text = OpenAIProvider(settings).generate([{"role": "user", "content": "hi"}])
+        stats = server.stats()
+    assert "シミュレーション出力" in text
+    assert stats["status_429"] == 1 and stats["status_200"] == 1
+
+
+def test_cancelled_calls_release_their_slot():
+    scheduler = RequestScheduler(max_concurrency=1)
+
+    async def _scenario():
+        release = asyncio.Event()
+
+        async def _blocked():
+            await release.wait()
+            return "never"
+
+        async def _ok():
+            return "ok"
+
+        # 上限の数だけキャンセルしても、後続の呼び出しは待ち続けない
+        for _ in range(3):
+            task = asyncio.ensure_future(scheduler.acall(_blocked))
+            await asyncio.sleep(0.01)
+            waiting = asyncio.ensure_future(scheduler.acall(_ok))
+            await asyncio.sleep(0.01)
+            assert not waiting.done()
+            task.cancel()
+            assert await asyncio.wait_for(waiting, 1.0) == "ok"
+
+    asyncio.run(_scenario())
+    assert scheduler.snapshot()["in_flight"] == 0
+
+    def _interrupted():
+        raise KeyboardInterrupt
+
+    with pytest.raises(KeyboardInterrupt):
+        scheduler.call(_interrupted)
+    assert scheduler.in_flight == 0
@@ -0,0 +1,79 @@
+from __future__ import annotations
+
+import json
+from pathlib import Path
+from typing import Any, Dict, List
+
+from openpyxl import load_workbook
+
+from pmbok_gpt.bench import SimulationProfile
+from pmbok_gpt.capabilities import get_registry
+from pmbok_gpt.config import AppSettings
+from pmbok_gpt.metrics import load_records
+from pmbok_gpt.mock_server import MockOpenAIServer
+from pmbok_gpt.providers import build_backend
+from pmbok_gpt.risks import RiskExpansionReport, expand_risks, write_risk_register
+
+
+class _JsonProvider:
+    """種の一覧から登録簿の行を JSON で返す。種 broken を含む 11件以上のチャンクは途中で途切れた JSON を返す。"""
+
+    def __init__(self, broken: int = 0, skip: int = 0) -> None:
+        self.broken, self.skip = broken, skip
+        self.chunks: List[List[int]] = []
+
+    def generate_json(self, messages: List[Dict[str, str]], schema: Dict[str, Any], *, name: str) -> str:
+        seeds = json.loads(messages[-1]["content"].rsplit("\n", 1)[1])["seeds"]
+        numbers = [s["seed"] for s in seeds]
+        self.chunks.append(numbers)
+        if self.broken in numbers and len(numbers) > 10:
+            return '{"risks": [{"seed": 1, "event": "途中で'
+        risks = [
+            {"seed": s["seed"], "event": f"{s['text']}（詳細）", "category": "技術", "cause": "原因", "impact": "4",
+             "probability": 9, "strategy": "軽減", "response": "対応", "owner": "PM", "trigger": "兆候", "extra": "x"}
+            for s in seeds if s["seed"] != self.skip
+        ]
+        return json.dumps({"risks": risks}, ensure_ascii=False)
+
+
+def test_expand_risks_batches_seeds_and_streams_rows():
+    settings = AppSettings(use_stub=True)
+    project = {"name": "デモ", "risk_seeds": [f"リスク{i}" for i in range(1, 201)]}
+    provider = _JsonProvider(broken=3, skip=150)
+    report = RiskExpansionReport()
+    rows = list(expand_risks(project, settings=settings, provider=provider, report=report))
+
+    # 200件を 20件ずつ。壊れたチャンクは 10件ずつに分けて呼び直す
+    assert report.calls == 12 and len(provider.chunks[0]) == 20
+    assert [r["event"] for r in rows[:2]] == ["リスク1（詳細）", "リスク2（詳細）"]
+    assert rows[0]["impact"] == 4 and rows[0]["probability"] == 5 and "extra" not in rows[0]
+    # 応答に含まれなかった種は文言だけの行になる
+    assert rows[149] == {"event": "リスク150", "seed": "リスク150", "status": "未評価"}
+    assert (report.rows, report.fallback_rows, report.errors) == (200, 1, [])
+
+    records = load_records(settings.metrics_path)
+    assert len(records) == 12 and {r["mode"] for r in records} == {"json"}
+    assert [r["ok"] for r in records].count(False) == 1
+
+
+def test_write_risk_register_with_stub(tmp_path: Path):
+    out = tmp_path / "risk.xlsx"
+    report = write_risk_register({"risk_seeds": ["遅延", {"event": "要員不足"}]}, str(out), settings=AppSettings(use_stub=True))
+    assert report.calls == 0 and report.rows == 2
+    rows = list(load_workbook(out).active.iter_rows(values_only=True))
+    assert [r[1] for r in rows[1:3]] == ["遅延", "要員不足"]
+    assert rows[1][4:6] == (3, 3)
+
+
+def test_generate_json_falls_back_to_plain_and_learns(tmp_path: Path):
+    profile = SimulationProfile(time_scale=0.0, output_tokens=10, reject_params=("response_format",))
+    with MockOpenAIServer(profile=profile) as server:
+        settings = AppSettings(openai_base_url=server.base_url, openai_api_key="sk-mock", use_stub=False)
+        provider = build_backend(settings)
+        messages = [{"role": "user", "content": "JSON で返してください"}]
+        assert provider.generate_json(messages, {"type": "object"})
+        # json_schema -> json_object -> 指定なし の順に試し、通った形式を記録する
+        assert server.stats()["rejections"] == 2
+        assert get_registry(settings).get(provider._capability_key())["json_format"] == "none"
+        provider.generate_json(messages, {"type": "object"})
+        assert server.stats()["rejections"] == 2
@@ -0,0 +1,101 @@
+from __future__ import annotations
+
+import asyncio
+import time
+from typing import Dict, List, Optional
+
+import pytest
+
+from pmbok_gpt import metrics
+from pmbok_gpt.config import AppSettings
+from pmbok_gpt.routing import RoutingProvider, observe_latency, route_key, secondary_settings
+
+MESSAGES = [{"role": "user", "content": "hello"}]
+
+
+class _Backend:
+    """delay 秒後に text を返す（error を指定すると送出）。usage として prompt_tokens=tokens を記録する。"""
+
+    def __init__(self, text: str = "", *, delay: float = 0.0, error: Optional[Exception] = None, tokens: int = 0):
+        self.text, self.delay, self.error, self.tokens = text, delay, error, tokens
+        self.calls = 0
+        self.cancelled = False
+
+    def _result(self) -> str:
+        metrics.note_usage({"prompt_tokens": self.tokens, "completion_tokens": 1})
+        if self.error is not None:
+            raise self.error
+        return self.text
+
+    def generate(self, messages: List[Dict[str, str]]) -> str:
+        self.calls += 1
+        time.sleep(self.delay)
+        return self._result()
+
+    async def agenerate(self, messages: List[Dict[str, str]]) -> str:
+        self.calls += 1
+        try:
+            await asyncio.sleep(self.delay)
+        except asyncio.CancelledError:
+            self.cancelled = True
+            raise
+        return self._result()
+
+
+def _router(primary: _Backend, secondary: _Backend, **overrides) -> metrics.InstrumentedProvider:
+    settings = AppSettings(openai_api_key="sk-test", secondary_model="backup-model", metrics_path="", **overrides)
+    router = RoutingProvider(primary, secondary, settings, secondary_settings(settings))
+    return metrics.InstrumentedProvider(router, settings)
+
+
+def test_failover_on_error_and_empty():
+    provider = _router(_Backend(error=RuntimeError("boom"), tokens=5), _Backend("B", tokens=7))
+    assert provider.generate(MESSAGES) == "B"
+    rec = provider.recorder.records[-1]
+    assert rec.branches == ["route:failover:error", "route:secondary"]
+    assert (rec.model, rec.prompt_tokens, rec.ok) == ("backup-model", 7, True)
+
+    # 両方が空なら空を返し（スタブへのフォールバックは generator 側）、両方エラーなら主のエラー
+    assert _router(_Backend(""), _Backend(" ")).generate(MESSAGES) == ""
+    with pytest.raises(RuntimeError, match="primary"):
+        _router(_Backend(error=RuntimeError("primary")), _Backend(error=RuntimeError("secondary"))).generate(MESSAGES)
+
+
+def test_async_hedge_takes_first_answer_and_cancels_the_other():
+    primary, secondary = _Backend("A", delay=1.0), _Backend("B", delay=0.01)
+    provider = _router(primary, secondary, hedge_enabled=True, hedge_delay=0.05)
+    started = time.perf_counter()
+    assert asyncio.run(provider.agenerate(MESSAGES)) == "B"
+    assert time.perf_counter() - started < 0.5
+    assert primary.cancelled
+    assert provider.recorder.records[-1].branches == ["route:hedge", "route:secondary"]
+
+    # 主が待ち時間内に返れば予備には送らない
+    fast = _Backend("A", delay=0.0)
+    idle = _Backend("B")
+    assert asyncio.run(_router(fast, idle, hedge_enabled=True, hedge_delay=0.5).agenerate(MESSAGES)) == "A"
+    assert idle.calls == 0
+
+
+def test_sync_hedge_and_observed_delay():
+    primary, secondary = _Backend("A", delay=0.5), _Backend("B")
+    provider = _router(primary, secondary, hedge_enabled=True, hedge_min_samples=3)
+    # hedge_delay=0 は直近の応答時間の p95。件数が足りないうちはヘッジしない
+    assert provider.inner.hedge_delay() is None
+    for seconds in (0.01, 0.02, 0.03):
+        observe_latency(route_key(provider.settings), seconds)
+    assert provider.inner.hedge_delay() == 0.03
+    started = time.perf_counter()
+    assert provider.generate(MESSAGES) == "B"
+    assert time.perf_counter() - started < 0.4
+
+
+def test_secondary_settings():
+    assert secondary_settings(AppSettings(openai_api_key="sk")) is None
+    both = AppSettings(
+        openai_api_key="sk", azure_openai_api_key="az", azure_openai_endpoint="https://x.openai.azure.com",
+        secondary_provider="openai",
+    )
+    assert both.provider_kind() == "azure" and secondary_settings(both).provider_kind() == "openai"
+    with pytest.raises(ValueError):
+        secondary_settings(AppSettings(openai_api_key="sk", secondary_provider="azure"))
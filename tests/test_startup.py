@@ -0,0 +1,57 @@
+from __future__ import annotations
+
+import os
+import subprocess
+import sys
+from pathlib import Path
+from typing import Dict, Tuple
+
+import pytest
+
+ROOT = Path(__file__).resolve().parents[1]
+
+# コマンドの起動時に読み込んでよいモジュールの累計時間（ミリ秒）。CI の遅いマシンでも通る程度の余裕を持たせる
+BUDGET_MS = {"list": 250, "diag": 500}
+# 軽いコマンドでは読み込まないモジュール
+HEAVY = ["openpyxl", "openai", "httpx", "pandas", "pmbok_gpt.generator", "pmbok_gpt.providers", "pmbok_gpt.excel", "rich.table"]
+
+
+def _import_times(command: str, tmp_path: Path) -> Tuple[Dict[str, int], int]:
+    """python -X importtime でコマンドを実行し、(モジュール -> 累計μs, pmbok_gpt 以降のトップレベルの累計μs) を返す。"""
+    env = {**os.environ, "PYTHONPATH": str(ROOT), "AICPM_USE_STUB": "true"}
+    proc = subprocess.run(
+        [sys.executable, "-X", "importtime", "-m", "pmbok_gpt", command],
+        cwd=tmp_path, env=env, capture_output=True, text=True, timeout=60,
+    )
+    assert proc.returncode == 0, proc.stderr[-2000:]
+    modules: Dict[str, int] = {}
+    total = 0
+    started = False
+    for line in proc.stderr.splitlines():
+        if not line.startswith("import time:") or "|" not in line:
+            continue
+        _, cumulative, name = line.split("|")
+        if not cumulative.strip().isdigit():
+            continue
+        modules[name.strip()] = int(cumulative)
+        # インタプリタ自体の起動（site 等）は除き、パッケージの読み込み以降だけを数える
+        started = started or name.strip() == "pmbok_gpt"
+        if started and not name.startswith("  "):
+            total += int(cumulative)
+    return modules, total
+
+
+@pytest.mark.parametrize("command", ["list", "diag"])
+def test_light_commands_import_only_what_they_need(command: str, tmp_path: Path):
+    modules, total = _import_times(command, tmp_path)
+    assert [m for m in HEAVY if m in modules] == []
+    if command == "list":
+        # 一覧の表示には設定（pydantic-settings・.env の読み込み）も不要
+        assert "pmbok_gpt.config" not in modules and "pydantic_settings" not in modules
+    assert total / 1000 < BUDGET_MS[command], f"{command}: {total / 1000:.0f}ms"
+
+
+def test_package_import_does_not_load_cli():
+    code = "import sys, pmbok_gpt.templates; print('typer' in sys.modules, 'pmbok_gpt.cli' in sys.modules)"
+    out = subprocess.run([sys.executable, "-c", code], cwd=ROOT, capture_output=True, text=True, check=True).stdout
+    assert out.split() == ["False", "False"]
@@ -0,0 +1,88 @@
+from __future__ import annotations
+
+import asyncio
+import json
+from pathlib import Path
+from typing import Dict, List
+
+from pmbok_gpt.config import AppSettings
+from pmbok_gpt.templates import DOC_TEMPLATES
+from pmbok_gpt.watch import ProjectWatcher
+
+
+class _SlowAsync:
+    """プロジェクト名を本文として返す（生成に delay 秒かかる）。"""
+
+    def __init__(self, delay: float) -> None:
+        self.delay = delay
+        self.calls = 0
+
+    async def agenerate(self, messages: List[Dict[str, str]]) -> str:
+        self.calls += 1
+        await asyncio.sleep(self.delay)
+        return json.loads(messages[1]["content"].split("\n", 2)[2])["name"]
+
+
+def _write(path: Path, name: str) -> None:
+    path.write_text(json.dumps({"name": name, "objectives": ["品質向上"]}, ensure_ascii=False), encoding="utf-8")
+
+
+def test_newer_edit_cancels_in_flight_generation(tmp_path: Path):
+    project = tmp_path / "p.json"
+    _write(project, "v1")
+    out = tmp_path / "out"
+    provider = _SlowAsync(0.2)
+    watcher = ProjectWatcher(
+        [project], out, doc_types=["project_charter", "scope_statement"],
+        settings=AppSettings(use_stub=True), provider=provider, max_workers=1,
+    )
+
+    async def _scenario() -> None:
+        watcher.sync()
+        await asyncio.sleep(0.05)
+        _write(project, "v2")
+        watcher.sync([project])
+        await watcher.wait_idle()
+
+    asyncio.run(_scenario())
+    assert watcher.stats["cancelled"] == 2
+    assert watcher.stats["generated"] == 2
+    assert (out / "project_charter.txt").read_text(encoding="utf-8").strip() == "v2"
+
+    # 入力が変わっていなければ何も生成しない
+    async def _again() -> None:
+        watcher.sync()
+        await watcher.wait_idle()
+
+    asyncio.run(_again())
+    # v1 は1件が生成中、もう1件は順番待ちのままキャンセルされたので呼び出しは 1 + 2 回
+    assert provider.calls == 3 and watcher.stats["generated"] == 2
+
+
+def test_run_debounces_and_reloads_template_overrides(tmp_path: Path):
+    project = tmp_path / "p.json"
+    _write(project, "A")
+    templates = tmp_path / "templates.json"
+    out = tmp_path / "out"
+    events: List[str] = []
+    watcher = ProjectWatcher(
+        [project], out, templates=templates, doc_types=["project_charter", "wbs_outline"],
+        settings=AppSettings(use_stub=True), provider=_SlowAsync(0.0), debounce=0.05, interval=0.01,
+        on_event=lambda kind, label, detail: events.append(f"{kind}:{label}"),
+    )
+
+    async def _scenario() -> None:
+        stop = asyncio.Event()
+        runner = asyncio.create_task(watcher.run(stop))
+        await asyncio.sleep(0.1)
+        templates.write_text(json.dumps({"wbs_outline": {"sections": ["成果物", "作業"]}}, ensure_ascii=False), encoding="utf-8")
+        await asyncio.sleep(0.3)
+        stop.set()
+        await runner
+
+    asyncio.run(_scenario())
+    assert watcher.template_set.templates["wbs_outline"]["sections"] == ["成果物", "作業"]
+    # 上書きはこの監視の中だけ（組み込みのテンプレートは変わらない）
+    assert DOC_TEMPLATES["wbs_outline"]["sections"] != ["成果物", "作業"]
+    assert events.count("ok:p/wbs_outline") == 2
+    assert events.count("ok:p/project_charter") == 1